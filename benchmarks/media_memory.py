@@ -0,0 +1,82 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the memory held by the medias of a large inbox, as they are kept by
+calbum.cmd until the inbox is processed.
+
+    python benchmarks/media_memory.py [count]
+"""
+
+from datetime import datetime, timedelta
+import gc
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calbum.sources.image import JpegPicture
+
+
+class DirEntry(object):
+    """A directory entry of the inbox (see os.scandir)."""
+
+    def stat(self):
+        return os.stat(__file__)
+
+
+def max_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(count, discard):
+    gc.collect()
+    before = max_rss()
+    medias = []
+    for i in range(count):
+        media = JpegPicture(
+            '/data/inbox/2015/Camera/IMG_{:08d}.jpg'.format(i), DirEntry())
+        media.stat()
+        # Like the tags read by exifread, most of them aren't timestamps
+        media._exif = dict(
+            ('EXIF Tag{}'.format(tag), '2015:01:01 00:00:{:02d}'.format(tag))
+            for tag in range(40))
+        media._timestamp = datetime(2015, 1, 1) + timedelta(seconds=i)
+        if discard:
+            media.discard_metadata()
+        medias.append(media)
+    gc.collect()
+    return (max_rss() - before) / float(count)
+
+
+def main(args=sys.argv[1:]):
+    count = int(args[0]) if args else 1000000
+    if len(args) > 1:
+        discard = args[1] == 'discard'
+        print('{:>20}: {:8.1f} bytes per media'.format(
+            'tags discarded' if discard else 'tags kept',
+            measure(count, discard)))
+        return
+    # Each measure runs in its own process for the maximum resident set size
+    # not to include the memory of the other one.
+    for mode in ('discard', 'keep'):
+        subprocess.check_call(
+            [sys.executable, os.path.abspath(__file__), str(count), mode])
+
+
+if __name__ == '__main__':
+    main()
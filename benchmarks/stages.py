@@ -0,0 +1,184 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the stages of calbum on synthetic inboxes and calendars (see
+benchmarks/synthetic.py) and write the results as JSON, to compare runs.
+
+    python benchmarks/stages.py [--sizes 1000 100000 1000000]
+                                [--events 1000] [--jobs 1] [--seed 0]
+                                [--output stages.json]
+
+The stages are timed separately: scanning the inbox, extracting the
+timestamps, loading the calendar, matching the events, moving the medias
+to the timeline and linking them to the albums.  exiftool is replaced by
+benchmarks/exiftool.
+"""
+
+import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_path))
+
+from calbum import cmd  # Configures the media factory of the inboxes
+from calbum.core import model, pipeline
+from calbum.filters.album import CalendarAlbumFilter
+from calbum.filters.timeline import TimelineFilter
+from calbum.sources import exiftool
+from calbum.sources.calendar import CalendarEvent
+
+import synthetic
+
+
+@contextmanager
+def timed(stages, name, files):
+    start = time.time()
+    yield
+    seconds = time.time() - start
+    stages[name] = OrderedDict([
+        ('seconds', round(seconds, 6)),
+        ('files_per_second', round(files / seconds, 1) if seconds else None),
+    ])
+
+
+def run(path, files, events, jobs, seed):
+    """
+    Generate an inbox and a calendar in a directory, then time the stages
+    of calbum on them.
+    :rtype: dict
+    """
+    inbox = os.path.join(path, 'inbox')
+    feed = os.path.join(path, 'calendar.ics')
+    start = time.time()
+    kinds = synthetic.make_inbox(inbox, files, seed)
+    synthetic.make_calendar(feed, events, seed)
+    generated = time.time() - start
+
+    exiftool.exiftool_path = os.path.join(benchmarks_path, 'exiftool')
+    exiftool.ExifToolMedia.pool.size = max(jobs, 1)
+    model.FileSystemElement.destination_index = model.DestinationIndex()
+    model.FileSystemElement.file_operations = model.FileOperations(
+        model.DirectoryCache())
+    stages = OrderedDict()
+    try:
+        with timed(stages, 'scan', files):
+            medias = list(model.MediaCollection(inbox))
+
+        with timed(stages, 'timestamps', files):
+            for media in pipeline.resolve_timestamps(medias, jobs):
+                media.timestamp()
+
+        with timed(stages, 'calendar', files):
+            with open(feed) as f:
+                calendar_events = CalendarEvent.load_from_stream(f)
+
+        album_filter = CalendarAlbumFilter(
+            albums_path=os.path.join(path, 'album'),
+            events=calendar_events,
+            save_events=False)
+        matches = 0
+        with timed(stages, 'events', files):
+            index = album_filter.index()
+            for media in medias:
+                matches += sum(1 for _ in index.events_at(media.timestamp()))
+
+        timeline_filter = TimelineFilter(os.path.join(path, 'timeline'))
+        with timed(stages, 'move', files):
+            for media in medias:
+                timeline_filter.move(media)
+
+        with timed(stages, 'link', files):
+            for media in medias:
+                album_filter.link(media)
+    finally:
+        exiftool.ExifToolMedia.pool.close()
+        model.FileSystemElement.destination_index = None
+        model.FileSystemElement.file_operations = model.FileOperations()
+
+    return OrderedDict([
+        ('files', files),
+        ('kinds', kinds),
+        ('events', events),
+        ('matches', matches),
+        ('jobs', jobs),
+        ('generate_seconds', round(generated, 6)),
+        ('stages', stages),
+    ])
+
+
+def revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'describe', '--always', '--dirty'],
+                cwd=benchmarks_path, stderr=devnull).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000],
+                        help='The numbers of files of the inboxes.')
+    parser.add_argument('--events', type=int, default=1000,
+                        help='The number of events of the calendar.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='The number of timestamps resolved '
+                             'concurrently.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the synthetic inboxes and '
+                             'calendars.')
+    parser.add_argument('--output', default='stages.json',
+                        help='The JSON file of the results.')
+    settings = parser.parse_args(args)
+
+    results = OrderedDict([
+        ('revision', revision()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('date', datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+        ('seed', settings.seed),
+        ('runs', []),
+    ])
+    for files in settings.sizes:
+        path = tempfile.mkdtemp(prefix='calbum-benchmark-')
+        try:
+            result = run(path, files, settings.events, settings.jobs,
+                         settings.seed)
+        finally:
+            shutil.rmtree(path)
+        results['runs'].append(result)
+        for name, stage in result['stages'].items():
+            print('{:>9} files {:>12}: {:10.3f}s {:>12} files/s'.format(
+                files, name, stage['seconds'], stage['files_per_second']))
+
+    with open(settings.output, 'w') as f:
+        json.dump(results, f, indent=2, separators=(',', ': '))
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
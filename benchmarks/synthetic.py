@@ -0,0 +1,206 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generate synthetic inboxes and calendars, the same ones for the same seed.
+
+    python benchmarks/synthetic.py inbox path count [seed]
+    python benchmarks/synthetic.py calendar path count [seed]
+
+The inboxes hold small files with only the headers read by calbum:
+  - JPEG pictures with an Exif DateTimeOriginal
+  - TIFF pictures with an Exif DateTimeOriginal
+  - MP4 videos with a movie header (mvhd)
+  - damaged QuickTime videos, only read by exiftool (see
+    benchmarks/exiftool)
+  - JPEG pictures without Exif, timestamped by their name
+  - copies of other files, to be found as duplicates
+"""
+
+from datetime import datetime, timedelta
+import os
+import random
+import struct
+import sys
+
+# The first and last timestamps of the generated files and events
+start = datetime(2010, 1, 1)
+end = datetime(2016, 1, 1)
+
+# Number of files in each directory of the inbox
+files_per_directory = 1000
+
+# Share of each kind of file in the inboxes
+kinds = (
+    ('jpeg', 0.60),
+    ('tiff', 0.05),
+    ('mp4', 0.15),
+    ('damaged', 0.03),
+    ('named', 0.15),
+    ('copy', 0.02),
+)
+
+# Share of the recurring events in the calendars
+recurring_events = 0.2
+
+# Times of the movie headers are seconds since this date
+iso_epoch = datetime(1904, 1, 1)
+
+
+def tiff(timestamp):
+    """
+    Return a little-endian TIFF header with an Exif IFD holding the
+    DateTimeOriginal of a timestamp.
+    :rtype: str
+    """
+    date = timestamp.strftime('%Y:%m:%d %H:%M:%S').encode('ascii') + b'\0'
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, 26) + \
+        struct.pack('<I', 0)
+    exif = struct.pack('<H', 1) + \
+        struct.pack('<HHII', 0x9003, 2, len(date), 44) + struct.pack('<I', 0)
+    return b'II*\0' + struct.pack('<I', 8) + ifd0 + exif + date
+
+
+def jpeg(timestamp=None):
+    """
+    Return a JPEG file with the Exif DateTimeOriginal of a timestamp, or
+    without Exif.
+    :rtype: str
+    """
+    if timestamp is None:
+        return b'\xff\xd8\xff\xd9'
+    payload = b'Exif\0\0' + tiff(timestamp)
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(payload) + 2) + \
+        payload + b'\xff\xd9'
+
+
+def box(box_type, payload):
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+def mp4(timestamp, leading_box=b'ftyp'):
+    """
+    Return an MP4 file whose movie header was created at a timestamp.
+    :param leading_box: the type of the first box, the file is damaged if it
+                        isn't one of isobmff.leading_boxes
+    :rtype: str
+    """
+    seconds = int((timestamp - iso_epoch).total_seconds())
+    mvhd = struct.pack('>IIIII', 0, seconds, seconds, 1000, 0) + \
+        b'\0' * 80
+    return box(leading_box, b'isom' + struct.pack('>I', 512) + b'isommp41') \
+        + box(b'moov', box(b'mvhd', mvhd))
+
+
+def random_timestamp(rand):
+    return start + timedelta(seconds=rand.randint(
+        0, int((end - start).total_seconds())))
+
+
+def make_inbox(path, count, seed=0):
+    """
+    Create an inbox of synthetic media files.
+    :param path: the path of the inbox
+    :param count: the number of files
+    :param seed: the seed of the random generator
+    :return: the number of files of each kind
+    :rtype: dict
+    """
+    rand = random.Random(seed)
+    created = dict((kind, 0) for kind, _ in kinds)
+    previous = None
+    for i in range(count):
+        directory = os.path.join(
+            path, 'DCIM', '{:03d}CAMERA'.format(i // files_per_directory))
+        if i % files_per_directory == 0:
+            os.makedirs(directory)
+        kind = pick(rand, kinds)
+        if kind == 'copy' and previous is None:
+            kind = 'jpeg'
+        timestamp = random_timestamp(rand)
+        if kind == 'jpeg':
+            name, content = 'IMG_{:07d}.jpg'.format(i), jpeg(timestamp)
+        elif kind == 'tiff':
+            name, content = 'IMG_{:07d}.tif'.format(i), tiff(timestamp)
+        elif kind == 'mp4':
+            name, content = 'VID_{:07d}.mp4'.format(i), mp4(timestamp)
+        elif kind == 'damaged':
+            name = 'MOV_{:07d}.mov'.format(i)
+            content = mp4(timestamp, leading_box=b'junk')
+        elif kind == 'named':
+            name = timestamp.strftime('IMG_%Y%m%d_%H%M%S_{:07d}.jpg').format(i)
+            content = jpeg()
+        else:
+            name = 'COPY_{:07d}{}'.format(i, os.path.splitext(previous[0])[1])
+            content = previous[1]
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+        if kind != 'copy':
+            previous = name, content
+        created[kind] += 1
+    return created
+
+
+def make_calendar(path, count, seed=0):
+    """
+    Create an ical feed of one-off and recurring events.
+    :param path: the path of the feed
+    :param count: the number of events
+    :param seed: the seed of the random generator
+    """
+    rand = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'
+                'PRODID:-//calbum//benchmarks//EN\r\n')
+        for i in range(count):
+            timestamp = random_timestamp(rand)
+            f.write('BEGIN:VEVENT\r\nUID:event-{}@calbum\r\n'
+                    'SUMMARY:Event {}\r\n'.format(i, i))
+            if rand.random() < recurring_events:
+                f.write('DTSTART:{:%Y%m%dT%H%M%SZ}\r\n'
+                        'DTEND:{:%Y%m%dT%H%M%SZ}\r\n'.format(
+                            timestamp, timestamp + timedelta(hours=2)))
+                if rand.random() < 0.5:
+                    f.write('RRULE:FREQ=WEEKLY;COUNT=52\r\n')
+                else:
+                    f.write('RRULE:FREQ=YEARLY\r\n')
+            else:
+                f.write('DTSTART;VALUE=DATE:{:%Y%m%d}\r\n'
+                        'DTEND;VALUE=DATE:{:%Y%m%d}\r\n'.format(
+                            timestamp,
+                            timestamp + timedelta(days=rand.randint(1, 4))))
+            f.write('END:VEVENT\r\n')
+        f.write('END:VCALENDAR\r\n')
+
+
+def pick(rand, shares):
+    value = rand.random()
+    for name, share in shares:
+        value -= share
+        if value < 0:
+            return name
+    return shares[-1][0]
+
+
+def main(args=sys.argv[1:]):
+    what, path, count = args[:3]
+    seed = int(args[3]) if len(args) > 3 else 0
+    if what == 'inbox':
+        print(make_inbox(path, int(count), seed))
+    else:
+        make_calendar(path, int(count), seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,22 +13,47 @@
 # limitations under the License.
 
 import argparse
+import cProfile
+import logging
+import os
 import sys
+from dateutil.parser import parse as parse_date
 from dateutil.tz import gettz
 
 from progress.bar import ChargingBar
 
-from calbum.core import model
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 without the pytracemalloc backport
+    tracemalloc = None
+
+from calbum.core import cache, journal, model, pipeline, plan, stats, watch
 from calbum.filters import timeline, album, NoopMediaFilter
-from calbum.sources import image, calendar, exiftool
+from calbum.sources import image, calendar, exiftool, isobmff
 
 model.MediaCollection.media_factory = model.MediaFactory(
     image.JpegPicture,
+    image.CanonRawPicture,
     image.TiffPicture,
-    exiftool.VideoMP4Media,
-    exiftool.Video3GPMedia,
+    image.NikonRawPicture,
+    image.SonyRawPicture,
+    image.DigitalNegativePicture,
+    isobmff.VideoMP4Media,
+    isobmff.Video3GPMedia,
+    isobmff.VideoMOVMedia,
+    isobmff.VideoM4VMedia,
+    isobmff.HeicPicture,
 )
 
+# Number of media files found ahead of the one being processed when the
+# inbox is streamed.
+stream_lookahead = 1000
+
+# Number of media files planned and executed together when the file
+# operations are journaled.
+journal_plan_size = 1000
+
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser(
         prog='calbum',
@@ -62,11 +87,16 @@ def main(args=sys.argv[1:]):
                         default='./album')
 
     parser.add_argument('--calendar',
-                        help='The url of the album calendar. (ical)',
-                        metavar='url')
+                        help='The url of an album calendar (ical) and the '
+                             'path of its albums (default: the --album '
+                             'path). Can be repeated.',
+                        metavar=('url', 'path'),
+                        nargs='+',
+                        action='append')
 
     parser.add_argument('--date-format',
-                        help='The format to use for timestamps.',
+                        help='The format to use for timestamps (strftime '
+                             'and %%N for milliseconds).',
                         metavar='format',
                         default=model.TimeLine.media_path_format)
 
@@ -78,31 +108,369 @@ def main(args=sys.argv[1:]):
                         metavar='tz',
                         help='Pictures timezone (default to local time).')
 
+    parser.add_argument('--jobs',
+                        help='The number of media files whose metadata is '
+                             'read concurrently. (default: 1)',
+                        metavar='count',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--metadata-cache',
+                        help='Keep the metadata of the media files in a '
+                             'cache under the timeline directory.',
+                        action='store_true')
+
+    parser.add_argument('--prune-metadata-cache',
+                        help='Remove the entries of missing or modified '
+                             'files from the metadata cache.',
+                        action='store_true')
+
+    parser.add_argument('--skip-duplicates',
+                        help='Leave out the media files whose content is '
+                             'already anywhere in the timeline; moved '
+                             'duplicates are removed from the inbox. The '
+                             'index of the timeline is then kept up to date '
+                             'by every run.',
+                        action='store_true')
+
+    parser.add_argument('--stream',
+                        help='Process the media files while the inbox '
+                             'directory is being scanned.',
+                        action='store_true')
+
+    parser.add_argument('--skip-hidden',
+                        help='Ignore the hidden files and directories of '
+                             'the inbox.',
+                        action='store_true')
+
+    parser.add_argument('--skip-system',
+                        help='Ignore the directories created by operating '
+                             'systems and NAS in the inbox (@eaDir, '
+                             '.thumbnails, ...).',
+                        action='store_true')
+
+    parser.add_argument('--sniff',
+                        help='Identify the media files without a known '
+                             'extension from their content.',
+                        action='store_true')
+
+    parser.add_argument('--plan',
+                        help='Find where every media file goes before '
+                             'moving or linking any of them.',
+                        action='store_true')
+
+    parser.add_argument('--dry-run',
+                        help='Find where every media file goes without '
+                             'moving or linking any of them and write the '
+                             'plan as JSON in a file (default: the standard '
+                             'output).',
+                        metavar='file',
+                        nargs='?',
+                        const='-')
+
+    parser.add_argument('--journal',
+                        help='Keep a journal of the moves and links under '
+                             'the timeline directory to resume an '
+                             'interrupted run.  The media files are planned '
+                             '(see --plan) and processed in batches.',
+                        action='store_true')
+
+    parser.add_argument('--watch',
+                        help='Keep running and process the files added to '
+                             'the inbox (Linux only).',
+                        action='store_true')
+
+    parser.add_argument('--calendar-cache',
+                        help='Keep the calendar events in a cache under the '
+                             'timeline directory and download them again '
+                             'only when they change.',
+                        action='store_true')
+
+    parser.add_argument('--calendar-timeout',
+                        help='The maximum number of seconds to wait for the '
+                             'calendar server.',
+                        metavar='seconds',
+                        type=float)
+
+    parser.add_argument('--events-since',
+                        help='Ignore the calendar events that ended before '
+                             'this date, unless they recur.',
+                        metavar='date',
+                        type=parse_date)
+
+    parser.add_argument('--stats',
+                        help='Print the time spent in each stage and what '
+                             'they did at the end of the run, and write '
+                             'them as JSON in a file (default: '
+                             '.calbum/stats.json under the timeline '
+                             'directory).',
+                        metavar='file',
+                        nargs='?',
+                        const='')
+
+    parser.add_argument('--profile',
+                        help='Profile the run with cProfile and write the '
+                             'statistics in a file (see pstats).',
+                        metavar='file')
+
+    parser.add_argument('--trace-memory',
+                        help='Trace the memory allocations of the run with '
+                             'tracemalloc and write the largest ones in a '
+                             'file.',
+                        metavar='file')
+
     settings = vars(parser.parse_args(args))
+    for values in settings['calendar'] or []:
+        if len(values) > 2:
+            parser.error('argument --calendar: expected a url and an '
+                         'optional path')
+    if settings['dry_run'] and settings['watch']:
+        parser.error('argument --dry-run: not allowed with argument --watch')
+    if settings['trace_memory'] and tracemalloc is None:
+        parser.error('argument --trace-memory: tracemalloc is not installed')
+
+    run_stats = None
+    if settings['stats'] is not None:
+        run_stats = stats.Stats()
+        stats.current = run_stats
+    profiler = None
+    if settings['profile']:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if settings['trace_memory']:
+        tracemalloc.start()
+    try:
+        with stats.timer('total'):
+            process(settings)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(settings['profile'])
+        if settings['trace_memory']:
+            write_memory_trace(settings['trace_memory'])
+            tracemalloc.stop()
+        if run_stats is not None:
+            stats.current = None
+            write_stats(run_stats, settings['stats'] or os.path.join(
+                settings['timeline'], '.calbum', 'stats.json'))
 
+
+def process(settings):
+    """
+    Process the inbox with the settings of the command line.
+    """
     # Configure data model
     model.TimeLine.media_path_format = settings['date_format']
     model.Media.time_zone = gettz(settings['time_zone'])
+    exiftool.ExifToolMedia.pool.size = max(settings['jobs'], 1)
+    model.MediaCollection.exclude_hidden = settings['skip_hidden']
+    model.MediaCollection.media_factory.sniff = settings['sniff']
+    if settings['skip_system']:
+        model.MediaCollection.excluded_dirs = model.system_dirs
+    model.FileSystemElement.destination_index = model.DestinationIndex()
+    model.FileOperations.kept_directories = set(
+        [os.path.abspath(settings['inbox'])])
+    directories = model.DirectoryCache()
+    model.FileSystemElement.file_operations = model.FileOperations(
+        directories)
+    if settings['metadata_cache'] or settings['prune_metadata_cache']:
+        model.Media.metadata_cache = cache.MetadataCache(
+            database_path(settings, 'metadata.db'))
+    run_journal = None
+    if settings['journal'] and not settings['dry_run']:
+        run_journal = journal.Journal(
+            os.path.join(settings['timeline'], '.calbum', 'journal'))
+        resumed = run_journal.recover()
+        if resumed:
+            logging.info('%d operations of an interrupted run resumed',
+                         resumed)
+    file_plan = None
+    if settings['plan'] or settings['dry_run'] or run_journal is not None:
+        file_plan = plan.Plan(directories)
+        model.FileSystemElement.file_operations = file_plan
 
     # Create filters
-    timeline_filter = timeline.TimelineFilter(settings['timeline'])
+    # An existing index is updated by every run, for the duplicates to be
+    # found among the medias added without --skip-duplicates
+    library = None
+    if settings['skip_duplicates'] or (
+            not settings['dry_run'] and os.path.exists(
+                database_path(settings, 'library.db'))):
+        library = cache.LibraryIndex(
+            database_path(settings, 'library.db'), root=settings['timeline'])
+        if not len(library):
+            library.add_collection(model.TimeLine(settings['timeline']))
+    timeline_filter = timeline.TimelineFilter(
+        settings['timeline'], library,
+        skip_duplicates=settings['skip_duplicates'])
     album_filter = NoopMediaFilter()
     if settings['calendar']:
-        events = calendar.CalendarEvent.load_from_url(url=settings['calendar'])
+        calendar_cache = None
+        if settings['calendar_cache']:
+            calendar_cache = calendar.CalendarCache(
+                os.path.join(settings['timeline'], '.calbum', 'calendars'),
+                read_only=bool(settings['dry_run']))
+        window = None
+        if settings['events_since']:
+            window = (settings['events_since'], None)
+        with stats.timer('calendars'):
+            calendars = calendar.CalendarEvent.load_from_urls(
+                urls=[values[0] for values in settings['calendar']],
+                cache=calendar_cache,
+                timeout=settings['calendar_timeout'],
+                window=window)
         album_filter = album.CalendarAlbumFilter(
             albums_path=settings['album'],
-            events=events,
+            events=[],
             save_events=settings['save_events']
         )
+        for values, events in zip(settings['calendar'], calendars):
+            album_filter.add_events(events, *values[1:])
 
     filter_actions = [
         timeline_filter.link if settings['link_only'] else timeline_filter.move,
         album_filter.link
     ]
 
+    # Watch the inbox before scanning it to not miss new files
+    watcher = None
+    if settings['watch']:
+        watcher = watch.InboxWatcher(
+            settings['inbox'],
+            excluded_dirs=model.MediaCollection.excluded_dirs,
+            exclude_hidden=model.MediaCollection.exclude_hidden)
+        # The watches are lost with the directories
+        model.FileOperations.kept_directories = watcher
+
     # Perform actions
     suffix = '%(index)d/%(max)d [eta: %(eta)ds]'
     bar = ChargingBar('Processing inbox:', suffix=suffix)
-    for picture in bar.iter(list(model.MediaCollection(settings['inbox']))):
+    inbox = model.MediaCollection(settings['inbox'])
+    if run_journal is not None:
+        inbox = (media for media in inbox
+                 if not run_journal.is_done(media.path()))
+    if settings['stream']:
+        medias = pipeline.Lookahead(inbox, size=stream_lookahead)
+    else:
+        medias = list(inbox)
+    count = 0
+    try:
+        with bar:
+            for picture in pipeline.resolve_timestamps(
+                    medias, settings['jobs']):
+                for action in filter_actions:
+                    action(picture)
+                count += 1
+                bar.max = max(len(medias), count)
+                bar.next()
+                if run_journal is not None and \
+                        count % journal_plan_size == 0:
+                    run_journal.execute(file_plan)
+                    file_plan = plan.Plan(directories)
+                    model.FileSystemElement.file_operations = file_plan
+        logging.info('%d timestamps resolved for %d media files',
+                     model.Media.resolved_timestamps, count)
+        if file_plan is not None:
+            model.FileSystemElement.file_operations = model.FileOperations(
+                directories)
+            if settings['dry_run']:
+                write_plan(file_plan, settings['dry_run'])
+                return
+            if run_journal is not None:
+                run_journal.execute(file_plan)
+                run_journal.clear()
+            else:
+                execute_plan(file_plan)
+        if settings['prune_metadata_cache']:
+            model.Media.metadata_cache.prune()
+        if watcher is not None:
+            for path in watcher:
+                process_new_file(path, filter_actions)
+    finally:
+        if watcher is not None:
+            watcher.close()
+        exiftool.ExifToolMedia.pool.close()
+        if model.Media.metadata_cache is not None:
+            model.Media.metadata_cache.close()
+            model.Media.metadata_cache = None
+        if library is not None:
+            library.close()
+        if run_journal is not None:
+            run_journal.close()
+        model.FileSystemElement.destination_index = None
+        model.FileSystemElement.file_operations = model.FileOperations()
+        model.FileOperations.kept_directories = ()
+
+
+def database_path(settings, name):
+    """
+    Return the path of a database kept under the timeline directory, or an
+    in-memory database for a dry run to leave the timeline untouched.
+    """
+    if settings['dry_run']:
+        return ':memory:'
+    return os.path.join(settings['timeline'], '.calbum', name)
+
+
+def write_stats(run_stats, path):
+    """
+    Print the summary of the stats of a run and write them as JSON in a
+    file.
+    """
+    sys.stderr.write(run_stats.summary())
+    parent = os.path.dirname(path)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent)
+    with open(path, 'w') as f:
+        run_stats.dump(f)
+
+
+def write_memory_trace(path, limit=50):
+    """
+    Write the lines of code holding the most memory in a file.
+    """
+    snapshot = tracemalloc.take_snapshot()
+    with open(path, 'w') as f:
+        for statistic in snapshot.statistics('lineno')[:limit]:
+            f.write('{}\n'.format(statistic))
+
+
+def write_plan(file_plan, path):
+    """
+    Write the operations of a plan as JSON in a file, '-' for the standard
+    output.
+    """
+    if path == '-':
+        file_plan.dump(sys.stdout)
+    else:
+        with open(path, 'w') as f:
+            file_plan.dump(f)
+
+
+def execute_plan(file_plan):
+    """
+    Do the operations of a plan, showing their progress.
+    """
+    operations = file_plan.operations()
+    with ChargingBar('Writing files:', max=len(operations),
+                     suffix='%(index)d/%(max)d [eta: %(eta)ds]') as bar:
+        for operation in operations:
+            file_plan.perform(operation)
+            bar.next()
+
+
+def process_new_file(path, filter_actions):
+    """
+    Apply the filter actions to a file added to the inbox.  Errors are
+    logged so that watching the inbox continues.
+    """
+    media = model.MediaCollection.media_factory(path)
+    if media is None or not os.path.exists(path):
+        return
+    try:
         for action in filter_actions:
-            action(picture)
+            action(media)
+    except Exception:
+        logging.exception('Processing of "%s" failed', path)
+    if model.Media.metadata_cache is not None:
+        model.Media.metadata_cache.flush()
@@ -0,0 +1,322 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import sqlite3
+import threading
+
+from calbum.core import model
+from calbum.core.index import BloomFilter
+
+
+class BatchedDatabase(object):
+    """
+    A sqlite database shared between threads whose writes are committed in
+    batches.  The subclasses create their tables from their schema.
+    """
+
+    schema = ()
+
+    def __init__(self, path, batch_size=100):
+        """
+        :param path: the path of the database, ':memory:' for a database
+                     discarded on close
+        :param batch_size: the number of writes committed together
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.batch_size = batch_size
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        for statement in self.schema:
+            self._connection.execute(statement)
+        self._connection.commit()
+
+    def _execute(self, statement, parameters):
+        with self._lock:
+            self._connection.execute(statement, parameters)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def _commit(self):
+        self._connection.commit()
+        self._pending = 0
+
+    def flush(self):
+        """
+        Commit the pending writes.
+        """
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """
+        Commit the pending writes and close the database.
+        """
+        with self._lock:
+            self._commit()
+            self._connection.close()
+
+
+class MetadataCache(BatchedDatabase):
+    """
+    A persistent cache of media metadata stored in a sqlite database.
+    Entries are keyed by the identity of the file on disk (device, inode,
+    size and modification time) so they survive the file being renamed or
+    moved on the same file system.  Their paths are kept absolute, for the
+    cache to be used from any directory.  Writes are committed in batches.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS metadata ('
+        ' device INTEGER, inode INTEGER, size INTEGER, mtime REAL,'
+        ' path TEXT, timestamp TEXT, time_zone TEXT,'
+        ' PRIMARY KEY (device, inode, size, mtime))',
+        'CREATE TABLE IF NOT EXISTS tags ('
+        ' device INTEGER, inode INTEGER, size INTEGER, mtime REAL,'
+        ' source TEXT, tags TEXT,'
+        ' PRIMARY KEY (device, inode, size, mtime, source))',
+    )
+
+    @staticmethod
+    def key(stat):
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime
+
+    def get(self, stat):
+        """
+        Get the cached metadata of a file.
+        :param stat: the os.stat result of the file
+        :return: a dictionary with the 'path', 'timestamp' and 'time_zone'
+                 of the file and its 'tags' by source, or None if the file
+                 is not cached.
+        :rtype: dict
+        """
+        key = self.key(stat)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT path, timestamp, time_zone FROM metadata '
+                'WHERE device=? AND inode=? AND size=? AND mtime=?',
+                key).fetchone()
+            tags = self._connection.execute(
+                'SELECT source, tags FROM tags '
+                'WHERE device=? AND inode=? AND size=? AND mtime=?',
+                key).fetchall()
+        if row is None:
+            return None
+        path, timestamp, time_zone = row
+        return {
+            'path': path,
+            'timestamp': timestamp,
+            'time_zone': time_zone,
+            'tags': dict((source, json.loads(t)) for source, t in tags),
+        }
+
+    def put_tags(self, stat, path, source, tags):
+        """
+        Store the raw timestamp tags of a file.
+        :param stat: the os.stat result of the file
+        :param path: the path of the file
+        :param source: the name of the tool that extracted the tags
+        :param tags: a dictionary of tag names and string values
+        """
+        self._upsert(stat, path)
+        self._execute(
+            'INSERT OR REPLACE INTO tags '
+            '(device, inode, size, mtime, source, tags) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            self.key(stat) + (source, json.dumps(tags)))
+
+    def put_timestamp(self, stat, path, timestamp, time_zone):
+        """
+        Store the resolved timestamp of a file.
+        :param stat: the os.stat result of the file
+        :param path: the path of the file
+        :param timestamp: the timestamp as an ISO 8601 local date/time
+        :param time_zone: the name of the time zone of the timestamp
+        """
+        self._upsert(stat, path, timestamp=timestamp, time_zone=time_zone)
+
+    def relocate(self, stat, path):
+        """
+        Record the new path of a cached file.
+        """
+        self._execute(
+            'UPDATE metadata SET path=? '
+            'WHERE device=? AND inode=? AND size=? AND mtime=?',
+            (os.path.abspath(path),) + self.key(stat))
+
+    def _upsert(self, stat, path, **values):
+        key = self.key(stat)
+        self._execute(
+            'INSERT OR IGNORE INTO metadata '
+            '(device, inode, size, mtime) VALUES (?, ?, ?, ?)', key)
+        columns = ['path'] + sorted(values)
+        values['path'] = os.path.abspath(path)
+        self._execute(
+            'UPDATE metadata SET {} '
+            'WHERE device=? AND inode=? AND size=? AND mtime=?'.format(
+                ', '.join('{}=?'.format(c) for c in columns)),
+            tuple(values[c] for c in columns) + key)
+
+    def prune(self):
+        """
+        Remove the entries of the files that no longer exist at their last
+        known path or that were modified since they were cached.
+        :return: the number of removed entries
+        """
+        with self._lock:
+            self._commit()
+            rows = self._connection.execute(
+                'SELECT device, inode, size, mtime, path '
+                'FROM metadata').fetchall()
+        stale = []
+        for row in rows:
+            try:
+                current = self.key(os.stat(row[4]))
+            except (OSError, TypeError):
+                current = None
+            if current != tuple(row[:4]):
+                stale.append(row[:4])
+        with self._lock:
+            for table in ('metadata', 'tags'):
+                self._connection.executemany(
+                    'DELETE FROM {} WHERE device=? AND inode=? AND size=? '
+                    'AND mtime=?'.format(table), stale)
+            self._commit()
+        return len(stale)
+
+
+class LibraryIndex(BatchedDatabase):
+    """
+    A persistent index of the content of the files of a timeline stored in
+    a sqlite database.  Files are indexed by size, their fingerprint (see
+    model.fingerprint) is only computed when a file of the same size is
+    looked up.  A Bloom filter of the sizes answers most lookups of new
+    files without querying the database.  The files whose operations are
+    deferred are compared from their current content (see
+    FileSystemElement.file_operations).  The paths are stored relative to
+    the root of the timeline, for the index to be used from any directory.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS files ('
+        ' path TEXT PRIMARY KEY, size INTEGER, fingerprint BLOB)',
+        'CREATE INDEX IF NOT EXISTS files_size ON files (size)',
+    )
+
+    def __init__(self, path, root=None, batch_size=100):
+        """
+        :param path: the path of the database, ':memory:' for an index
+                     discarded on close
+        :param root: the directory of the indexed files (the timeline), the
+                     paths are stored absolute if None
+        :param batch_size: the number of writes committed together
+        """
+        super(LibraryIndex, self).__init__(path, batch_size)
+        self.root = root
+        sizes = [size for size, in self._connection.execute(
+            'SELECT DISTINCT size FROM files')]
+        self._sizes = BloomFilter(max(2 * len(sizes), 1024))
+        for size in sizes:
+            self._sizes.add(size)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def add(self, path, size):
+        """
+        Index a file of the timeline.
+        :param path: the path of the file
+        :param size: the size of the file in bytes
+        """
+        self._execute(
+            'INSERT OR REPLACE INTO files (path, size, fingerprint) '
+            'VALUES (?, ?, NULL)', (self._key(path), size))
+        self._sizes.add(size)
+
+    def add_collection(self, collection):
+        """
+        Index all the medias of a collection.
+        :type collection: model.MediaCollection
+        :return: the number of indexed medias
+        """
+        count = 0
+        for media in collection:
+            self.add(media.path(), media.stat().st_size)
+            count += 1
+        self.flush()
+        return count
+
+    def remove(self, path):
+        """
+        Remove a file from the index.
+        """
+        self._execute('DELETE FROM files WHERE path=?', (self._key(path),))
+
+    def find(self, path):
+        """
+        Find an indexed file whose content is the same as a file.
+        :param path: the path of the file
+        :return: the path of the indexed file or None
+        """
+        size = os.stat(path).st_size
+        if size not in self._sizes:
+            return None
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT path, fingerprint FROM files WHERE size=?',
+                (size,)).fetchall()
+        key = self._key(path)
+        fingerprint = None
+        file_operations = model.FileSystemElement.file_operations
+        for other_key, other_fingerprint in rows:
+            other = self._path(other_key)
+            content = file_operations.content_path(other)
+            try:
+                if other_key == key or os.path.samefile(path, content):
+                    continue
+                if fingerprint is None:
+                    fingerprint = model.fingerprint(path)
+                if other_fingerprint is None:
+                    other_fingerprint = model.fingerprint(content)
+                    self._execute(
+                        'UPDATE files SET fingerprint=? WHERE path=?',
+                        (sqlite3.Binary(other_fingerprint), other_key))
+                if bytes(other_fingerprint) == fingerprint and \
+                        model.is_same_file(path, content):
+                    return other
+            except (IOError, OSError):
+                if os.path.exists(content):
+                    raise
+                self.remove(other)
+        return None
+
+    def _key(self, path):
+        if self.root is None:
+            return os.path.abspath(path)
+        return os.path.relpath(path, self.root)
+
+    def _path(self, key):
+        if self.root is None:
+            return key
+        return os.path.join(self.root, key)
@@ -0,0 +1,171 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import calendar
+import datetime
+import hashlib
+import math
+import struct
+
+from dateutil import tz
+
+from calbum.core import stats
+
+
+def is_floating(value):
+    """
+    Checks if a date or datetime is not bound to a specific time zone.
+    Dates and naive datetimes follow the local time of what they are
+    compared to.
+    """
+    if not isinstance(value, datetime.datetime):
+        return True
+    return value.tzinfo is None or value.tzinfo.utcoffset(value) is None
+
+
+def time_key(value):
+    """
+    Convert a date or a datetime to a number of seconds since the epoch.
+    Floating values are converted as if they were UTC.
+    :rtype: float
+    """
+    if not isinstance(value, datetime.datetime):
+        return float(calendar.timegm(value.timetuple()))
+    if not is_floating(value):
+        value = value.astimezone(tz.tzutc()).replace(tzinfo=None)
+    return calendar.timegm(value.timetuple()) + value.microsecond / 1e6
+
+
+class IntervalTree(object):
+    """
+    A static centered interval tree.  It finds the half-open intervals
+    [start, end) containing a point in O(log n + k).
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: an iterable of (start, end, value) tuples
+        """
+        self._root = self._build([i for i in intervals if i[0] < i[1]])
+
+    @classmethod
+    def _build(cls, intervals):
+        if not intervals:
+            return None
+        starts = sorted(start for start, _, _ in intervals)
+        center = starts[len(starts) // 2]
+        left, right, overlapping = [], [], []
+        for interval in intervals:
+            if interval[1] <= center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                overlapping.append(interval)
+        return (center,
+                sorted(overlapping, key=lambda i: i[0]),
+                sorted(overlapping, key=lambda i: i[1], reverse=True),
+                cls._build(left),
+                cls._build(right))
+
+    def search(self, point):
+        """
+        Yield the value of every interval containing the point.
+        """
+        node = self._root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, _, value in by_start:
+                    if start > point:
+                        break
+                    yield value
+                node = left
+            else:
+                for _, end, value in by_end:
+                    if end <= point:
+                        break
+                    yield value
+                node = right
+
+
+class EventIndex(object):
+    """
+    Finds the events including a timestamp without checking every event.
+    """
+
+    def __init__(self, events):
+        """
+        :param events: an iterable of Event
+        """
+        self.events = list(events)
+        floating, absolute = [], []
+        for position, event in enumerate(self.events):
+            start, end = event.time_period().span()
+            intervals = floating if is_floating(start) else absolute
+            intervals.append((
+                time_key(start),
+                float('inf') if end is None else time_key(end),
+                position))
+        self._floating = IntervalTree(floating)
+        self._absolute = IntervalTree(absolute)
+
+    def events_at(self, timestamp):
+        """
+        Yield the events including the timestamp, in their original order.
+        :param timestamp: a timezone aware datetime
+        """
+        positions = set(self._absolute.search(time_key(timestamp)))
+        positions.update(self._floating.search(
+            time_key(timestamp.replace(tzinfo=None))))
+        stats.count('event_checks', len(positions))
+        for position in sorted(positions):
+            event = self.events[position]
+            if timestamp in event.time_period():
+                yield event
+
+
+class BloomFilter(object):
+    """
+    A probabilistic set: a value that was added is always found, a value
+    that wasn't is found with a probability close to the error rate as long
+    as the capacity isn't exceeded.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :param capacity: the expected number of values
+        :param error_rate: the expected rate of false positives
+        """
+        capacity = max(capacity, 1)
+        self._size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(int(round(
+            float(self._size) / capacity * math.log(2))), 1)
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.md5(str(value).encode('utf-8')).digest()
+        first, second = struct.unpack('<QQ', digest)
+        for i in range(self._hashes):
+            yield (first + i * second) % self._size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self._bits[position // 8] & (1 << (position % 8))
+                   for position in self._positions(value))
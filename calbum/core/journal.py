@@ -0,0 +1,184 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+
+from calbum.core.plan import Operation, Plan
+
+
+class Journal(object):
+    """
+    An append-only journal of the plans executed by a run, used to finish
+    the plans of an interrupted run (see recover).  Each line is a JSON
+    record:
+      {"plan": n, "operations": [[name, source, path], ...],
+       "events": {folder: ical}}: written and synced before the plan n is
+                                  executed
+      {"plan": n, "done": count}: the first operations of the plan n are
+                                  done, written after each batch of
+                                  operations without being synced
+      {"plan": n, "end": true}: the plan n is done
+    """
+
+    def __init__(self, path, batch_size=100):
+        """
+        :param path: the path of the journal
+        :param batch_size: the number of operations done between the
+                           records of the progress of a plan
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.path = path
+        self.batch_size = batch_size
+        self._plans = 0
+        self._done_sources = set()
+        self._file = open(path, 'a')
+
+    def _records(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Partly written when the run was interrupted
+                    continue
+
+    def recover(self):
+        """
+        Finish the plans of the journal that were interrupted.  The
+        operations that weren't recorded as done are checked and only done
+        if their source is still there and their destination isn't.
+        Removals are not done again, the removed files are found as
+        duplicates by the next run.
+        :return: the number of operations done
+        """
+        plans = {}
+        for record in self._records():
+            number = record['plan']
+            self._plans = max(self._plans, number)
+            if 'operations' in record:
+                plans[number] = [
+                    record['operations'], record.get('events', {}), 0]
+                self._add_done_sources(
+                    Operation(*o) for o in record['operations'])
+            elif number in plans and 'done' in record:
+                plans[number][2] = record['done']
+            elif 'end' in record:
+                plans.pop(number, None)
+
+        count = 0
+        for number in sorted(plans):
+            operations, events, done = plans[number]
+            for operation in operations[done:]:
+                if self._roll_forward(Operation(*operation), events):
+                    count += 1
+            self._write({'plan': number, 'end': True})
+        self.flush()
+        return count
+
+    def _roll_forward(self, operation, events):
+        if operation.name in ('move', 'link'):
+            if not os.path.exists(operation.source) or \
+                    os.path.lexists(operation.path):
+                return False
+            parent = os.path.dirname(operation.path)
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+        elif operation.name == 'remove':
+            return False
+        elif operation.name == 'save_event':
+            if not os.path.isdir(operation.path):
+                return False
+            with open(os.path.join(operation.path, 'event.ics'), 'w') as f:
+                f.write(events[operation.path].encode('utf-8'))
+            return True
+        logging.info('Resuming {} to "{}"'.format(
+            operation.name, operation.path))
+        Plan().perform(operation)
+        return True
+
+    def _add_done_sources(self, operations):
+        self._done_sources.update(
+            operation.source for operation in operations
+            if operation.name in ('move', 'link'))
+
+    def is_done(self, path):
+        """
+        Test whether a file was moved or linked by a plan of the journal.
+        """
+        return path in self._done_sources
+
+    def execute(self, plan):
+        """
+        Record the operations of a plan, then do them while recording their
+        progress.
+        :type plan: Plan
+        :return: the number of operations done
+        """
+        operations = plan.operations()
+        self._plans += 1
+        number = self._plans
+        self._write({
+            'plan': number,
+            'operations': operations,
+            'events': dict(
+                (o.path, plan.event(o.path).to_ical().decode('utf-8'))
+                for o in operations if o.name == 'save_event'),
+        })
+        self.sync()
+        for done, operation in enumerate(operations, 1):
+            plan.perform(operation)
+            if done % self.batch_size == 0:
+                self._write({'plan': number, 'done': done})
+                self.flush()
+        self._write({'plan': number, 'end': True})
+        self.flush()
+        self._add_done_sources(operations)
+        return len(operations)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def flush(self):
+        """
+        Write the pending records to the journal file.
+        """
+        self._file.flush()
+
+    def sync(self):
+        """
+        Write the pending records to the journal file and to the disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def clear(self):
+        """
+        Empty the journal once all its plans are done and the files they
+        moved or linked no longer need to be skipped.
+        """
+        self._file.flush()
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._plans = 0
+        self._done_sources.clear()
+
+    def close(self):
+        """
+        Write the pending records and close the journal file.
+        """
+        self._file.close()
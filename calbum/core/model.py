@@ -13,33 +13,283 @@
 # limitations under the License.
 
 
+from collections import namedtuple
 from datetime import datetime
+import errno
 import filecmp
+import hashlib
 import locale
 import os
+import re
+import threading
 
 from dateutil import tz
 
+from calbum.core import stats
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
 
 class MediaFactory(object):
+    """
+    Create the media of a file from its extension or, when sniffing, from
+    the signature found at the start of its content.
+    """
+
+    # Identify the files without a known extension from their content
+    sniff = False
+
+    # Number of bytes read from the start of the files that are sniffed
+    header_size = 16 * 1024
 
     def __init__(self, *factories):
         self.factories = factories
+        self.extensions = {}
+        for factory in factories:
+            for extension in factory.file_extensions:
+                self.extensions.setdefault(extension, factory)
+
+    def __call__(self, path, dir_entry=None):
+        _, extension = os.path.splitext(path)
+        factory = self.extensions.get(extension.lower())
+        if factory is not None:
+            return factory(path, dir_entry)
+        if self.sniff:
+            return self.sniff_media(path, dir_entry)
+        return None
+
+    def sniff_media(self, path, dir_entry=None):
+        """
+        Create the media of a file from the signature found at the start of
+        its content.  The bytes read are kept by the media (see
+        Media.header) for its metadata to be read without opening the file
+        again.
+        :rtype: Media
+        """
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(self.header_size)
+        except IOError:
+            return None
+        stats.count('files_sniffed')
+        stats.count('metadata_bytes_read', len(header))
+        factory = next((
+            f for f in self.factories
+            if any(header.startswith(signature, offset)
+                   for offset, signature in f.file_signatures)), None)
+        if factory is None:
+            return None
+        media = factory(path, dir_entry)
+        media.header = header
+        return media
+
+
+# The part of os.stat kept by the medias
+FileStatus = namedtuple('FileStatus', 'st_dev st_ino st_size st_mtime')
+
+
+class DirectoryCache(object):
+    """
+    The directories known to exist, for the destination directories of the
+    files to be checked and created once rather than for every file.
+    """
 
-    def __call__(self, path):
-        return next((
-            f(path) for f in self.factories
-            if path.lower().endswith(f.file_extensions)), None)
+    def __init__(self):
+        self._known = set()
+
+    def exists(self, directory):
+        """
+        Test whether a directory exists, only the first time it is known.
+        """
+        if directory in self._known:
+            return True
+        if os.path.isdir(directory):
+            self._add(directory)
+            return True
+        return False
+
+    def make(self, directory):
+        """
+        Create a directory and its parents unless they are known to exist.
+        """
+        if not directory or directory in self._known:
+            return
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+                stats.count('directories_created')
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        self._add(directory)
+
+    def forget(self, directory):
+        """
+        Forget a directory removed since it was known, and the directories
+        it contained.
+        """
+        prefix = os.path.join(directory, '')
+        self._known = set(
+            d for d in self._known
+            if d != directory and not d.startswith(prefix))
+
+    def _add(self, directory):
+        while directory and directory not in self._known:
+            self._known.add(directory)
+            directory = os.path.dirname(directory)
+
+
+class FileOperations(object):
+    """
+    The operations of the file system elements on the file system, done
+    when they are requested.  See plan.Plan for operations recorded to be
+    done later.
+    """
+
+    # The operations are only recorded, the files are not there yet
+    deferred = False
+
+    # The absolute paths of the directories kept when a move leaves them
+    # empty, like the inbox
+    kept_directories = ()
+
+    def __init__(self, directories=None):
+        """
+        :param directories: the DirectoryCache of the destination
+                            directories, they are checked for every file
+                            if None
+        """
+        self.directories = directories
+
+    def exists(self, path):
+        """
+        Test whether a path exists.
+        """
+        return os.path.exists(path)
+
+    def content_path(self, path):
+        """
+        Return the path where the content of a file currently is.
+        """
+        return path
+
+    def move(self, source, dest):
+        """
+        Move a file, creating the missing directories of its new path.  The
+        directories left empty are removed (like os.renames), up to the
+        kept directories.
+        """
+        with stats.timer('file_operations'):
+            self._create(dest, lambda: os.rename(source, dest))
+            stats.count('files_moved')
+            self._remove_empty_directories(os.path.dirname(source))
+
+    def remove(self, path):
+        """
+        Remove a file.
+        """
+        with stats.timer('file_operations'):
+            os.remove(path)
+        stats.count('files_removed')
+
+    def link(self, source, dest):
+        """
+        Link a file, creating the missing directories of the link path.  A
+        relative symbolic link is created when a hard link isn't possible.
+        """
+        def link():
+            try:
+                os.link(source, dest)
+                stats.count('hard_links')
+            except os.error:
+                relative_src_path = os.path.join(
+                    os.path.relpath(
+                        os.path.dirname(source),
+                        os.path.dirname(dest)),
+                    os.path.basename(source))
+                os.symlink(relative_src_path, dest)
+                stats.count('symbolic_links')
+        with stats.timer('file_operations'):
+            self._create(dest, link)
+
+    def save_event(self, event, folder):
+        """
+        Save an event in a folder (see Event.save_to).
+        """
+        with stats.timer('file_operations'):
+            event.save_to(folder)
+        stats.count('events_saved')
+
+    def _create(self, path, create):
+        """
+        Create a file with a function once the missing directories of its
+        path are created.  A directory removed since it was known is
+        created again.
+        """
+        parent = os.path.dirname(path)
+        self._make_directory(parent)
+        try:
+            create()
+        except OSError as e:
+            if e.errno != errno.ENOENT or self.directories is None or \
+                    not parent or os.path.isdir(parent):
+                raise
+            self.directories.forget(parent)
+            self._make_directory(parent)
+            create()
+
+    def _remove_empty_directories(self, directory):
+        while directory and \
+                os.path.abspath(directory) not in self.kept_directories:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            if self.directories is not None:
+                self.directories.forget(directory)
+            head = os.path.dirname(directory)
+            if head == directory:
+                return
+            directory = head
+
+    def _directory_exists(self, directory):
+        if self.directories is not None:
+            return self.directories.exists(directory)
+        return os.path.isdir(directory)
+
+    def _make_directory(self, directory):
+        if self.directories is not None:
+            self.directories.make(directory)
+        elif directory and not os.path.exists(directory):
+            os.makedirs(directory)
 
 
 class FileSystemElement(object):
+    # Medias are created for every file of the inbox, keep them small
+    __slots__ = ('_path', '_dir_entry', '_stat')
+
+    # The DestinationIndex used to find where files are moved, if any
+    destination_index = None
+
+    # The FileOperations performing the moves, links and removals
+    file_operations = FileOperations()
 
-    def __init__(self, path):
+    def __init__(self, path, dir_entry=None):
+        """
+        :param path: the path of the file
+        :param dir_entry: the directory entry of the file (os.scandir) used
+                          to get its status without another system call.
+        """
         pref_enc = locale.getpreferredencoding()
         if isinstance(path, unicode):
             self._path = path
         else:
             self._path = path.decode(pref_enc)
+        self._dir_entry = dir_entry
+        self._stat = None
 
     def move_to(self, path_prefix):
         """
@@ -48,15 +298,16 @@ class FileSystemElement(object):
         file_extension method.
         :param path_prefix: the destination path without extension
         """
-        path = get_destination_path(
-            source=self.path(),
-            dest=path_prefix,
-            extension=self.file_extension())
-        if not os.path.exists(path):
-            os.renames(self._path, path)
+        path = self.destination_path(path_prefix)
+        if self.file_operations.deferred:
+            self.stat()
+        if not self.file_operations.exists(path):
+            self.file_operations.move(self._path, path)
+            self._index_moved(self._path, path)
         elif self._path != path:
-            os.remove(self._path)
-        self._path = path
+            self.file_operations.remove(self._path)
+            self._index_moved(self._path, None)
+        self._moved(path)
 
     def link_to(self, path_prefix):
         """
@@ -64,24 +315,56 @@ class FileSystemElement(object):
         part of path_prefix as it is added by this method using the
         file_extension method.
         :param path_prefix: the destination path without extension
+        :return: the path of the link
         """
-        dest_link_path = get_destination_path(
-            source=self.path(),
-            dest=path_prefix,
-            extension=self.file_extension())
-        if not os.path.exists(dest_link_path):
-            parent, _ = os.path.split(path_prefix)
-            if parent and not os.path.exists(parent):
-                os.makedirs(parent)
-            try:
-                os.link(self._path, dest_link_path)
-            except os.error:
-                relative_src_path = os.path.join(
-                    os.path.relpath(
-                        os.path.dirname(self._path),
-                        os.path.dirname(dest_link_path)),
-                    os.path.basename(self._path))
-                os.symlink(relative_src_path, dest_link_path)
+        dest_link_path = self.destination_path(path_prefix)
+        if not self.file_operations.exists(dest_link_path):
+            self.file_operations.link(self._path, dest_link_path)
+            self._index_moved(None, dest_link_path)
+        return dest_link_path
+
+    def replace_with(self, path):
+        """
+        Remove the file, a copy of the file at path, and use the file at
+        path instead.
+        :param path: the path of the other copy of the file
+        """
+        if self.file_operations.deferred:
+            self.stat()
+        self.file_operations.remove(self._path)
+        self._index_moved(self._path, None)
+        self._moved(path)
+
+    def _moved(self, path):
+        self._path = path
+        if not self.file_operations.deferred:
+            self._stat = None
+            self._dir_entry = None
+
+    def destination_path(self, path_prefix):
+        """
+        Return the path where the file is moved or linked for a path prefix
+        (see get_destination_path), using the destination index if any.
+        :param path_prefix: the destination path without extension
+        """
+        with stats.timer('destinations'):
+            if self.destination_index is not None:
+                return self.destination_index.destination_path(
+                    source=self.content_path(),
+                    dest=path_prefix,
+                    extension=self.file_extension())
+            return get_destination_path(
+                source=self.content_path(),
+                dest=path_prefix,
+                extension=self.file_extension())
+
+    def _index_moved(self, source, dest):
+        if self.destination_index is not None:
+            if source is not None:
+                self.destination_index.remove(source)
+            if dest is not None:
+                self.destination_index.add(
+                    dest, self.file_operations.content_path(dest))
 
     def path(self):
         """
@@ -89,6 +372,30 @@ class FileSystemElement(object):
         """
         return self._path
 
+    def content_path(self):
+        """
+        Return the path where the content of the file currently is, it
+        differs from path when the operations of the file are deferred.
+        """
+        return self.file_operations.content_path(self._path)
+
+    def stat(self):
+        """
+        Return the status of the file (the st_dev, st_ino, st_size and
+        st_mtime fields of os.stat), it is kept until the file is moved.
+        :rtype: FileStatus
+        """
+        if self._stat is None:
+            if self._dir_entry is not None:
+                status = self._dir_entry.stat()
+                self._dir_entry = None
+            else:
+                status = os.stat(self.content_path())
+            self._stat = FileStatus(
+                status.st_dev, status.st_ino, status.st_size,
+                status.st_mtime)
+        return self._stat
+
     def file_extension(self):
         """
         Return the actual or required file extension.
@@ -116,25 +423,147 @@ class Media(FileSystemElement):
     file_extensions = ()
     time_zone = tz.gettz()
 
+    # (offset, bytes) pairs found at the start of the files of this type
+    file_signatures = ()
+
+    # Number of timestamps resolved by all the medias (see timestamp)
+    resolved_timestamps = 0
+    _resolved_timestamps_lock = threading.Lock()
+
+    # The MetadataCache shared by all the medias, if any
+    metadata_cache = None
+
+    # header: the first bytes of the file, when they were read to identify
+    #         it (see MediaFactory.sniff_media)
+    # _exif: the tags read from the file by the media sources (see exif)
+    __slots__ = ('header', '_exif', '_timestamp', '_timestamp_path',
+                 '_metadata')
+
+    def __init__(self, path, dir_entry=None):
+        super(Media, self).__init__(path, dir_entry)
+        self.header = None
+        self._timestamp = None
+        self._timestamp_path = None
+        self._metadata = None
+
     def location(self):
         """
         :rtype: Location
         """
         raise NotImplemented()
 
+    def move_to(self, path_prefix):
+        """
+        Move the file to a new path prefix.  The timestamp already resolved
+        is kept, even if it was derived from the previous path.
+        :param path_prefix: the destination path without extension
+        """
+        super(Media, self).move_to(path_prefix)
+        if self.metadata_cache is not None and \
+                not self.file_operations.deferred:
+            self.metadata_cache.relocate(self.stat(), self.path())
+
+    def replace_with(self, path):
+        """
+        Remove the file, a copy of the file at path, and use the file at
+        path instead.  A timestamp derived from the previous path is
+        resolved again on its next use.
+        :param path: the path of the other copy of the file
+        """
+        super(Media, self).replace_with(path)
+        if self._timestamp_path not in (None, self.path()):
+            self._timestamp = None
+
+    def cached_metadata(self):
+        """
+        Return the metadata of this file found in the metadata cache (see
+        MetadataCache.get) or None.
+        :rtype: dict
+        """
+        if self.metadata_cache is None:
+            return None
+        if self._metadata is None:
+            self._metadata = self.metadata_cache.get(self.stat()) or {}
+        return self._metadata or None
+
+    def cached_tags(self, source):
+        """
+        Return the timestamp tags extracted from this file by a source in a
+        previous run, or None.
+        :rtype: dict
+        """
+        metadata = self.cached_metadata()
+        if metadata:
+            return metadata['tags'].get(source)
+
+    def cache_tags(self, source, tags):
+        """
+        Keep the timestamp tags extracted from this file by a source in the
+        metadata cache.
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.put_tags(
+                self.stat(), self.content_path(), source, tags)
+
     def timestamp(self):
+        """
+        Return the creation timestamp of the media.  It is resolved once
+        (see resolve_timestamp) and kept for the following calls.  A
+        timestamp resolved from the metadata of the file is kept in the
+        metadata cache.
+        :rtype: datetime
+        """
+        if self._timestamp is None:
+            self._timestamp = self._cached_timestamp()
+        if self._timestamp is None:
+            with self._resolved_timestamps_lock:
+                Media.resolved_timestamps += 1
+            self._timestamp_path = None
+            with stats.timer('timestamps'):
+                self._timestamp = self.resolve_timestamp()
+            if self._timestamp_path is None and self.metadata_cache:
+                self.metadata_cache.put_timestamp(
+                    self.stat(), self.content_path(),
+                    self._timestamp.replace(tzinfo=None).isoformat(),
+                    repr(self.time_zone))
+            self.discard_metadata()
+        return self._timestamp
+
+    def discard_metadata(self):
+        """
+        Forget the metadata read from the file and from the metadata cache,
+        only the timestamp is needed once it is resolved.
+        """
+        self.header = None
+        self._metadata = None
+        if hasattr(self, '_exif'):
+            del self._exif
+
+    def _cached_timestamp(self):
+        metadata = self.cached_metadata()
+        if metadata and metadata['timestamp'] and \
+                metadata['time_zone'] == repr(self.time_zone):
+            timestamp = metadata['timestamp']
+            iso_format = '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp \
+                else '%Y-%m-%dT%H:%M:%S'
+            stats.count('cached_timestamps')
+            return datetime.strptime(timestamp, iso_format).replace(
+                tzinfo=self.time_zone)
+
+    def resolve_timestamp(self):
         """
         Return the creation timestamp of the media.  The name is parsed to be
         used as a date/time.  If it is not a date, the modification time of
         the file on the file system is used.
         :rtype: datetime
         """
+        self._timestamp_path = self.path()
         try:
             _, file_name = os.path.split(self.path())
             return string_to_datetime(file_name, self.time_zone)
         except ValueError:
             return datetime.fromtimestamp(
-                timestamp=os.path.getmtime(self.path()),
+                timestamp=self.stat().st_mtime,
                 tz=self.time_zone
             )
 
@@ -147,16 +576,50 @@ class Media(FileSystemElement):
         return super(Media, self).file_extension()
 
 
+# Directories created by operating systems, NAS and photo managers
+system_dirs = frozenset([
+    '#recycle', '#snapshot', '$RECYCLE.BIN', '.@__thumb', '.AppleDouble',
+    '.thumbnails', '@eaDir', 'System Volume Information', 'lost+found',
+])
+
+
 # noinspection PyAbstractClass
 class MediaCollection(FileSystemElement):
     media_factory = Media
 
+    # Names of the directories that are not walked
+    excluded_dirs = frozenset()
+
+    # Skip the files and directories whose name starts with a dot
+    exclude_hidden = False
+
     def __iter__(self):
-        for sub_path, subdirs, files in os.walk(self.path()):
-            for name in files:
-                media = self.media_factory(os.path.join(sub_path, name))
+        """
+        Walk the collection top-down (like os.walk) and yield the medias
+        created by the media factory.
+        """
+        directories = [self.path()]
+        while directories:
+            try:
+                with stats.timer('scan'):
+                    entries = list(scandir(directories.pop()))
+            except OSError:
+                continue
+            stats.count('directories_scanned')
+            sub_directories = []
+            for entry in entries:
+                if self.exclude_hidden and entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if not entry.is_symlink() and \
+                            entry.name not in self.excluded_dirs:
+                        sub_directories.append(entry.path)
+                    continue
+                stats.count('files_scanned')
+                media = self.media_factory(entry.path, entry)
                 if media is not None:
                     yield media
+            directories.extend(reversed(sub_directories))
 
 
 # noinspection PyAbstractClass
@@ -164,27 +627,36 @@ class TimeLine(MediaCollection):
     """
     A media collection organized by date.
     """
+    # strftime format of the media paths, %N is replaced by the milliseconds
     media_path_format = "%Y/%Y-%m/%Y-%m-%d-%H-%M-%S"
 
     def link(self, media):
         """
         Link the media file in this TimeLine MediaCollection.
         :param media: the media file
+        :return: the path of the link
         """
-        new_path = os.path.join(
-            self.path(),
-            media.timestamp().strftime(self.media_path_format))
-        media.link_to(new_path)
+        return media.link_to(self.media_path(media))
 
     def move(self, media):
         """
         Move the media file in this TimeLine MediaCollection.
         :param media: the media file
         """
-        new_path = os.path.join(
-            self.path(),
-            media.timestamp().strftime(self.media_path_format))
-        media.move_to(new_path)
+        media.move_to(self.media_path(media))
+
+    def media_path(self, media):
+        """
+        Return the path of a media file in this TimeLine, without extension.
+        :param media: the media file
+        """
+        timestamp = media.timestamp()
+        path_format = re.sub(
+            '%[%N]',
+            lambda m: m.group() if m.group() == '%%'
+            else '{:03d}'.format(timestamp.microsecond // 1000),
+            self.media_path_format)
+        return os.path.join(self.path(), timestamp.strftime(path_format))
 
     def organize(self):
         """
@@ -258,6 +730,15 @@ class TimePeriod(object):
         """
         raise NotImplementedError()
 
+    def span(self):
+        """
+        Get the time covered by all the occurrences of this time period.
+        :return: a (start, end) tuple, end is None for endless recurrences.
+        :rtype: tuple
+        """
+        start = self.start()
+        return start, start + self.duration()
+
     def __contains__(self, timestamp):
         """
         Checks if the time period includes a specific timestamp.
@@ -298,6 +779,13 @@ class Event(object):
         """
         raise NotImplementedError()
 
+    def to_ical(self):
+        """
+        Returns this event as the content of an ical file.
+        :rtype: str
+        """
+        raise NotImplementedError()
+
 
 def is_same_file(source, dest):
     return os.path.samefile(source, dest) or \
@@ -309,6 +797,7 @@ def get_destination_path(source, dest, extension, suffix=0):
         computed_dest = u'{}({}){}'.format(dest, suffix, extension)
     else:
         computed_dest = u'{}{}'.format(dest, extension)
+    stats.count('collision_probes')
     if os.path.exists(computed_dest):
         if is_same_file(source, computed_dest):
             return computed_dest
@@ -317,9 +806,177 @@ def get_destination_path(source, dest, extension, suffix=0):
     return computed_dest
 
 
+class DestinationIndex(object):
+    """
+    Finds the destination path of files like get_destination_path, but lists
+    each destination directory once and compares the content of the files
+    from their size, then from a fingerprint of their first and last bytes.
+    Files are only compared byte for byte when their fingerprints match.
+    The files moved or linked by calbum must be reported to the index (see
+    add and remove).
+    """
+
+    def __init__(self):
+        # {directory: {name: [size, fingerprint, content path]}}
+        self._directories = {}
+        # {(directory, name, extension): [next suffix, {size: [suffixes]}]}
+        self._suffixes = {}
+
+    def destination_path(self, source, dest, extension):
+        """
+        Return the path among dest+extension, dest(1)+extension, ... whose
+        content is the same as source or, if none, the next free one.  The
+        suffixes are allocated from a counter kept for each path prefix, the
+        returned free path is reserved.
+        :rtype: unicode
+        """
+        directory, name = os.path.split(dest)
+        entries = self._entries(directory)
+        source_size = os.stat(source).st_size
+        suffixes = self._suffixes_of(directory, name, extension, entries)
+
+        source_fingerprint = None
+        for suffix in list(suffixes[1].get(source_size, ())):
+            file_name = suffixed_name(name, suffix, extension)
+            path = os.path.join(directory, file_name)
+            entry = entries.get(file_name)
+            if entry is None or entry[0] != source_size:
+                continue
+            stats.count('collision_probes')
+            content = entry[2] or path
+            try:
+                if source_fingerprint is None:
+                    source_fingerprint = fingerprint(source)
+                if entry[1] is None:
+                    entry[1] = fingerprint(content)
+                if entry[1] == source_fingerprint and \
+                        is_same_file(source, content):
+                    return path
+            except (IOError, OSError):
+                if os.path.exists(content):
+                    raise
+                # Removed behind our back
+                del entries[file_name]
+
+        while True:
+            stats.count('collision_probes')
+            suffix = suffixes[0]
+            suffixes[0] += 1
+            path = os.path.join(
+                directory, suffixed_name(name, suffix, extension))
+            if not os.path.exists(path):
+                suffixes[1].setdefault(source_size, []).append(suffix)
+                return path
+            # Created behind our back
+            if is_same_file(source, path):
+                return path
+
+    def add(self, path, content_path=None):
+        """
+        Report a file created in a destination directory.
+        :param content_path: the path where the content of the file is
+                             until it is moved there, if it differs
+        """
+        directory, name = os.path.split(path)
+        entries = self._directories.get(directory)
+        if entries is not None:
+            if content_path == path:
+                content_path = None
+            entries[name] = [
+                os.stat(content_path or path).st_size, None, content_path]
+
+    def remove(self, path):
+        """
+        Report a file removed from a destination directory.
+        """
+        directory, name = os.path.split(path)
+        entries = self._directories.get(directory)
+        if entries is not None:
+            entries.pop(name, None)
+
+    def _suffixes_of(self, directory, name, extension, entries):
+        key = (directory, name, extension)
+        suffixes = self._suffixes.get(key)
+        if suffixes is None:
+            suffixes = [0, {}]
+            while True:
+                entry = entries.get(
+                    suffixed_name(name, suffixes[0], extension))
+                if entry is None:
+                    break
+                suffixes[1].setdefault(entry[0], []).append(suffixes[0])
+                suffixes[0] += 1
+            self._suffixes[key] = suffixes
+        return suffixes
+
+    def _entries(self, directory):
+        if directory not in self._directories:
+            entries = {}
+            try:
+                directory_entries = list(scandir(directory or u'.'))
+            except OSError:
+                directory_entries = []
+            for entry in directory_entries:
+                try:
+                    if not entry.is_dir():
+                        entries[entry.name] = [
+                            entry.stat().st_size, None, None]
+                except OSError:
+                    pass
+            self._directories[directory] = entries
+        return self._directories[directory]
+
+
+def suffixed_name(name, suffix, extension):
+    """
+    Return the file name of a name and its extension, with a collision
+    suffix: name.ext, name(1).ext, name(2).ext, ...
+    """
+    if suffix:
+        return u'{}({}){}'.format(name, suffix, extension)
+    return u'{}{}'.format(name, extension)
+
+
+# Number of bytes read at the start and at the end of the files for their
+# fingerprint
+fingerprint_size = 64 * 1024
+
+
+def fingerprint(path, size=None):
+    """
+    Return a hash of the size, the first and the last bytes of a file.
+    :param size: the number of bytes read at the start and the end of the
+                 file (default: fingerprint_size)
+    :rtype: str
+    """
+    if size is None:
+        size = fingerprint_size
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        digest.update(str(file_size).encode('ascii'))
+        digest.update(f.read(size))
+        if file_size > 2 * size:
+            f.seek(-size, os.SEEK_END)
+        digest.update(f.read(size))
+    return digest.digest()
+
+
 def string_to_datetime(string, tzinfo):
     date_string = ''.join(c for c in string if c.isdigit())[0:14]
     if len(date_string) != 14:
         raise ValueError('time data in "{}" must contain 14 digits'.format(string))
     dt = datetime.strptime(date_string, '%Y%m%d%H%M%S')
     return dt.replace(tzinfo=tzinfo)
+
+
+def subsec_to_microseconds(string):
+    """
+    Return the microseconds of an EXIF fraction of second ('25' for 0.25
+    second).
+    :rtype: int
+    """
+    digits = ''.join(c for c in string if c.isdigit())[0:6]
+    if not digits:
+        return 0
+    return int(digits.ljust(6, '0'))
@@ -0,0 +1,101 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import _strptime  # datetime.strptime imports it unsafely on first use
+import collections
+from multiprocessing.pool import ThreadPool
+import Queue
+import threading
+
+_END = object()
+
+
+def _resolve_timestamp(media):
+    media.timestamp()
+    return media
+
+
+def resolve_timestamps(medias, jobs=1):
+    """
+    Resolve the timestamp of the medias concurrently using a pool of
+    threads.  The medias are yielded in their original order once their
+    timestamp is known, so the consumer may act on them sequentially.  At
+    most a few medias per job are resolved ahead of the consumer.
+    :param medias: an iterable of Media
+    :param jobs: the number of threads resolving timestamps
+    """
+    if jobs <= 1:
+        for media in medias:
+            yield media
+        return
+
+    pool = ThreadPool(jobs)
+    pending = collections.deque()
+    try:
+        for media in medias:
+            pending.append(pool.apply_async(_resolve_timestamp, (media,)))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class Lookahead(object):
+    """
+    Iterates over an iterable consumed by a background thread at most
+    `size` items ahead of the consumer.  The length of a Lookahead is the
+    number of items read from the iterable so far.
+    """
+
+    def __init__(self, iterable, size):
+        self.exhausted = False
+        self._produced = 0
+        self._closed = False
+        self._queue = Queue.Queue(size)
+        self._thread = threading.Thread(target=self._produce, args=(iterable,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self._produced
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if self._closed:
+                    return
+                self._produced += 1
+                self._queue.put((item, None))
+            self._queue.put((_END, None))
+        except Exception as e:
+            self._queue.put((_END, e))
+
+    def __iter__(self):
+        try:
+            while True:
+                item, error = self._queue.get()
+                if item is _END:
+                    self.exhausted = True
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            self._closed = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
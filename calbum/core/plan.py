@@ -0,0 +1,209 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import json
+import os
+
+from calbum.core import model
+
+# name: mkdir, move, remove, link or save_event
+# source: the path of the moved or linked file, None for the others
+# path: the path created or removed by the operation
+Operation = namedtuple('Operation', 'name source path')
+
+# The order in which the operations are done
+_order = ('mkdir', 'move', 'remove', 'link', 'save_event')
+
+
+class Plan(model.FileOperations):
+    """
+    File operations recorded to be done later, once the destination of
+    every media is known.  The planned files are seen at their new path by
+    the file system elements while their content stays where it is (see
+    content_path).  The name conflicts with planned files are only resolved
+    with a destination index (see FileSystemElement.destination_index).
+    """
+
+    deferred = True
+
+    def __init__(self, directories=None):
+        """
+        :param directories: the DirectoryCache of the destination
+                            directories
+        """
+        super(Plan, self).__init__(directories)
+        self._operations = []
+        # {planned path: index of the move in _operations}
+        self._moves = {}
+        # {planned path: path where the content currently is}
+        self._contents = {}
+        # Paths moved or removed by the plan
+        self._removed = set()
+        # {folder: event}
+        self._events = {}
+
+    def __len__(self):
+        return len(self._operations) + len(self._events)
+
+    def exists(self, path):
+        if path in self._contents:
+            return True
+        if path in self._removed:
+            return False
+        return os.path.exists(path)
+
+    def content_path(self, path):
+        return self._contents.get(path, path)
+
+    def move(self, source, dest):
+        content = self._contents.pop(source, source)
+        if source in self._moves:
+            # Moved again, only its last destination matters
+            index = self._moves.pop(source)
+            self._operations[index] = self._operations[index]._replace(
+                path=dest)
+        else:
+            index = len(self._operations)
+            self._operations.append(Operation('move', source, dest))
+            self._removed.add(source)
+        self._moves[dest] = index
+        self._contents[dest] = content
+        self._removed.discard(dest)
+
+    def remove(self, path):
+        content = self._contents.pop(path, path)
+        if path in self._moves:
+            index = self._moves.pop(path)
+            self._operations[index] = Operation('remove', None, content)
+        else:
+            self._operations.append(Operation('remove', None, path))
+            self._removed.add(path)
+
+    def link(self, source, dest):
+        self._operations.append(Operation('link', source, dest))
+        self._contents[dest] = self.content_path(source)
+        self._removed.discard(dest)
+
+    def save_event(self, event, folder):
+        self._events[folder] = event
+
+    def event(self, folder):
+        """
+        Return the event saved in a folder by the plan.
+        :rtype: model.Event
+        """
+        return self._events[folder]
+
+    def operations(self):
+        """
+        Return the operations in the order they are done: the creation of
+        the missing directories, the moves, the removals, the links and the
+        writes of events, each grouped by directory.  An operation on a path
+        written or read by a previous operation is done after it, like the
+        moves of a file to the previous path of another one.
+        :rtype: list of Operation
+        """
+        directories = set(
+            os.path.dirname(operation.path)
+            for operation in self._operations
+            if operation.name in ('move', 'link'))
+        directories.update(self._events)
+        operations = [
+            Operation('mkdir', None, directory)
+            for directory in sorted(directories)
+            if directory and not self._directory_exists(directory)]
+        rounds = self._rounds()
+        operations.extend(
+            operation for _, operation in sorted(
+                zip(rounds, self._operations),
+                key=lambda r_o: (r_o[0], _order.index(r_o[1].name),
+                                 os.path.dirname(r_o[1].path))))
+        operations.extend(
+            Operation('save_event', None, folder)
+            for folder in sorted(self._events))
+        return operations
+
+    def _rounds(self):
+        """
+        Return the round of each planned operation: the operations of a
+        round don't depend on each other and can be done in any order once
+        those of the previous rounds are done.
+        :rtype: list of int
+        """
+        # {path: last round writing it}, {path: last round reading it}
+        written = {}
+        read = {}
+        rounds = []
+        for operation in self._operations:
+            reads = [operation.source] if operation.source else []
+            writes = reads + [operation.path] \
+                if operation.name == 'move' else [operation.path]
+            current = 1 + max(
+                [written.get(path, -1) for path in reads + writes] +
+                [read.get(path, -1) for path in writes])
+            for path in writes:
+                written[path] = current
+            for path in reads:
+                read[path] = max(read.get(path, -1), current)
+            rounds.append(current)
+        return rounds
+
+    def perform(self, operation):
+        """
+        Do an operation of the plan.
+        :type operation: Operation
+        """
+        if operation.name == 'mkdir':
+            self._make_directory(operation.path)
+        elif operation.name == 'move':
+            super(Plan, self).move(operation.source, operation.path)
+            if model.Media.metadata_cache is not None:
+                status = os.stat(operation.path)
+                model.Media.metadata_cache.relocate(
+                    model.FileStatus(status.st_dev, status.st_ino,
+                                     status.st_size, status.st_mtime),
+                    operation.path)
+        elif operation.name == 'remove':
+            super(Plan, self).remove(operation.path)
+        elif operation.name == 'link':
+            super(Plan, self).link(operation.source, operation.path)
+        elif operation.name == 'save_event':
+            super(Plan, self).save_event(
+                self._events[operation.path], operation.path)
+        index = model.FileSystemElement.destination_index
+        if index is not None and operation.name in ('move', 'link'):
+            # The content is now at its planned path
+            index.add(operation.path)
+
+    def execute(self):
+        """
+        Do all the operations of the plan.
+        :return: the number of operations done
+        """
+        operations = self.operations()
+        for operation in operations:
+            self.perform(operation)
+        return len(operations)
+
+    def dump(self, f):
+        """
+        Write the operations of the plan as JSON in a file.
+        """
+        json.dump({'operations': [
+            dict((key, value) for key, value in operation._asdict().items()
+                 if value is not None)
+            for operation in self.operations()
+        ]}, f, indent=2, separators=(',', ': '), sort_keys=True)
+        f.write('\n')
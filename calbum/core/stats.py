@@ -0,0 +1,126 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+
+
+class Stats(object):
+    """
+    The time spent in the stages of a run and the counters of what they
+    did.  The time of a stage is summed over the threads working on it, the
+    stages may be nested (exiftool is part of timestamps for instance).
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def report(self):
+        """
+        :rtype: dict
+        :return: the seconds spent in each stage and the counters
+        """
+        with self._lock:
+            return {
+                'seconds': dict(
+                    (stage, round(seconds, 6))
+                    for stage, seconds in self.timings.items()),
+                'counters': dict(self.counters),
+            }
+
+    def summary(self):
+        """
+        Return the stages, slowest first, and the counters as text.
+        :rtype: str
+        """
+        report = self.report()
+        lines = ['Stages (seconds):']
+        lines.extend(
+            '  {:<24}{:>12.3f}'.format(stage, seconds)
+            for stage, seconds in sorted(
+                report['seconds'].items(), key=lambda s: -s[1]))
+        lines.append('Counters:')
+        lines.extend(
+            '  {:<24}{:>12}'.format(name, value)
+            for name, value in sorted(report['counters'].items()))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, f):
+        """
+        Write the report as JSON in a file.
+        """
+        json.dump(self.report(), f, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        f.write('\n')
+
+
+class _Timer(object):
+    __slots__ = ('stats', 'stage', 'start')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.stage, time.time() - self.start)
+
+
+class _NoTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_timer = _NoTimer()
+
+# The Stats of the run, if any.  The stages and counters are reported
+# through the count and timer functions, they do nothing without it.
+current = None
+
+
+def count(name, value=1):
+    """
+    Add a value to a counter of the current Stats.
+    """
+    stats = current
+    if stats is not None:
+        stats.count(name, value)
+
+
+def timer(stage):
+    """
+    Return a context manager adding the time spent in it to a stage of the
+    current Stats.
+    """
+    stats = current
+    if stats is None:
+        return _no_timer
+    return _Timer(stats, stage)
@@ -0,0 +1,217 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from calbum.core.model import scandir
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_event_header = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """
+    A minimal binding of the Linux inotify API.
+    """
+
+    def __init__(self):
+        library = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        wd = self._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self, timeout=None):
+        """
+        Read the pending events, waiting at most timeout seconds for one.
+        :return: a list of (wd, mask, name) tuples
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append(
+                (wd, mask, name.decode(sys.getfilesystemencoding())))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InboxWatcher(object):
+    """
+    Watches a directory tree and reports the files once they are complete:
+    closed after being written, moved in, or with a size that stayed the
+    same for settle_time seconds (files found by a scan).
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, path, settle_time=5.0, excluded_dirs=(),
+                 exclude_hidden=False):
+        """
+        :param path: the directory to watch
+        :param settle_time: seconds without size change for a scanned file
+                            to be complete
+        :param excluded_dirs: names of the directories that are not watched
+        :param exclude_hidden: ignore the names starting with a dot
+        """
+        self.path = path
+        self.settle_time = settle_time
+        self.excluded_dirs = excluded_dirs
+        self.exclude_hidden = exclude_hidden
+        self._inotify = Inotify()
+        self._directories = {}
+        self._pending = {}
+        self._ready = []
+        self._watch(path, scan=False)
+
+    def _watch(self, path, scan=True):
+        """
+        Watch a directory and its sub-directories.  With scan, the files
+        already in them are checked until their size is stable.
+        """
+        try:
+            wd = self._inotify.add_watch(path, self.mask)
+        except OSError:
+            return
+        self._directories[wd] = path
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            return
+        for entry in entries:
+            if self._excluded(entry.name):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in self.excluded_dirs:
+                    self._watch(entry.path, scan)
+            elif scan:
+                self._check_later(entry.path)
+
+    def _excluded(self, name):
+        return self.exclude_hidden and name.startswith('.')
+
+    def _check_later(self, path):
+        self._pending[path] = (None, time.time())
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._watch(self.path)
+            return
+        directory = self._directories.get(wd)
+        if mask & IN_IGNORED:
+            self._directories.pop(wd, None)
+        if directory is None or not name or self._excluded(name):
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and \
+                    name not in self.excluded_dirs:
+                self._watch(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._pending.pop(path, None)
+            self._ready.append(path)
+        elif mask & IN_CREATE:
+            self._check_later(path)
+
+    def _settled(self):
+        """
+        Move the pending files whose size and modification time didn't
+        change for settle_time seconds to the ready files.
+        """
+        now = time.time()
+        for path, (status, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+                current = (stat.st_size, stat.st_mtime)
+            except OSError:
+                del self._pending[path]
+                continue
+            if current != status:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle_time:
+                del self._pending[path]
+                self._ready.append(path)
+
+    def poll(self, timeout=None):
+        """
+        Wait for complete files.
+        :param timeout: the maximum number of seconds to wait for a file
+        :return: the paths of the complete files, in order of completion
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._ready:
+            wait = None
+            if self._pending:
+                wait = min(self.settle_time, 1.0)
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+                wait = remaining if wait is None else min(wait, remaining)
+            for event in self._inotify.read(wait):
+                self._handle(*event)
+            self._settled()
+            if deadline is not None and time.time() >= deadline:
+                break
+        ready, self._ready = self._ready, []
+        return ready
+
+    def __contains__(self, directory):
+        """
+        Test whether a directory is watched.
+        :param directory: an absolute path
+        """
+        return any(os.path.abspath(path) == directory
+                   for path in self._directories.values())
+
+    def __iter__(self):
+        while True:
+            for path in self.poll():
+                yield path
+
+    def close(self):
+        self._inotify.close()
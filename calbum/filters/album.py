@@ -12,33 +12,83 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from calbum.core import model
+from calbum.core import model, stats
+from calbum.core.index import EventIndex
 from calbum.filters import MediaFilter
 
 
 class CalendarAlbumFilter(MediaFilter):
 
     def __init__(self, albums_path, events, save_events):
-        self.events = list(events)
         self.albums_path = albums_path
         self.save_events = save_events
- 
+        self.events = []
+        self.events_albums_path = {}
+        self._index = None
+        # {event: album}, the albums found during the run
+        self._albums = {}
+        # The events saved in their album, the last one saved in an album
+        # shared by several events is kept
+        self._saved_events = set()
+        self.add_events(events)
+
+    def add_events(self, events, albums_path=None):
+        """
+        Add the events of another calendar to the filter.
+        :param events: the events of the calendar
+        :param albums_path: the path of the albums of these events
+        (default: the albums path of the filter)
+        """
+        for event in events:
+            self.events.append(event)
+            if albums_path is not None:
+                self.events_albums_path[event] = albums_path
+        self._index = None
+
+    def index(self):
+        """
+        :rtype: EventIndex
+        :return: the index of all the events of the filter
+        """
+        if self._index is None:
+            self._index = EventIndex(self.events)
+        return self._index
+
+    def album(self, event):
+        """
+        :rtype: model.Album
+        :return: the album of an event, created once for the run
+        """
+        album = self._albums.get(event)
+        if album is None:
+            albums_path = self.events_albums_path.get(event, self.albums_path)
+            album = model.Album.from_event(event, albums_path)
+            self._albums[event] = album
+        return album
+
     def albums_for(self, media):
-        for event in self.events:
-            if media.timestamp() in event.time_period():
-                yield (model.Album.from_event(event, self.albums_path),
-                       event)
+        timestamp = media.timestamp()
+        with stats.timer('events'):
+            events = list(self.index().events_at(timestamp))
+        for event in events:
+            yield (self.album(event), event)
+
+    def save_event(self, album, event):
+        """
+        Save the event of an album in the album, once for the run.
+        """
+        if self.save_events and event not in self._saved_events:
+            self._saved_events.add(event)
+            album.file_operations.save_event(event, album.path())
 
     def move(self, media):
         album, event = next(self.albums_for(media), (None, None))
         if album:
             album.timeline().move(media)
-            if self.save_events:
-                event.save_to(album.path())
+            self.save_event(album, event)
 
     def link(self, media):
         for album, event in self.albums_for(media):
             album.timeline().link(media)
-            if self.save_events:
-                event.save_to(album.path())
+            self.save_event(album, event)
 
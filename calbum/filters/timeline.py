@@ -12,18 +12,54 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from calbum.core import model
+import logging
+
+from calbum.core import model, stats
 from calbum.filters import MediaFilter
 
 
 class TimelineFilter(MediaFilter):
 
-    def __init__(self, timeline_path):
+    def __init__(self, timeline_path, library=None, skip_duplicates=True):
+        """
+        :param timeline_path: the path of the timeline
+        :param library: the LibraryIndex of the timeline, kept up to date
+                        with the medias added to the timeline
+        :param skip_duplicates: the medias already present in the timeline
+                                are skipped, requires the library
+        """
         self.timeline = model.TimeLine(timeline_path)
+        self.library = library
+        self.skip_duplicates = skip_duplicates
+
+    def duplicate_of(self, media):
+        """
+        Return the path of a copy of the media found anywhere in the
+        timeline, or None.
+        """
+        if self.library is None or not self.skip_duplicates:
+            return None
+        with stats.timer('duplicates'):
+            duplicate = self.library.find(media.path())
+        if duplicate is not None:
+            stats.count('duplicates')
+            logging.info('"{}" is already in the timeline: "{}"'.format(
+                media.path(), duplicate))
+        return duplicate
 
     def move(self, media):
+        duplicate = self.duplicate_of(media)
+        if duplicate is not None:
+            media.replace_with(duplicate)
+            return
         self.timeline.move(media)
+        if self.library is not None:
+            self.library.add(media.path(), media.stat().st_size)
 
     def link(self, media):
-        self.timeline.link(media)
+        if self.duplicate_of(media) is not None:
+            return
+        path = self.timeline.link(media)
+        if self.library is not None:
+            self.library.add(path, media.stat().st_size)
 
@@ -12,15 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import gzip
+import hashlib
+import httplib
+import logging
 import os
+import socket
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
 
 import urllib2
 import datetime
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import dateutil
 import dateutil.rrule
+import dateutil.tz
 import icalendar
+from icalendar.timezone_cache import _timezone_cache
+import pytz
 
+from calbum.core.index import is_floating, time_key
 from calbum.core.model import TimePeriod, Event
 
 
@@ -32,12 +49,59 @@ class CalendarTimePeriod(TimePeriod):
 
     default_duration = datetime.timedelta()
 
+    # Length in seconds of the windows in which the occurrences of recurrent
+    # time periods are expanded, when a timestamp of the window is first
+    # checked.
+    occurrences_window = 366 * 24 * 3600
+
     def __init__(self, event):
         """
         :type event: icalendar.Event
         """
-        self._event = event
+        start = event['dtstart'].dt
+        duration = event.get('duration')
+        end = event.get('dtend')
+        if duration:
+            duration = duration.dt
+        elif end:
+            duration = end.dt - start
+        else:
+            duration = self.default_duration
+        rrule = event.get('rrule')
+        self._setup(
+            start=start,
+            duration=duration,
+            rrule=rrule.to_ical() if rrule is not None else None,
+            exdates=list(get_datetime_list(event.get('exdate', []))))
+
+    def _setup(self, start, duration, rrule, exdates):
+        self._start = start
+        self._duration = duration
+        self._rrule = rrule
+        self._exdates = exdates
         self._recurrence = None
+        self._occurrences = {}
+
+    @classmethod
+    def from_values(cls, start, duration, rrule=None, exdates=()):
+        """
+        Create a time period without an icalendar event.
+        :param start: the start of the first occurrence
+        :param duration: the duration of each occurrence
+        :param rrule: the recurrence rule (RRULE value)
+        :param exdates: the excluded occurrences (EXDATE values)
+        :rtype: CalendarTimePeriod
+        """
+        time_period = cls.__new__(cls)
+        time_period._setup(start, duration, rrule, list(exdates))
+        return time_period
+
+    def values(self):
+        """
+        Get the values needed to create this time period with from_values.
+        :rtype: tuple
+        """
+        return self._start, self._duration, self._rrule, self._exdates
 
     def start(self):
         """
@@ -45,7 +109,7 @@ class CalendarTimePeriod(TimePeriod):
         :return: start of this time period as a datetime.
         :rtype: datetime.datetime
         """
-        return self._event['dtstart'].dt
+        return self._start
 
     def duration(self):
         """
@@ -53,13 +117,7 @@ class CalendarTimePeriod(TimePeriod):
         :return: duration of the first occurrence of this time period.
         :rtype: datetime.timedelta
         """
-        duration = self._event.get('duration')
-        end = self._event.get('dtend')
-        if duration:
-            return duration.dt
-        if end:
-            return end.dt - self.start()
-        return self.default_duration
+        return self._duration
 
     def recurrence(self):
         """
@@ -68,20 +126,94 @@ class CalendarTimePeriod(TimePeriod):
         :rtype: dateutil.rrule.rruleset
         """
         if self._recurrence is None:
-            if 'rrule' in self._event:
+            if self._rrule is not None:
                 self._recurrence = dateutil.rrule.rruleset()
                 self._recurrence.rrule(dateutil.rrule.rrulestr(
-                    self._event['rrule'].to_ical(), dtstart=self.start()))
-                for dt in get_datetime_list(self._event.get('exdate', [])):
+                    self._rrule, dtstart=self.start()))
+                for dt in self._exdates:
                     self._recurrence.exdate(dt)
         return self._recurrence
 
+    def span(self):
+        """
+        Get the time covered by all the occurrences of this time period.
+        :return: a (start, end) tuple, end is None for endless recurrences.
+        :rtype: tuple
+        """
+        start = self.start()
+        rule = self.recurrence()
+        if rule is None:
+            return start, start + self.duration()
+
+        if 'UNTIL=' not in self._rrule and 'COUNT=' not in self._rrule:
+            return start, None
+
+        last = start
+        for last in rule:
+            pass
+        return start, last + self.duration()
+
+    def _time_key(self, timestamp):
+        """
+        Get the key of a timestamp comparable with the occurrences keys, or
+        None if the timestamp can't be compared with this time period.
+        """
+        start = self.start()
+        if not isinstance(start, datetime.datetime):
+            return time_key(timestamp.replace(tzinfo=None))
+        if is_floating(start) == is_floating(timestamp):
+            return time_key(timestamp)
+        return None
+
+    def _window(self, key):
+        if self.recurrence() is None:
+            return None
+        return int(key // self.occurrences_window)
+
+    def _occurrences_in(self, window):
+        """
+        Get the sorted start and end keys of the occurrences that may include
+        a timestamp of a window.  The first occurrence starts before the
+        window, the others start in it.
+        """
+        if window not in self._occurrences:
+            start = self.start()
+            rule = self.recurrence()
+            if rule is None:
+                starts = [start]
+            else:
+                window_start = self._from_key(window * self.occurrences_window)
+                window_end = self._from_key(
+                    (window + 1) * self.occurrences_window)
+                starts = [rule.before(window_start, True) or start]
+                starts.extend(rule.between(window_start, window_end))
+            duration = self.duration()
+            self._occurrences[window] = (
+                [time_key(s) for s in starts],
+                [time_key(s + duration) for s in starts])
+        return self._occurrences[window]
+
+    def _from_key(self, key):
+        if is_floating(self.start()):
+            return datetime.datetime(1970, 1, 1) + \
+                datetime.timedelta(seconds=key)
+        return datetime.datetime.fromtimestamp(key, dateutil.tz.tzutc())
+
     def __contains__(self, timestamp):
         """
         Checks if the time period includes a specific timestamp.
         :param timestamp: a timezone aware datetime
         :return: if the timestamp is included
         """
+        key = self._time_key(timestamp)
+        if key is None:
+            return self._includes(timestamp)
+
+        starts, ends = self._occurrences_in(self._window(key))
+        index = bisect.bisect_right(starts, key) - 1
+        return index >= 0 and key < ends[index]
+
+    def _includes(self, timestamp):
         start = self.start()
         duration = self.duration()
         rule = self.recurrence()
@@ -108,13 +240,25 @@ class CalendarEvent(Event):
         :type event: icalendar.Event
         """
         self._event = event
+        self._title = None
         self._time_period = CalendarTimePeriod(self._event)
 
+    def component(self):
+        """
+        Returns the icalendar event.
+        :rtype: icalendar.Event
+        """
+        if self._event is None:
+            self._event = icalendar.Event.from_ical(self._ical)
+        return self._event
+
     def title(self):
         """
         Returns the title of the event (uses the summary field).
         """
-        return self._event['summary']
+        if self._title is not None:
+            return self._title
+        return self.component()['summary']
 
     def time_period(self):
         """
@@ -128,14 +272,60 @@ class CalendarEvent(Event):
 
     def save_to(self, folder):
         """
-        Save this event in the provided folder (event.ics).
+        Save this event in the provided folder (event.ics), unless it is
+        already saved there.
         :param folder: The folder where the event will be saved
         """
         event_path = os.path.join(folder, 'event.ics')
+        content = self.to_ical()
+        try:
+            with open(event_path) as f:
+                if f.read(len(content) + 1) == content:
+                    return
+        except IOError:
+            pass
         with open(event_path, 'w') as f:
-            cal = icalendar.Calendar()
-            cal.add_component(self._event)
-            f.write(cal.to_ical())
+            f.write(content)
+
+    def to_ical(self):
+        """
+        Returns this event as the content of an ical file.
+        :rtype: str
+        """
+        cal = icalendar.Calendar()
+        cal.add_component(self.component())
+        return cal.to_ical()
+
+    def compact(self):
+        """
+        Returns this event as a tuple of plain values that can be pickled
+        and turned back into an event without parsing it (see
+        from_compact).  The time zones are kept by TZID, those that aren't
+        in the Olson database must be registered again before the event is
+        turned back (see CalendarCache).
+        :rtype: tuple
+        """
+        start, duration, rrule, exdates = self._time_period.values()
+        return (unicode(self.title()), self.component().to_ical(),
+                plain_datetime(start), duration, rrule,
+                [plain_datetime(dt) for dt in exdates])
+
+    @classmethod
+    def from_compact(cls, compact):
+        """
+        Create an event from the values returned by compact.  The icalendar
+        event is only parsed when it is needed.
+        :rtype: CalendarEvent
+        """
+        title, ical, start, duration, rrule, exdates = compact
+        event = cls.__new__(cls)
+        event._event = None
+        event._ical = ical
+        event._title = title
+        event._time_period = CalendarTimePeriod.from_values(
+            zoned_datetime(*start), duration, rrule,
+            [zoned_datetime(*dt) for dt in exdates])
+        return event
 
     @classmethod
     def load_from_file(cls, path):
@@ -143,22 +333,212 @@ class CalendarEvent(Event):
             return cls.load_from_stream(f)
 
     @classmethod
-    def load_from_url(cls, url):
-        response = urllib2.urlopen(url)
-        if response.code != 200:
-            raise Exception("Something went wrong. HTTP response code: %s" % response.code)
-        return cls.load_from_stream(response)
+    def load_from_url(cls, url, cache=None, timeout=None, window=None):
+        """
+        Download the events of an ical feed.  With a cache, the feed is only
+        downloaded again when it has changed (conditional GET) and the
+        cached events are used when the server fails or doesn't respond in
+        time.
+        :param url: the url of the feed
+        :param cache: a CalendarCache
+        :param timeout: the maximum number of seconds to wait for the server
+        :param window: a (start, end) tuple of datetimes (see
+                       load_from_stream)
+        :rtype: list
+        """
+        cached = cache.load(url) if cache is not None else None
+        request = urllib2.Request(url, headers={'Accept-Encoding': 'gzip'})
+        validators, _ = cached or ({}, None)
+        # The cached events can only be revalidated for the same window
+        if cached is not None and validators.get('window') == window:
+            if validators.get('etag'):
+                request.add_header('If-None-Match', validators['etag'])
+            if validators.get('last_modified'):
+                request.add_header(
+                    'If-Modified-Since', validators['last_modified'])
+
+        timezones = {}
+        try:
+            if timeout is None:
+                response = urllib2.urlopen(request)
+            else:
+                response = urllib2.urlopen(request, timeout=timeout)
+            if response.code != 200:
+                raise Exception("Something went wrong. HTTP response code: %s" % response.code)
+            headers = response.info()
+            stream = response
+            if headers.get('Content-Encoding') == 'gzip':
+                stream = gzip.GzipFile(fileobj=StringIO(response.read()))
+            events = cls.load_from_stream(stream, window, timezones)
+        except urllib2.HTTPError as e:
+            if e.code == 304 and cached is not None:
+                return cached[1]
+            return cls._load_stale(url, cached, e)
+        except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+            return cls._load_stale(url, cached, e)
+
+        if cache is not None:
+            cache.store(url, {
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'window': window,
+            }, events, timezones)
+        return events
+
+    @classmethod
+    def load_from_urls(cls, urls, cache=None, timeout=None, window=None):
+        """
+        Download the events of several ical feeds concurrently.
+        :param urls: the urls of the feeds
+        :param cache: a CalendarCache
+        :param timeout: the maximum number of seconds to wait for a server
+        :param window: a (start, end) tuple of datetimes (see
+                       load_from_stream)
+        :rtype: list
+        :return: the list of events of each feed, in the order of the urls
+        """
+        def load(url):
+            return cls.load_from_url(url, cache, timeout, window)
+
+        urls = list(urls)
+        if len(urls) < 2:
+            return [load(url) for url in urls]
+        pool = ThreadPool(len(urls))
+        try:
+            return pool.map(load, urls)
+        finally:
+            pool.terminate()
 
     @classmethod
-    def load_from_stream(cls, stream):
+    def _load_stale(cls, url, cached, error):
+        if cached is None:
+            raise error
+        logging.warning('Using the cached events of "{}": {}'.format(
+            url, repr(error)))
+        return cached[1]
+
+    @classmethod
+    def load_from_stream(cls, stream, window=None, timezones=None):
+        """
+        Read the events of an ical feed one component at a time.  With a
+        window, the events that don't recur and end before or start after
+        it are skipped without being parsed.
+        :param stream: a file-like object with the content of the feed
+        :param window: a (start, end) tuple of datetimes, either can be None
+        :param timezones: a dictionary filled with the VTIMEZONE components
+                          of the feed as ical, by TZID
+        :rtype: list
+        """
         events = []
-        cal = icalendar.Calendar.from_ical(stream.read().decode('UTF-8'))
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                events.append(cls(event=component))
+        for name, lines in iter_components(stream):
+            if name == 'VTIMEZONE':
+                # Registers the time zone for the events that refer to it
+                timezone = icalendar.Timezone.from_ical(u'\r\n'.join(lines))
+                if timezones is not None:
+                    timezones[unicode(timezone['TZID'])] = timezone.to_ical()
+            elif name == 'VEVENT':
+                if window is not None and not may_overlap(lines, window):
+                    continue
+                events.append(cls(
+                    event=icalendar.Event.from_ical(u'\r\n'.join(lines))))
         return events
 
 
+class CalendarCache(object):
+    """
+    Keeps the events of ical feeds on disk, in a compact form, with the
+    validators (ETag and Last-Modified) and the time zones of the downloaded
+    feed.
+    """
+
+    def __init__(self, path, read_only=False):
+        """
+        :param path: the directory of the cached feeds
+        :param read_only: the feeds are only loaded, never stored
+        """
+        self.path = path
+        self.read_only = read_only
+
+    def _file_path(self, url, extension):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + extension)
+
+    def load(self, url):
+        """
+        Load the cached events of a feed, registering its time zones.  A
+        cache that can't be read is ignored.
+        :return: a (validators, events) tuple or None
+        :rtype: tuple
+        """
+        try:
+            with open(self._file_path(url, '.events'), 'rb') as f:
+                validators, timezones, compact_events = pickle.load(f)
+        except IOError:
+            return None
+        except Exception as e:
+            logging.warning('Ignoring the cached events of "{}": {}'.format(
+                url, repr(e)))
+            return None
+        try:
+            for ical in timezones.values():
+                icalendar.Timezone.from_ical(ical)
+            return validators, [CalendarEvent.from_compact(c)
+                                for c in compact_events]
+        except Exception as e:
+            logging.warning('Ignoring the cached events of "{}": {}'.format(
+                url, repr(e)))
+            return None
+
+    def store(self, url, validators, events, timezones=None):
+        """
+        Store the events of a feed.
+        :param validators: a dictionary with the 'etag' and 'last_modified'
+                           of the feed and the 'window' of the events
+        :param events: the CalendarEvent of the feed
+        :param timezones: the VTIMEZONE components of the feed as ical, by
+                          TZID
+        """
+        if self.read_only:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        path = self._file_path(url, '.events')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((validators, timezones or {},
+                         [event.compact() for event in events]), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+
+
+def plain_datetime(dt):
+    """
+    Get a datetime as values that can be pickled without its time zone: the
+    local datetime and the TZID of its time zone (see zoned_datetime).
+    :rtype: tuple
+    """
+    if not isinstance(dt, datetime.datetime) or dt.tzinfo is None:
+        return dt, None
+    zone = getattr(dt.tzinfo, 'zone', None)
+    if zone is None:
+        return dt.astimezone(pytz.utc).replace(tzinfo=None), 'UTC'
+    return dt.replace(tzinfo=None), zone
+
+
+def zoned_datetime(dt, zone):
+    """
+    Get the datetime of the values returned by plain_datetime.  The time
+    zones that aren't in the Olson database must be registered by their
+    VTIMEZONE component.
+    """
+    if zone is None:
+        return dt
+    try:
+        tzinfo = pytz.timezone(zone)
+    except pytz.UnknownTimeZoneError:
+        tzinfo = _timezone_cache[zone]
+    return tzinfo.localize(dt)
+
+
 def get_datetime_list(obj):
     if not isinstance(obj, list):
         obj = [obj]
@@ -168,3 +548,93 @@ def get_datetime_list(obj):
                 yield dt.dt
         else:
             yield item.dt
+
+
+def iter_lines(stream):
+    """
+    Read the unfolded content lines of an ical feed.
+    :param stream: a file-like object with the content of the feed
+    :rtype: iterator
+    """
+    current = None
+    for line in stream:
+        line = line.rstrip(b'\r\n')
+        if current is not None and line[:1] in (b' ', b'\t'):
+            current += line[1:]
+            continue
+        if current:
+            yield current.decode('UTF-8')
+        current = line
+    if current:
+        yield current.decode('UTF-8')
+
+
+def iter_components(stream):
+    """
+    Read the top-level components of an ical feed one at a time.
+    :param stream: a file-like object with the content of the feed
+    :rtype: iterator
+    :return: (name, lines) tuples where lines are the unfolded content lines
+             of the component, from its BEGIN line to its END line
+    """
+    name = None
+    lines = []
+    for line in iter_lines(stream):
+        upper = line.upper()
+        if name is None:
+            if upper.startswith('BEGIN:') and upper != 'BEGIN:VCALENDAR':
+                name = upper[6:]
+                lines = [line]
+            continue
+        lines.append(line)
+        if upper == 'END:' + name:
+            yield name, lines
+            name = None
+
+
+def may_overlap(lines, window):
+    """
+    Tells, only from the text of its DTSTART, DTEND and DURATION, whether a
+    VEVENT may overlap a time window.  Time zones are ignored by comparing
+    days with a margin, so recurring events and events that can't be read
+    this way are always kept.
+    :param lines: the unfolded content lines of the VEVENT
+    :param window: a (start, end) tuple of datetimes, either can be None
+    :rtype: bool
+    """
+    values = {}
+    depth = 0
+    for line in lines[1:-1]:
+        upper = line.upper()
+        if upper.startswith('BEGIN:'):
+            depth += 1
+        elif upper.startswith('END:'):
+            depth -= 1
+        elif depth == 0:
+            head, _, value = line.partition(':')
+            values.setdefault(head.split(';', 1)[0].upper(), value.strip())
+
+    if 'RRULE' in values or 'RDATE' in values or 'DTSTART' not in values:
+        return True
+    try:
+        first_day = _parse_day(values['DTSTART'])
+        last_day = first_day
+        if 'DTEND' in values:
+            last_day = max(last_day, _parse_day(values['DTEND']))
+        elif 'DURATION' in values:
+            duration = icalendar.vDuration.from_ical(values['DURATION'])
+            last_day = max(last_day, first_day + duration)
+    except ValueError:
+        return True
+
+    margin = datetime.timedelta(days=2)
+    window_start, window_end = window
+    if window_end is not None and first_day - margin > window_end.date():
+        return False
+    if window_start is not None and last_day + margin < window_start.date():
+        return False
+    return True
+
+
+def _parse_day(value):
+    return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
@@ -0,0 +1,175 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import struct
+
+from calbum.core import stats
+
+
+class ExifHeaderError(Exception):
+    pass
+
+
+# The tags read from the first IFD and from the Exif IFD, named like exifread
+# names them.
+image_tags = {
+    0x0132: 'Image DateTime',
+}
+exif_tags = {
+    0x9003: 'EXIF DateTimeOriginal',
+    0x9004: 'EXIF DateTimeDigitized',
+    0x9290: 'EXIF SubSecTime',
+    0x9291: 'EXIF SubSecTimeOriginal',
+    0x9292: 'EXIF SubSecTimeDigitized',
+}
+
+exif_ifd_tag = 0x8769
+ascii_type = 2
+
+
+def read_tags(path, header=None):
+    """
+    Read the timestamp tags of a JPEG or TIFF based picture (TIFF, CR2, NEF,
+    ARW, DNG, ...) straight from its header.  The file is memory-mapped, so
+    only the few pages holding the IFDs are actually read.
+    :param path: the path of the picture
+    :param header: the first bytes of the file, if they were already read.
+                   The file is only opened when the tags are beyond them.
+    :rtype: dict
+    :return: the values of the tags found, by exifread name
+    :raise ExifHeaderError: when the file isn't a JPEG or TIFF file or its
+                            header can't be read
+    """
+    if header is not None:
+        try:
+            return _read_tags(header)
+        except struct.error:
+            pass
+
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error) as e:
+            raise ExifHeaderError('Cannot map "{}": {}'.format(path, e))
+    try:
+        return _read_tags(buf)
+    except struct.error as e:
+        raise ExifHeaderError('Truncated header in "{}": {}'.format(path, e))
+    finally:
+        buf.close()
+
+
+def read_tiff_tags(buf, offset=0):
+    """
+    Read the timestamp tags of a TIFF header held in a buffer, like the Exif
+    item of a HEIF image.
+    :param buf: the buffer
+    :param offset: the offset of the TIFF header in the buffer
+    :rtype: dict
+    :return: the values of the tags found, by exifread name
+    :raise ExifHeaderError: when the TIFF header can't be read
+    """
+    try:
+        return _read_tiff(buf, offset)
+    except struct.error as e:
+        raise ExifHeaderError('Truncated TIFF header: {}'.format(e))
+
+
+def _read_tags(buf):
+    if buf[0:2] == b'\xff\xd8':
+        offset = _find_jpeg_exif(buf)
+        if offset is None:
+            return {}
+    elif buf[0:4] in (b'II*\x00', b'MM\x00*'):
+        offset = 0
+    else:
+        raise ExifHeaderError('Not a JPEG or TIFF file')
+    return _read_tiff(buf, offset)
+
+
+def _find_jpeg_exif(buf):
+    """
+    Walk the JPEG markers up to the image data.
+    :return: the offset of the TIFF header of the Exif APP1 segment or None
+    """
+    position = 2
+    while True:
+        prefix, marker = struct.unpack_from('BB', buf, position)
+        stats.count('metadata_bytes_read', 4)
+        if prefix != 0xff:
+            raise ExifHeaderError('No JPEG marker at {}'.format(position))
+        if marker == 0xff:
+            # Fill byte
+            position += 1
+        elif marker in (0xda, 0xd9):
+            # Start of scan or end of image: no Exif segment
+            return None
+        elif marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            # Markers without a segment
+            position += 2
+        else:
+            length, = struct.unpack_from('>H', buf, position + 2)
+            if (marker == 0xe1 and
+                    buf[position + 4:position + 10] == b'Exif\x00\x00'):
+                return position + 10
+            position += 2 + length
+
+
+def _read_tiff(buf, base):
+    byte_order = buf[base:base + 2]
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        raise ExifHeaderError('Invalid TIFF byte order')
+    magic, first_ifd = struct.unpack_from(endian + 'HI', buf, base + 2)
+    if magic != 42:
+        raise ExifHeaderError('Invalid TIFF header')
+
+    tags = {}
+    exif_ifd = _read_ifd(buf, base, endian, first_ifd, image_tags, tags)
+    if exif_ifd:
+        _read_ifd(buf, base, endian, exif_ifd, exif_tags, tags)
+    return tags
+
+
+def _read_ifd(buf, base, endian, offset, names, tags):
+    """
+    Read the ASCII entries of an IFD whose tag is in names.
+    :return: the offset of the Exif IFD, if the IFD points to it
+    """
+    exif_ifd = None
+    count, = struct.unpack_from(endian + 'H', buf, base + offset)
+    stats.count('metadata_bytes_read', 2 + 12 * count)
+    for i in range(count):
+        entry = base + offset + 2 + 12 * i
+        tag, value_type, length = struct.unpack_from(endian + 'HHI', buf, entry)
+        if tag == exif_ifd_tag:
+            exif_ifd, = struct.unpack_from(endian + 'I', buf, entry + 8)
+        elif tag in names and value_type == ascii_type:
+            start = entry + 8
+            if length > 4:
+                start = base + struct.unpack_from(endian + 'I', buf, start)[0]
+            if start + length > len(buf):
+                raise struct.error('Value beyond the end of the buffer')
+            value = buf[start:start + length].split(b'\x00', 1)[0]
+            stats.count('metadata_bytes_read', length)
+            try:
+                tags[names[tag]] = value.decode('ascii')
+            except UnicodeDecodeError:
+                raise ExifHeaderError(
+                    'Invalid ASCII value for tag {:#06x}'.format(tag))
+    return exif_ifd
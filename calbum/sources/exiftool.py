@@ -11,57 +11,203 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
+import json
 import logging
-
+import os
 import subprocess
+import threading
 
-from calbum.core.model import Media, string_to_datetime
+from calbum.core import stats
+from calbum.core.model import Media, string_to_datetime, \
+    subsec_to_microseconds
 
 exiftool_path = 'exiftool'
 
 
+class ExifToolError(Exception):
+    pass
+
+
+class ExifToolProcess(object):
+    """
+    A long-lived exiftool process driven through its -stay_open interface.
+    """
+
+    def __init__(self, path):
+        with open(os.devnull, 'w') as devnull:
+            self._process = subprocess.Popen(
+                [path, '-stay_open', 'True', '-@', '-'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=devnull)
+        stats.count('exiftool_processes')
+
+    def execute(self, *args):
+        """
+        Run exiftool with the provided arguments and return its output.
+        :param args: the command line arguments, one per line
+        :rtype: str
+        """
+        stats.count('exiftool_executions')
+        with stats.timer('exiftool'):
+            return self._execute(args)
+
+    def _execute(self, args):
+        stdin = self._process.stdin
+        for arg in args + ('-execute',):
+            if isinstance(arg, unicode):
+                arg = arg.encode('utf-8')
+            stdin.write(arg + b'\n')
+        stdin.flush()
+
+        output = []
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise ExifToolError(
+                    'exiftool exited with code {}'.format(self._process.poll()))
+            if line.rstrip() == b'{ready}':
+                return b''.join(output)
+            output.append(line)
+
+    def close(self):
+        """
+        Ask the process to terminate and wait for it.
+        """
+        try:
+            self._process.stdin.write(b'-stay_open\nFalse\n')
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self._process.wait()
+
+
+class ExifToolPool(object):
+    """
+    A thread-safe pool of long-lived exiftool processes.  Processes are
+    started on demand, up to `size`, and reused across calls.
+    """
+
+    def __init__(self, size=1):
+        self.size = size
+        self._idle = []
+        self._started = 0
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        with self._condition:
+            while not self._idle and self._started >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return ExifToolProcess(exiftool_path)
+        except Exception:
+            self._discard()
+            raise
+
+    def _release(self, process):
+        with self._condition:
+            self._idle.append(process)
+            self._condition.notify()
+
+    def _discard(self):
+        with self._condition:
+            self._started -= 1
+            self._condition.notify()
+
+    def metadata(self, path, tags):
+        """
+        Extract the requested tags of a file.
+        :param path: the file to inspect
+        :param tags: the exiftool tag names to extract
+        :return: the tags found, by name
+        :rtype: dict
+        """
+        args = ('-json',) + tuple('-' + tag for tag in tags) + (path,)
+        process = self._acquire()
+        try:
+            output = process.execute(*args)
+        except Exception:
+            process.close()
+            self._discard()
+            raise
+        self._release(process)
+
+        entries = json.loads(output.decode('utf-8')) if output.strip() else []
+        if not entries:
+            return {}
+        entries[0].pop('SourceFile', None)
+        return entries[0]
+
+    def close(self):
+        """
+        Terminate all the idle exiftool processes.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+        for process in idle:
+            process.close()
+
+
 class ExifToolMedia(Media):
+    __slots__ = ()
     file_extensions = ()
 
+    pool = ExifToolPool()
+
     timestamp_tags = (
-        'Creation Date',
-        'Date/Time Original',
-        'Track Create Date',
-        'Media Create Date',
-        'Create Date',
+        'CreationDate',
+        'DateTimeOriginal',
+        'TrackCreateDate',
+        'MediaCreateDate',
+        'CreateDate',
     )
 
+    # The tags holding the fraction of second of the timestamp tags
+    subsec_tags = {
+        'DateTimeOriginal': 'SubSecTimeOriginal',
+        'CreateDate': 'SubSecTimeDigitized',
+    }
+
     def exif(self):
         if not hasattr(self, '_exif'):
+            self._exif = self.cached_tags('exiftool')
+            if self._exif is not None:
+                return self._exif
             self._exif = {}
             try:
-                for line in subprocess.check_output(
-                        [exiftool_path, self.path()]).splitlines():
-                    key, value = line.split(':', 1)
-                    self._exif[key.strip()] = value.strip()
-            except OSError as e:
-                logging.warning('Metadata processing with "{}" '
-                                'failed for "{}": {}'.format(
-                    exiftool_path, self.path(), repr(e)))
-            except subprocess.CalledProcessError as e:
+                self._exif = self.pool.metadata(
+                    self.content_path(),
+                    self.timestamp_tags + tuple(self.subsec_tags.values()))
+                self.cache_tags('exiftool', self._exif)
+            except (IOError, OSError, ValueError, ExifToolError) as e:
                 logging.warning('Metadata processing with "{}" '
                                 'failed for "{}": {}'.format(
                     exiftool_path, self.path(), repr(e)))
         return self._exif
 
-    def timestamp(self):
+    def resolve_timestamp(self):
         """
         Return the creation timestamp of the media as defined in the EXIF
-        metadata ('Creation Date', 'Date/Time Original', 'Track Create Date',
-        'Media Create Date', 'Create Date')
+        metadata ('CreationDate', 'DateTimeOriginal', 'TrackCreateDate',
+        'MediaCreateDate', 'CreateDate') with its fraction of second
+        (SubSecTime tags) when it is known.
         :rtype: datetime
         """
         try:
             exif = self.exif()
-            d = next((
-                string_to_datetime(str(exif[tag]), self.time_zone)
-                for tag in self.timestamp_tags if tag in exif), None)
-            if d:
+            tag = next(
+                (tag for tag in self.timestamp_tags if tag in exif), None)
+            if tag:
+                d = string_to_datetime(str(exif[tag]), self.time_zone)
+                subsec_tag = self.subsec_tags.get(tag)
+                if subsec_tag in exif:
+                    d = d.replace(microsecond=subsec_to_microseconds(
+                        str(exif[subsec_tag])))
                 if d.tzinfo is None or d.tzinfo.utcoffset(d) is None:
                     d = d.replace(tzinfo=self.time_zone)
                 if d.year < 1970:
@@ -74,23 +220,30 @@ class ExifToolMedia(Media):
         except ValueError:
             pass
 
-        return super(ExifToolMedia, self).timestamp()
+        return super(ExifToolMedia, self).resolve_timestamp()
 
     def location(self):
         raise NotImplemented()
 
 
+atexit.register(ExifToolMedia.pool.close)
+
+
 class JpegPicture(ExifToolMedia):
+    __slots__ = ()
     file_extensions = ('.jpeg', '.jpg')
 
 
 class TiffPicture(ExifToolMedia):
+    __slots__ = ()
     file_extensions = ('.tiff', '.tif')
 
 
 class VideoMP4Media(ExifToolMedia):
+    __slots__ = ()
     file_extensions = ('.mp4',)
 
 
 class Video3GPMedia(ExifToolMedia):
+    __slots__ = ()
     file_extensions = ('.3gp', '.3g2')
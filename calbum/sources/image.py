@@ -14,10 +14,14 @@
 
 import exifread
 
-from calbum.core.model import Media, string_to_datetime
+from calbum.core import stats
+from calbum.core.model import Media, string_to_datetime, \
+    subsec_to_microseconds
+from calbum.sources import exifheader
 
 
 class ExifPicture(Media):
+    __slots__ = ()
     file_extensions = ()
 
     timestamp_tags = (
@@ -27,36 +31,107 @@ class ExifPicture(Media):
         'DateTime'
     )
 
+    # The tags holding the fraction of second of the timestamp tags
+    subsec_tags = {
+        'Image DateTime': 'EXIF SubSecTime',
+        'EXIF DateTimeOriginal': 'EXIF SubSecTimeOriginal',
+        'EXIF DateTimeDigitized': 'EXIF SubSecTimeDigitized',
+    }
+
     def exif(self):
         if not hasattr(self, '_exif'):
-            with open(self.path()) as f:
-                self._exif = exifread.process_file(f)
+            self._exif = self.cached_tags('exifread')
+            if self._exif is None:
+                try:
+                    self._exif = exifheader.read_tags(
+                        self.content_path(), self.header)
+                except exifheader.ExifHeaderError:
+                    stats.count('exifread_fallbacks')
+                    with open(self.content_path(), 'rb') as f:
+                        self._exif = exifread.process_file(f, details=False)
+                        stats.count('metadata_bytes_read', f.tell())
+                values = ((tag, ascii_value(self._exif[tag]))
+                          for tag in self.timestamp_tags +
+                          tuple(self.subsec_tags.values())
+                          if tag in self._exif)
+                self.cache_tags('exifread', dict(
+                    (tag, value) for tag, value in values
+                    if value is not None))
+                self.header = None
         return self._exif
 
-    def timestamp(self):
+    def resolve_timestamp(self):
         """
         Return the creation timestamp of the media as defined in the EXIF
         metadata ('Image DateTime', 'EXIF DateTimeOriginal',
-        'EXIF DateTimeDigitized', 'DateTime')
+        'EXIF DateTimeDigitized', 'DateTime') with its fraction of second
+        (SubSecTime tags) when it is known.
         :rtype: datetime
         """
         exif = self.exif()
 
-        d = next((
-            string_to_datetime(str(exif[tag]), self.time_zone)
-            for tag in self.timestamp_tags if tag in exif), None)
+        d = None
+        for tag in self.timestamp_tags:
+            value = ascii_value(exif.get(tag))
+            if value is not None:
+                d = string_to_datetime(value, self.time_zone)
+                subsec = ascii_value(exif.get(self.subsec_tags.get(tag)))
+                if subsec is not None:
+                    d = d.replace(microsecond=subsec_to_microseconds(subsec))
+                break
         if d and (d.tzinfo is None or d.tzinfo.utcoffset(d) is None):
             d = d.replace(tzinfo=self.time_zone)
 
-        return d or super(ExifPicture, self).timestamp()
+        return d or super(ExifPicture, self).resolve_timestamp()
 
     def location(self):
         raise NotImplemented()
 
 
+def ascii_value(value):
+    """
+    Return the value of a tag as an ASCII string, or None if it holds other
+    characters (the tag is then ignored).
+    :rtype: str
+    """
+    if value is None:
+        return None
+    try:
+        if not isinstance(value, unicode):
+            value = str(value).decode('ascii')
+        return value.encode('ascii')
+    except UnicodeError:
+        return None
+
+
 class JpegPicture(ExifPicture):
+    __slots__ = ()
     file_extensions = ('.jpeg', '.jpg')
+    file_signatures = ((0, b'\xff\xd8\xff'),)
 
 
 class TiffPicture(ExifPicture):
+    __slots__ = ()
     file_extensions = ('.tiff', '.tif')
+    file_signatures = ((0, b'II*\x00'), (0, b'MM\x00*'))
+
+
+class CanonRawPicture(ExifPicture):
+    __slots__ = ()
+    file_extensions = ('.cr2',)
+    file_signatures = ((0, b'II*\x00\x10\x00\x00\x00CR'),)
+
+
+class NikonRawPicture(ExifPicture):
+    __slots__ = ()
+    file_extensions = ('.nef',)
+
+
+class SonyRawPicture(ExifPicture):
+    __slots__ = ()
+    file_extensions = ('.arw',)
+
+
+class DigitalNegativePicture(ExifPicture):
+    __slots__ = ()
+    file_extensions = ('.dng',)
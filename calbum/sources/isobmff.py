@@ -0,0 +1,344 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import logging
+import os
+import struct
+
+from calbum.core import stats
+from calbum.sources import exifheader
+from calbum.sources.exiftool import ExifToolMedia
+
+
+class IsoBoxError(Exception):
+    pass
+
+
+# Times of the movie and media headers are seconds since this date (UTC)
+epoch = datetime.datetime(1904, 1, 1)
+
+# The first box of a MP4, 3GP, QuickTime or HEIF file
+leading_boxes = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide',
+                 b'pnot')
+
+apple_creation_date_key = b'com.apple.quicktime.creationdate'
+
+# The Exif tags of HEIF images, named like exiftool names them
+exif_tags = {
+    'EXIF DateTimeOriginal': 'DateTimeOriginal',
+    'EXIF DateTimeDigitized': 'CreateDate',
+    'Image DateTime': 'ModifyDate',
+    'EXIF SubSecTime': 'SubSecTime',
+    'EXIF SubSecTimeOriginal': 'SubSecTimeOriginal',
+    'EXIF SubSecTimeDigitized': 'SubSecTimeDigitized',
+}
+
+# The largest Exif item read from HEIF images
+max_exif_size = 1024 * 1024
+
+
+def read_tags(path):
+    """
+    Read the creation dates of an ISO base media file (MP4, 3GP, QuickTime,
+    HEIF, ...) by seeking from box to box, without reading the media data.
+    :param path: the path of the file
+    :rtype: dict
+    :return: the dates found, by exiftool tag name ('CreationDate',
+             'DateTimeOriginal', 'TrackCreateDate', 'MediaCreateDate',
+             'CreateDate', ...)
+    :raise IsoBoxError: when the file isn't an ISO base media file or its
+                        boxes can't be read
+    """
+    tags = {}
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        try:
+            for index, (box_type, start, box_end) in enumerate(
+                    iter_boxes(f, 0, end)):
+                if index == 0 and box_type not in leading_boxes:
+                    raise IsoBoxError('Not an ISO base media file')
+                if box_type == b'moov':
+                    _read_movie(f, start, box_end, tags)
+                elif box_type == b'meta':
+                    _read_item_metadata(f, start + 4, box_end, tags)
+        except struct.error as e:
+            raise IsoBoxError('Invalid box in "{}": {}'.format(path, e))
+        except exifheader.ExifHeaderError as e:
+            raise IsoBoxError('Invalid Exif item in "{}": {}'.format(path, e))
+    return tags
+
+
+def iter_boxes(f, start, end):
+    """
+    Iterate over the boxes found between two offsets of a file.
+    :rtype: iterator
+    :return: (type, payload offset, end offset) tuples
+    """
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack('>I4s', _read(f, 8))
+        payload = position + 8
+        if size == 1:
+            size, = struct.unpack('>Q', _read(f, 8))
+            payload += 8
+        elif size == 0:
+            size = end - position
+        if size < payload - position or position + size > end:
+            raise IsoBoxError('Invalid size for box "{}" at {}'.format(
+                box_type, position))
+        yield box_type, payload, position + size
+        position += size
+
+
+def _read(f, size):
+    data = f.read(size)
+    stats.count('metadata_bytes_read', len(data))
+    if len(data) != size:
+        raise IsoBoxError('Truncated box at {}'.format(f.tell()))
+    return data
+
+
+def _read_version(f, start):
+    f.seek(start)
+    version, = struct.unpack('>B', _read(f, 4)[:1])
+    return version
+
+
+def _read_creation_time(f, start):
+    """
+    Read the creation time of a movie, track or media header.
+    :rtype: str
+    :return: the time as exiftool formats it or None when it isn't set
+    """
+    if _read_version(f, start) == 1:
+        seconds, = struct.unpack('>Q', _read(f, 8))
+    else:
+        seconds, = struct.unpack('>I', _read(f, 4))
+    if not seconds:
+        return None
+    try:
+        d = epoch + datetime.timedelta(seconds=seconds)
+    except (OverflowError, ValueError):
+        raise IsoBoxError('Invalid creation time at {}'.format(start))
+    return '{:04d}:{:02d}:{:02d} {:02d}:{:02d}:{:02d}'.format(
+        d.year, d.month, d.day, d.hour, d.minute, d.second)
+
+
+def _set_creation_time(f, start, tags, tag):
+    value = _read_creation_time(f, start)
+    if value is not None and tag not in tags:
+        tags[tag] = value
+
+
+def _read_movie(f, start, end, tags):
+    for box_type, payload, box_end in iter_boxes(f, start, end):
+        if box_type == b'mvhd':
+            _set_creation_time(f, payload, tags, 'CreateDate')
+        elif box_type == b'trak':
+            _read_track(f, payload, box_end, tags)
+        elif box_type == b'meta':
+            _read_movie_metadata(f, payload, box_end, tags)
+
+
+def _read_track(f, start, end, tags):
+    for box_type, payload, box_end in iter_boxes(f, start, end):
+        if box_type == b'tkhd':
+            _set_creation_time(f, payload, tags, 'TrackCreateDate')
+        elif box_type == b'mdia':
+            for child_type, child, _ in iter_boxes(f, payload, box_end):
+                if child_type == b'mdhd':
+                    _set_creation_time(f, child, tags, 'MediaCreateDate')
+
+
+def _read_movie_metadata(f, start, end, tags):
+    """
+    Read the creation date written by Apple devices in the QuickTime
+    metadata (keys and ilst boxes).
+    """
+    f.seek(start)
+    if _read(f, 4) == b'\x00\x00\x00\x00':
+        # MP4 meta boxes are full boxes, QuickTime ones are not
+        start += 4
+
+    keys = {}
+    for box_type, payload, box_end in iter_boxes(f, start, end):
+        if box_type == b'keys':
+            f.seek(payload + 4)
+            count, = struct.unpack('>I', _read(f, 4))
+            position = payload + 8
+            for index in range(1, count + 1):
+                f.seek(position)
+                size, = struct.unpack('>I', _read(f, 4))
+                if size < 8 or position + size > box_end:
+                    raise IsoBoxError('Invalid metadata key')
+                keys[index] = _read(f, size - 4)[4:]
+                position += size
+        elif box_type == b'ilst':
+            for item_type, item, item_end in iter_boxes(f, payload, box_end):
+                index, = struct.unpack('>I', item_type)
+                if keys.get(index) != apple_creation_date_key:
+                    continue
+                for data_type, data, data_end in iter_boxes(
+                        f, item, item_end):
+                    if data_type == b'data' and data_end - data > 8:
+                        f.seek(data + 8)
+                        tags['CreationDate'] = _read(
+                            f, data_end - data - 8).decode('utf-8')
+
+
+def _read_item_metadata(f, start, end, tags):
+    """
+    Read the Exif item of a HEIF image.
+    """
+    exif_items = set()
+    locations = {}
+    for box_type, payload, box_end in iter_boxes(f, start, end):
+        if box_type == b'iinf':
+            exif_items.update(_read_exif_items(f, payload, box_end))
+        elif box_type == b'iloc':
+            locations.update(_read_item_locations(f, payload))
+
+    for item in exif_items:
+        if item not in locations:
+            continue
+        data = b''
+        for offset, length in locations[item]:
+            f.seek(offset)
+            data += f.read(min(length, max_exif_size - len(data)))
+        if len(data) < 4:
+            continue
+        tiff_offset, = struct.unpack('>I', data[:4])
+        for tag, value in exifheader.read_tiff_tags(
+                data, 4 + tiff_offset).items():
+            if tag in exif_tags:
+                tags[exif_tags[tag]] = value
+        return
+
+
+def _read_exif_items(f, start, end):
+    version = _read_version(f, start)
+    start += 6 if version == 0 else 8
+    for box_type, payload, _ in iter_boxes(f, start, end):
+        if box_type != b'infe':
+            continue
+        version = _read_version(f, payload)
+        if version < 2:
+            continue
+        item_id, = struct.unpack(
+            '>H' if version == 2 else '>I', _read(f, 2 if version == 2 else 4))
+        _read(f, 2)
+        if _read(f, 4) == b'Exif':
+            yield item_id
+
+
+def _read_item_locations(f, start):
+    """
+    :rtype: dict
+    :return: the (offset, length) extents of the items stored in the file,
+             by item id
+    """
+    version = _read_version(f, start)
+    sizes, = struct.unpack('>H', _read(f, 2))
+    offset_size = sizes >> 12
+    length_size = (sizes >> 8) & 0xf
+    base_offset_size = (sizes >> 4) & 0xf
+    index_size = sizes & 0xf if version in (1, 2) else 0
+
+    locations = {}
+    count = _read_int(f, 2 if version < 2 else 4)
+    for _ in range(count):
+        item_id = _read_int(f, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = _read_int(f, 2) & 0xf
+        _read(f, 2)
+        base_offset = _read_int(f, base_offset_size)
+        extents = []
+        for _ in range(_read_int(f, 2)):
+            _read_int(f, index_size)
+            offset = _read_int(f, offset_size)
+            extents.append((base_offset + offset, _read_int(f, length_size)))
+        # Only the items stored in the file itself (not in the idat box)
+        if construction_method == 0:
+            locations[item_id] = extents
+    return locations
+
+
+def _read_int(f, size):
+    value = 0
+    for byte in struct.unpack('>{}B'.format(size), _read(f, size)):
+        value = (value << 8) | byte
+    return value
+
+
+class IsoMedia(ExifToolMedia):
+    """
+    A media whose creation dates are read from its ISO base media file
+    boxes, with exiftool only as a fallback.
+    """
+    __slots__ = ()
+    file_extensions = ()
+
+    def exif(self):
+        if not hasattr(self, '_exif'):
+            tags = self.cached_tags('isobmff')
+            if tags is None:
+                try:
+                    tags = read_tags(self.content_path())
+                except (IOError, IsoBoxError) as e:
+                    logging.debug('Using exiftool for "{}": {}'.format(
+                        self.path(), repr(e)))
+                    return super(IsoMedia, self).exif()
+                self.cache_tags('isobmff', tags)
+            self._exif = tags
+        return self._exif
+
+
+def brands(*names):
+    """
+    :return: the file signatures of the major brands of a file type
+    """
+    return tuple((4, b'ftyp' + name) for name in names)
+
+
+class VideoMP4Media(IsoMedia):
+    __slots__ = ()
+    file_extensions = ('.mp4',)
+    file_signatures = brands(b'isom', b'iso2', b'mp41', b'mp42', b'avc1')
+
+
+class Video3GPMedia(IsoMedia):
+    __slots__ = ()
+    file_extensions = ('.3gp', '.3g2')
+    file_signatures = brands(b'3gp', b'3g2')
+
+
+class VideoMOVMedia(IsoMedia):
+    __slots__ = ()
+    file_extensions = ('.mov',)
+    file_signatures = brands(b'qt  ') + ((4, b'moov'), (4, b'wide'))
+
+
+class VideoM4VMedia(IsoMedia):
+    __slots__ = ()
+    file_extensions = ('.m4v',)
+    file_signatures = brands(b'M4V')
+
+
+class HeicPicture(IsoMedia):
+    __slots__ = ()
+    file_extensions = ('.heic',)
+    file_signatures = brands(b'heic', b'heix', b'mif1')
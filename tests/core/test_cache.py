@@ -0,0 +1,272 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from dateutil import tz
+from hamcrest import assert_that, is_, none
+
+from calbum.core import model
+from calbum.core.cache import BatchedDatabase, LibraryIndex, MetadataCache
+
+
+class TestBatchedDatabase(unittest.TestCase):
+
+    class Database(BatchedDatabase):
+        schema = ('CREATE TABLE IF NOT EXISTS items (name TEXT)',)
+
+        def add(self, name):
+            self._execute('INSERT INTO items (name) VALUES (?)', (name,))
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, '.calbum', 'items.db')
+        self.database = self.Database(self.path, batch_size=2)
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.folder)
+
+    def committed(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                'SELECT COUNT(*) FROM items').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_writes_are_committed_in_batches(self):
+        self.database.add('a')
+        assert_that(self.committed(), is_(0))
+
+        self.database.add('b')
+        assert_that(self.committed(), is_(2))
+
+    def test_flush_commits_the_pending_writes(self):
+        self.database.add('a')
+        self.database.flush()
+
+        assert_that(self.committed(), is_(1))
+
+    def test_in_memory_database_creates_no_file(self):
+        self.database.close()
+        self.database = self.Database(':memory:')
+        self.database.add('a')
+
+        assert_that(os.listdir(self.folder), is_(['.calbum']))
+        assert_that(os.listdir(os.path.join(self.folder, '.calbum')),
+                    is_(['items.db']))
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, 'picture.jpeg')
+        with open(self.file_path, 'w') as f:
+            f.write('content')
+        self.cache = MetadataCache(
+            os.path.join(self.folder, '.calbum', 'metadata.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.folder)
+
+    def test_get_unknown_file(self):
+        assert_that(self.cache.get(os.stat(self.file_path)), is_(none()))
+
+    def test_tags_and_timestamp_are_kept(self):
+        stat = os.stat(self.file_path)
+        self.cache.put_tags(stat, self.file_path, 'exifread',
+                            {'EXIF DateTimeOriginal': '2012:05:01 01:00:00'})
+        self.cache.put_timestamp(stat, self.file_path,
+                                 '2012-05-01T01:00:00', 'tzutc()')
+        self.cache.close()
+
+        self.cache = MetadataCache(
+            os.path.join(self.folder, '.calbum', 'metadata.db'))
+        assert_that(self.cache.get(stat), is_({
+            'path': self.file_path,
+            'timestamp': '2012-05-01T01:00:00',
+            'time_zone': 'tzutc()',
+            'tags': {
+                'exifread': {'EXIF DateTimeOriginal': '2012:05:01 01:00:00'}
+            },
+        }))
+
+    def test_entries_follow_renamed_files(self):
+        self.cache.put_tags(os.stat(self.file_path), self.file_path,
+                            'exiftool', {})
+        new_path = os.path.join(self.folder, 'renamed.jpeg')
+        os.rename(self.file_path, new_path)
+
+        assert_that(
+            self.cache.get(os.stat(new_path))['tags'],
+            is_({'exiftool': {}}))
+
+    def test_entries_of_modified_files_are_ignored(self):
+        stat = os.stat(self.file_path)
+        self.cache.put_tags(stat, self.file_path, 'exiftool', {})
+        with open(self.file_path, 'a') as f:
+            f.write('more content')
+
+        assert_that(self.cache.get(os.stat(self.file_path)), is_(none()))
+
+    def test_prune_removes_missing_files(self):
+        stat = os.stat(self.file_path)
+        self.cache.put_tags(stat, self.file_path, 'exiftool', {})
+        other_path = os.path.join(self.folder, 'other.jpeg')
+        shutil.copy(self.file_path, other_path)
+        other_stat = os.stat(other_path)
+        self.cache.put_tags(other_stat, other_path, 'exiftool', {})
+        os.remove(other_path)
+
+        assert_that(self.cache.prune(), is_(1))
+        assert_that(self.cache.get(other_stat), is_(none()))
+        assert_that(self.cache.get(stat)['path'], is_(self.file_path))
+
+    def test_prune_from_another_directory(self):
+        stat = os.stat(self.file_path)
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.folder)
+            self.cache.put_tags(stat, 'picture.jpeg', 'exiftool', {})
+            os.chdir(os.path.dirname(self.folder))
+
+            assert_that(self.cache.prune(), is_(0))
+        finally:
+            os.chdir(cwd)
+        assert_that(self.cache.get(stat)['path'], is_(self.file_path))
+
+
+class TestMediaMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, 'picture.jpeg')
+        with open(self.file_path, 'w') as f:
+            f.write('content')
+        model.Media.metadata_cache = MetadataCache(
+            os.path.join(self.folder, 'metadata.db'))
+
+    def tearDown(self):
+        model.Media.metadata_cache.close()
+        model.Media.metadata_cache = None
+        shutil.rmtree(self.folder)
+
+    def test_timestamp_from_metadata_is_cached(self):
+        class FakeExifMedia(model.Media):
+            def resolve_timestamp(self):
+                return datetime(2012, 5, 1, 1, 0, 0, tzinfo=self.time_zone)
+        FakeExifMedia(self.file_path).timestamp()
+        resolved_timestamps = model.Media.resolved_timestamps
+
+        assert_that(
+            FakeExifMedia(self.file_path).timestamp(),
+            is_(datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())))
+        assert_that(
+            model.Media.resolved_timestamps, is_(resolved_timestamps))
+
+    def test_timestamp_from_path_is_not_cached(self):
+        model.Media(self.file_path).timestamp()
+
+        assert_that(
+            model.Media.metadata_cache.get(os.stat(self.file_path)),
+            is_(none()))
+
+    def test_tags_are_cached(self):
+        model.Media(self.file_path).cache_tags('exiftool', {'CreateDate': 'x'})
+
+        assert_that(
+            model.Media(self.file_path).cached_tags('exiftool'),
+            is_({'CreateDate': 'x'}))
+        assert_that(
+            model.Media(self.file_path).cached_tags('exifread'),
+            is_(none()))
+
+
+class TestLibraryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = self.create('picture.jpeg', 'content')
+        self.library = LibraryIndex(
+            os.path.join(self.folder, '.calbum', 'library.db'))
+        self.library.add(self.file_path, os.stat(self.file_path).st_size)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.folder)
+
+    def create(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_find_copy(self):
+        copy_path = self.create('copy.jpeg', 'content')
+
+        assert_that(self.library.find(copy_path), is_(self.file_path))
+
+    def test_find_ignores_same_size_with_other_content(self):
+        other_path = self.create('other.jpeg', 'CONTENT')
+
+        assert_that(self.library.find(other_path), is_(none()))
+
+    def test_find_ignores_the_file_itself(self):
+        assert_that(self.library.find(self.file_path), is_(none()))
+
+    def test_index_is_kept(self):
+        self.library.close()
+        self.library = LibraryIndex(
+            os.path.join(self.folder, '.calbum', 'library.db'))
+        copy_path = self.create('copy.jpeg', 'content')
+
+        assert_that(len(self.library), is_(1))
+        assert_that(self.library.find(copy_path), is_(self.file_path))
+
+    def test_index_is_used_from_other_directories(self):
+        self.library.close()
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.folder)
+            self.library = LibraryIndex(
+                os.path.join('.calbum', 'timeline.db'), root='.')
+            self.library.add('picture.jpeg', os.stat('picture.jpeg').st_size)
+            self.library.close()
+
+            os.chdir(os.path.dirname(self.folder))
+            timeline = os.path.basename(self.folder)
+            self.library = LibraryIndex(
+                os.path.join(timeline, '.calbum', 'timeline.db'),
+                root=timeline)
+            copy_path = self.create('copy.jpeg', 'content')
+
+            assert_that(self.library.find(copy_path),
+                        is_(os.path.join(timeline, 'picture.jpeg')))
+        finally:
+            os.chdir(cwd)
+
+    def test_missing_files_are_removed(self):
+        copy_path = self.create('copy.jpeg', 'content')
+        os.remove(self.file_path)
+
+        assert_that(self.library.find(copy_path), is_(none()))
+        assert_that(len(self.library), is_(0))
@@ -0,0 +1,135 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime, date, timedelta
+import random
+import unittest
+
+from dateutil import tz
+from hamcrest import assert_that, is_
+from icalendar import Event
+
+from calbum.core import index
+from calbum.sources.calendar import CalendarEvent
+
+
+def vevent(summary, *lines):
+    return CalendarEvent(Event.from_ical('\n'.join(
+        ('BEGIN:VEVENT', 'SUMMARY:' + summary) + lines + ('END:VEVENT',))))
+
+
+class TestTimeKey(unittest.TestCase):
+
+    def test_aware_datetime_is_converted_to_utc(self):
+        assert_that(
+            index.time_key(datetime(1970, 1, 1, 1, tzinfo=tz.tzoffset(None, 3600))),
+            is_(0.0))
+
+    def test_floating_values_are_converted_as_utc(self):
+        assert_that(index.time_key(date(1970, 1, 2)), is_(86400.0))
+        assert_that(index.time_key(datetime(1970, 1, 2, 0, 0, 1)), is_(86401.0))
+
+    def test_is_floating(self):
+        assert_that(index.is_floating(date(2015, 1, 1)), is_(True))
+        assert_that(index.is_floating(datetime(2015, 1, 1)), is_(True))
+        assert_that(
+            index.is_floating(datetime(2015, 1, 1, tzinfo=tz.tzutc())),
+            is_(False))
+
+
+class TestIntervalTree(unittest.TestCase):
+
+    def test_search_matches_a_linear_scan(self):
+        rnd = random.Random(42)
+        intervals = []
+        for value in range(300):
+            start = rnd.randint(0, 1000)
+            end = start + rnd.choice([0, 1, 5, 50, 500, float('inf')])
+            intervals.append((start, end, value))
+        tree = index.IntervalTree(intervals)
+
+        for point in range(-10, 1600, 7):
+            assert_that(
+                sorted(tree.search(point)),
+                is_(sorted(v for s, e, v in intervals if s <= point < e)))
+
+    def test_search_in_empty_tree(self):
+        assert_that(list(index.IntervalTree([]).search(1)), is_([]))
+
+
+class TestEventIndex(unittest.TestCase):
+
+    def test_events_at_matches_a_linear_scan(self):
+        events = [
+            vevent('all day', 'DTSTART;VALUE=DATE:20150501',
+                   'DTEND;VALUE=DATE:20150503'),
+            vevent('utc', 'DTSTART:20150502T100000Z',
+                   'DTEND:20150502T120000Z'),
+            vevent('zoned', 'DTSTART;TZID=America/Toronto:20150502T080000',
+                   'DTEND;TZID=America/Toronto:20150502T090000'),
+            vevent('count', 'DTSTART:20150505T100000Z',
+                   'DTEND:20150505T120000Z', 'RRULE:FREQ=DAILY;COUNT=3',
+                   'EXDATE:20150506T100000Z'),
+            vevent('until', 'DTSTART;VALUE=DATE:20150510',
+                   'DTEND;VALUE=DATE:20150511',
+                   'RRULE:FREQ=WEEKLY;UNTIL=20150601'),
+            vevent('endless', 'DTSTART;VALUE=DATE:20120502',
+                   'DTEND;VALUE=DATE:20120503', 'RRULE:FREQ=YEARLY'),
+            vevent('no end', 'DTSTART:20150502T100000Z'),
+        ]
+        event_index = index.EventIndex(events)
+
+        zone = tz.gettz('America/Toronto')
+        timestamp = datetime(2015, 4, 30, tzinfo=zone)
+        while timestamp < datetime(2015, 6, 10, tzinfo=zone):
+            assert_that(
+                [e.title() for e in event_index.events_at(timestamp)],
+                is_([e.title() for e in events
+                     if timestamp in e.time_period()]),
+                str(timestamp))
+            timestamp += timedelta(minutes=45)
+
+    def test_events_at_many_years_later(self):
+        events = [
+            vevent('endless', 'DTSTART;VALUE=DATE:20120502',
+                   'DTEND;VALUE=DATE:20120503', 'RRULE:FREQ=YEARLY'),
+            vevent('once', 'DTSTART;VALUE=DATE:20120502',
+                   'DTEND;VALUE=DATE:20120503'),
+        ]
+        event_index = index.EventIndex(events)
+
+        assert_that(
+            [e.title() for e in event_index.events_at(
+                datetime(2020, 5, 2, 12, tzinfo=tz.tzutc()))],
+            is_(['endless']))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_added_values_are_found(self):
+        bloom = index.BloomFilter(1000)
+        for value in range(0, 3000, 3):
+            bloom.add(value)
+
+        assert_that(all(value in bloom for value in range(0, 3000, 3)),
+                    is_(True))
+
+    def test_false_positives_are_rare(self):
+        bloom = index.BloomFilter(1000, error_rate=0.01)
+        for value in range(1000):
+            bloom.add(value)
+
+        false_positives = sum(1 for value in range(1000, 11000)
+                              if value in bloom)
+        assert_that(false_positives < 300, is_(True))
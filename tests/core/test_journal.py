@@ -0,0 +1,102 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import assert_that, is_
+import mock
+
+from calbum.core import model
+from calbum.core.journal import Journal
+from calbum.core.plan import Plan
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.journal_path = self.path('.calbum', 'journal')
+        self.journal = Journal(self.journal_path, batch_size=1)
+        self.plan = Plan()
+        model.FileSystemElement.file_operations = self.plan
+
+    def tearDown(self):
+        model.FileSystemElement.file_operations = model.FileOperations()
+        self.journal.close()
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def create(self, name, content='content'):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+        return model.FileSystemElement(self.path(name))
+
+    def interrupted_run(self, failing_operation):
+        original_perform = Plan.perform
+
+        def perform(plan, operation):
+            if operation.name == failing_operation:
+                raise KeyboardInterrupt()
+            original_perform(plan, operation)
+
+        with mock.patch.object(Plan, 'perform', perform):
+            self.assertRaises(
+                KeyboardInterrupt, self.journal.execute, self.plan)
+        self.journal.close()
+        self.journal = Journal(self.journal_path)
+
+    def test_execute(self):
+        self.create('a.jpg').move_to(self.path('timeline', 'b'))
+
+        assert_that(self.journal.execute(self.plan), is_(2))
+        assert_that(os.path.exists(self.path('timeline', 'b.jpg')), is_(True))
+        assert_that(self.journal.is_done(self.path('a.jpg')), is_(True))
+
+    def test_recover_finishes_interrupted_plan(self):
+        element = self.create('a.jpg')
+        element.move_to(self.path('timeline', 'b'))
+        element.link_to(self.path('album', 'b'))
+        self.interrupted_run('link')
+
+        assert_that(os.path.exists(self.path('album', 'b.jpg')), is_(False))
+        assert_that(self.journal.recover(), is_(1))
+        assert_that(
+            os.path.samefile(self.path('timeline', 'b.jpg'),
+                             self.path('album', 'b.jpg')),
+            is_(True))
+        assert_that(self.journal.is_done(self.path('a.jpg')), is_(True))
+        assert_that(self.journal.recover(), is_(0))
+
+    def test_recover_skips_operations_whose_source_is_missing(self):
+        self.create('a.jpg').move_to(self.path('timeline', 'b'))
+        self.interrupted_run('mkdir')
+        os.remove(self.path('a.jpg'))
+
+        assert_that(self.journal.recover(), is_(1))
+        assert_that(os.path.exists(self.path('timeline', 'b.jpg')), is_(False))
+
+    def test_clear(self):
+        self.create('a.jpg').move_to(self.path('timeline', 'b'))
+        self.journal.execute(self.plan)
+        self.journal.clear()
+        self.journal.close()
+        self.journal = Journal(self.journal_path)
+
+        assert_that(self.journal.recover(), is_(0))
+        assert_that(self.journal.is_done(self.path('a.jpg')), is_(False))
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 from datetime import datetime
+import os
+import shutil
+import tempfile
 import unittest
 
 from dateutil import tz
-from hamcrest import assert_that, is_
+from hamcrest import assert_that, instance_of, is_
 import mock
 
 from calbum.core import model
@@ -24,11 +27,14 @@ from calbum.core import model
 
 class TestFileSystemElement(unittest.TestCase):
 
-    @mock.patch('os.renames')
+    @mock.patch('os.rmdir')
+    @mock.patch('os.rename')
+    @mock.patch('os.makedirs')
     @mock.patch('os.remove')
     @mock.patch('os.path.exists')
     @mock.patch('calbum.core.model.get_destination_path')
-    def test_move_to(self, get_destination_path, exists, remove, renames):
+    def test_move_to(self, get_destination_path, exists, remove, makedirs,
+                     rename, rmdir):
         get_destination_path.return_value = 'dest/path.jpg'
         exists.return_value = False
 
@@ -38,15 +44,20 @@ class TestFileSystemElement(unittest.TestCase):
 
         get_destination_path.assert_called_with(
             source='origin/path.jpg', dest='dest/path', extension='.jpg')
-        exists.assert_called_with('dest/path.jpg')
-        renames.assert_called_with('origin/path.jpg', 'dest/path.jpg')
+        exists.assert_has_calls([
+            mock.call('dest/path.jpg'),
+            mock.call('dest'),
+        ])
+        makedirs.assert_called_with('dest')
+        rename.assert_called_with('origin/path.jpg', 'dest/path.jpg')
+        rmdir.assert_called_with('origin')
         assert_that(remove.called, is_(False))
 
-    @mock.patch('os.renames')
+    @mock.patch('os.rename')
     @mock.patch('os.remove')
     @mock.patch('os.path.exists')
     @mock.patch('calbum.core.model.get_destination_path')
-    def test_move_to_same_file(self, get_destination_path, exists, remove, renames):
+    def test_move_to_same_file(self, get_destination_path, exists, remove, rename):
         get_destination_path.return_value = 'dest/path.jpg'
         exists.return_value = True
 
@@ -58,7 +69,7 @@ class TestFileSystemElement(unittest.TestCase):
             source='origin/path.jpg', dest='dest/path', extension='.jpg')
         exists.assert_called_with('dest/path.jpg')
         remove.assert_called_with('origin/path.jpg')
-        assert_that(renames.called, is_(False))
+        assert_that(rename.called, is_(False))
 
     @mock.patch('os.link')
     @mock.patch('os.makedirs')
@@ -218,6 +229,162 @@ class TestGetDestinationPath(unittest.TestCase):
         ])
 
 
+class TestFileOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.directories = model.DirectoryCache()
+        self.operations = model.FileOperations(self.directories)
+        self.source = os.path.join(self.folder, 'inbox', 'a.jpg')
+        os.makedirs(os.path.dirname(self.source))
+        with open(self.source, 'w') as f:
+            f.write('content')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def test_move_removes_empty_directories(self):
+        self.operations.move(self.source, self.path('2012', '05', 'a.jpg'))
+
+        assert_that(os.path.exists(self.path('2012', '05', 'a.jpg')),
+                    is_(True))
+        assert_that(os.path.exists(self.path('inbox')), is_(False))
+
+    def test_move_keeps_kept_directories(self):
+        model.FileOperations.kept_directories = set([self.path('inbox')])
+        try:
+            self.operations.move(self.source, self.path('2012', 'a.jpg'))
+        finally:
+            model.FileOperations.kept_directories = ()
+
+        assert_that(os.path.isdir(self.path('inbox')), is_(True))
+
+    @mock.patch('os.makedirs')
+    def test_known_directories_are_not_checked_again(self, makedirs):
+        os.mkdir(self.path('album'))
+        self.operations.link(self.source, self.path('album', 'a.jpg'))
+        self.operations.link(self.source, self.path('album', 'b.jpg'))
+
+        assert_that(makedirs.called, is_(False))
+        assert_that(self.directories.exists(self.path('album')), is_(True))
+
+    def test_removed_directories_are_created_again(self):
+        self.operations.link(self.source, self.path('album', 'a.jpg'))
+        shutil.rmtree(self.path('album'))
+        self.operations.link(self.source, self.path('album', 'b.jpg'))
+
+        assert_that(os.path.exists(self.path('album', 'b.jpg')), is_(True))
+
+
+class TestDestinationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = model.DestinationIndex()
+        fingerprint_size = mock.patch.object(model, 'fingerprint_size', 4)
+        fingerprint_size.start()
+        self.addCleanup(fingerprint_size.stop)
+        self.source = self.write('inbox/source.jpg', b'0123456789')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def destination_path(self):
+        return self.index.destination_path(
+            source=self.source,
+            dest=os.path.join(self.folder, 'dest', 'path'),
+            extension='.jpg')
+
+    def test_file_doesnt_exist(self):
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path.jpg')))
+
+    def test_file_exist_with_same_content(self):
+        self.write('dest/path.jpg', b'9876543210')
+        self.write('dest/path(1).jpg', b'0123456789')
+
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path(1).jpg')))
+
+    def test_file_exist_with_same_fingerprint(self):
+        self.write('dest/path.jpg', b'0123xx6789')
+
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path(1).jpg')))
+
+    @mock.patch('calbum.core.model.fingerprint')
+    def test_files_of_other_sizes_are_not_read(self, fingerprint):
+        self.write('dest/path.jpg', b'0123')
+        self.write('dest/path(1).jpg', b'0123456789ab')
+
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path(2).jpg')))
+        assert_that(fingerprint.called, is_(False))
+
+    def test_directory_is_listed_once(self):
+        self.write('dest/path.jpg', b'9876543210')
+        self.destination_path()
+
+        with mock.patch('calbum.core.model.scandir') as scandir:
+            assert_that(
+                self.destination_path(),
+                is_(os.path.join(self.folder, 'dest', 'path(2).jpg')))
+            assert_that(scandir.called, is_(False))
+
+    def test_files_added_and_removed(self):
+        self.write('dest/path.jpg', b'9876543210')
+        self.destination_path()
+        added = self.write('dest/path(1).jpg', b'0123456789')
+        self.index.add(added)
+
+        assert_that(self.destination_path(), is_(added))
+
+        os.remove(added)
+        self.index.remove(added)
+
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path(2).jpg')))
+
+    def test_suffixes_are_allocated_without_probing(self):
+        self.write('dest/path.jpg', b'9876543210')
+        paths = [self.destination_path()]
+
+        with mock.patch('os.path.exists', return_value=False) as exists:
+            paths.append(self.destination_path())
+            paths.append(self.destination_path())
+
+        assert_that(paths, is_([
+            os.path.join(self.folder, 'dest', 'path(1).jpg'),
+            os.path.join(self.folder, 'dest', 'path(2).jpg'),
+            os.path.join(self.folder, 'dest', 'path(3).jpg'),
+        ]))
+        assert_that(exists.call_count, is_(2))
+
+    def test_files_changed_behind_the_index(self):
+        self.destination_path()
+        self.write('dest/path.jpg', b'9876543210')
+
+        assert_that(
+            self.destination_path(),
+            is_(os.path.join(self.folder, 'dest', 'path(1).jpg')))
+
+
 class TestMedia(unittest.TestCase):
 
     def test_file_extension_based_on_path(self):
@@ -235,3 +402,192 @@ class TestMedia(unittest.TestCase):
         assert_that(
             media.timestamp(),
             is_(datetime(2012, 5, 1, 22, 43, 23, tzinfo=tz.gettz())))
+
+    def test_media_has_no_instance_dictionary(self):
+        media = model.Media('some/file/path.jpg')
+
+        assert_that(hasattr(media, '__dict__'), is_(False))
+
+    def test_media_keeps_only_the_needed_status(self):
+        media = model.Media(__file__)
+
+        assert_that(media.stat(), is_(model.FileStatus(
+            os.stat(__file__).st_dev, os.stat(__file__).st_ino,
+            os.stat(__file__).st_size, os.stat(__file__).st_mtime)))
+
+    @mock.patch('calbum.core.model.string_to_datetime')
+    def test_timestamp_is_resolved_once(self, string_to_datetime):
+        string_to_datetime.return_value = datetime(2012, 5, 1, tzinfo=tz.gettz())
+        resolved_timestamps = model.Media.resolved_timestamps
+        media = model.Media('some/file/VID_20120501_000000.avi')
+
+        assert_that(media.timestamp(), is_(media.timestamp()))
+        assert_that(string_to_datetime.call_count, is_(1))
+        assert_that(
+            model.Media.resolved_timestamps, is_(resolved_timestamps + 1))
+
+    @mock.patch('calbum.core.model.FileOperations.move')
+    @mock.patch('os.path.exists')
+    @mock.patch('calbum.core.model.get_destination_path')
+    def test_timestamp_from_path_is_kept_after_move(self, get_destination_path, exists, move):
+        get_destination_path.return_value = 'dest/VID_20130601_000000.avi'
+        exists.return_value = False
+        media = model.Media('some/file/VID_20120501_224323.avi')
+        media.timestamp()
+        resolved_timestamps = model.Media.resolved_timestamps
+
+        media.move_to('dest/VID_20130601_000000')
+
+        assert_that(
+            media.timestamp(),
+            is_(datetime(2012, 5, 1, 22, 43, 23, tzinfo=tz.gettz())))
+        assert_that(
+            model.Media.resolved_timestamps, is_(resolved_timestamps))
+
+    @mock.patch('calbum.core.model.FileOperations.move')
+    @mock.patch('os.path.exists')
+    @mock.patch('calbum.core.model.get_destination_path')
+    def test_timestamp_from_content_is_kept_after_move(self, get_destination_path, exists, move):
+        class FakeExifMedia(model.Media):
+            def resolve_timestamp(self):
+                return datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())
+        get_destination_path.return_value = 'dest/path.jpg'
+        exists.return_value = False
+        media = FakeExifMedia('some/file/path.jpg')
+        media.timestamp()
+        resolved_timestamps = model.Media.resolved_timestamps
+
+        media.move_to('dest/path')
+        media.timestamp()
+
+        assert_that(
+            model.Media.resolved_timestamps, is_(resolved_timestamps))
+
+
+class TestTimeLine(unittest.TestCase):
+
+    def setUp(self):
+        self.media_path_format = model.TimeLine.media_path_format
+
+    def tearDown(self):
+        model.TimeLine.media_path_format = self.media_path_format
+
+    def test_media_path(self):
+        media = model.Media('some/file/VID_20120501_224323.avi')
+
+        assert_that(
+            model.TimeLine('timeline').media_path(media),
+            is_('timeline/2012/2012-05/2012-05-01-22-43-23'))
+
+    def test_media_path_with_milliseconds(self):
+        model.TimeLine.media_path_format = '%Y-%m-%d-%H-%M-%S.%N-100%%N'
+        media = mock.Mock()
+        media.timestamp.return_value = datetime(2012, 5, 1, 22, 43, 23, 46000)
+
+        assert_that(
+            model.TimeLine('timeline').media_path(media),
+            is_('timeline/2012-05-01-22-43-23.046-100%N'))
+
+
+class TestSubsecToMicroseconds(unittest.TestCase):
+
+    def test_fractions(self):
+        assert_that(model.subsec_to_microseconds('25'), is_(250000))
+        assert_that(model.subsec_to_microseconds('046'), is_(46000))
+        assert_that(model.subsec_to_microseconds('1234567'), is_(123456))
+        assert_that(model.subsec_to_microseconds(' '), is_(0))
+
+
+class TestMediaFactory(unittest.TestCase):
+
+    class Picture(model.Media):
+        file_extensions = ('.jpeg', '.jpg')
+        file_signatures = ((0, b'\xff\xd8\xff'),)
+
+    class Video(model.Media):
+        file_extensions = ('.mp4',)
+        file_signatures = ((4, b'ftypisom'),)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.factory = model.MediaFactory(self.Picture, self.Video)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_media_from_extension(self):
+        media = self.factory('/inbox/IMG_0001.JPG')
+
+        assert_that(media, instance_of(self.Picture))
+        assert_that(media.path(), is_('/inbox/IMG_0001.JPG'))
+        assert_that(self.factory('/inbox/v.mp4'), instance_of(self.Video))
+
+    def test_unknown_extension_without_sniffing(self):
+        path = self.write('IMG_0001', b'\xff\xd8\xff\xe0')
+
+        assert_that(self.factory(path), is_(None))
+
+    def test_media_from_signature(self):
+        self.factory.sniff = True
+        path = self.write('VID_0001', b'\x00\x00\x00\x18ftypisom' * 4)
+
+        media = self.factory(path)
+
+        assert_that(media, instance_of(self.Video))
+        assert_that(media.header, is_(b'\x00\x00\x00\x18ftypisom' * 4))
+        assert_that(media.file_extension(), is_('.mp4'))
+
+    def test_unknown_signature(self):
+        self.factory.sniff = True
+
+        assert_that(self.factory(self.write('notes', b'text')), is_(None))
+        assert_that(
+            self.factory(os.path.join(self.folder, 'missing')), is_(None))
+
+
+class TestMediaCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ('a.jpg', '.hidden/b.jpg', '@eaDir/c.jpg', 'd/e.jpg',
+                     'd/f/g.jpg', '.h.jpg'):
+            path = os.path.join(self.folder, name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def names(self, collection):
+        return sorted(
+            os.path.relpath(media.path(), self.folder) for media in collection)
+
+    def test_iter_walks_all_directories(self):
+        assert_that(
+            self.names(model.MediaCollection(self.folder)),
+            is_(['.h.jpg', '.hidden/b.jpg', '@eaDir/c.jpg', 'a.jpg',
+                 'd/e.jpg', 'd/f/g.jpg']))
+
+    def test_iter_skips_excluded_directories(self):
+        collection = model.MediaCollection(self.folder)
+        collection.excluded_dirs = model.system_dirs
+        collection.exclude_hidden = True
+
+        assert_that(
+            self.names(collection),
+            is_(['a.jpg', 'd/e.jpg', 'd/f/g.jpg']))
+
+    @mock.patch('os.stat')
+    def test_media_status_comes_from_the_directory_entry(self, stat):
+        collection = model.MediaCollection(self.folder)
+
+        for media in collection:
+            assert_that(media.stat().st_size, is_(0))
+        assert_that(stat.called, is_(False))
@@ -0,0 +1,103 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from hamcrest import assert_that, is_
+import mock
+
+from calbum.core import pipeline
+
+
+class TestResolveTimestamps(unittest.TestCase):
+
+    def test_medias_are_yielded_in_order(self):
+        medias = [mock.Mock(name=str(i)) for i in range(20)]
+
+        assert_that(
+            list(pipeline.resolve_timestamps(iter(medias), jobs=4)),
+            is_(medias))
+        for media in medias:
+            media.timestamp.assert_called_once_with()
+
+    def test_timestamps_are_resolved_concurrently(self):
+        both_started = threading.Event()
+        started = []
+
+        def timestamp():
+            started.append(threading.current_thread())
+            if len(started) == 2:
+                both_started.set()
+            assert both_started.wait(5)
+        medias = [mock.Mock(timestamp=timestamp) for _ in range(2)]
+
+        assert_that(
+            list(pipeline.resolve_timestamps(medias, jobs=2)),
+            is_(medias))
+        assert_that(started[0] is not started[1], is_(True))
+
+    def test_errors_are_raised_in_order(self):
+        failing = mock.Mock()
+        failing.timestamp.side_effect = ValueError()
+        medias = [mock.Mock(), failing, mock.Mock()]
+
+        resolved = pipeline.resolve_timestamps(medias, jobs=2)
+        assert_that(next(resolved), is_(medias[0]))
+        self.assertRaises(ValueError, next, resolved)
+
+    def test_single_job_does_not_resolve_ahead(self):
+        media = mock.Mock()
+
+        assert_that(
+            list(pipeline.resolve_timestamps([media], jobs=1)),
+            is_([media]))
+        assert_that(media.timestamp.called, is_(False))
+
+
+class TestLookahead(unittest.TestCase):
+
+    def test_items_are_yielded_in_order(self):
+        lookahead = pipeline.Lookahead(iter(range(100)), size=10)
+
+        assert_that(list(lookahead), is_(list(range(100))))
+        assert_that(len(lookahead), is_(100))
+        assert_that(lookahead.exhausted, is_(True))
+
+    def test_items_are_read_ahead_up_to_size(self):
+        read = []
+
+        def items():
+            for i in range(100):
+                read.append(i)
+                yield i
+        lookahead = pipeline.Lookahead(items(), size=5)
+        iterator = iter(lookahead)
+
+        assert_that(next(iterator), is_(0))
+        for _ in range(100):
+            if len(read) >= 6:
+                break
+            threading.Event().wait(0.01)
+        assert_that(len(read) <= 7, is_(True))
+        assert_that(lookahead.exhausted, is_(False))
+
+    def test_errors_are_raised_after_the_items(self):
+        def items():
+            yield 1
+            raise OSError()
+
+        iterator = iter(pipeline.Lookahead(items(), size=5))
+        assert_that(next(iterator), is_(1))
+        self.assertRaises(OSError, next, iterator)
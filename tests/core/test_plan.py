@@ -0,0 +1,125 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from hamcrest import assert_that, is_
+
+from calbum.core import model
+from calbum.core.plan import Operation, Plan
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.plan = Plan()
+        model.FileSystemElement.file_operations = self.plan
+        model.FileSystemElement.destination_index = model.DestinationIndex()
+
+    def tearDown(self):
+        model.FileSystemElement.file_operations = model.FileOperations()
+        model.FileSystemElement.destination_index = None
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def create(self, name, content):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+        return model.FileSystemElement(self.path(name))
+
+    def test_moves_are_deferred(self):
+        element = self.create('a.jpg', 'content')
+        element.move_to(self.path('timeline', 'b'))
+
+        assert_that(element.path(), is_(self.path('timeline', 'b.jpg')))
+        assert_that(element.content_path(), is_(self.path('a.jpg')))
+        assert_that(element.stat().st_size, is_(7))
+        assert_that(os.path.exists(self.path('timeline')), is_(False))
+
+        assert_that(self.plan.execute(), is_(2))
+        assert_that(os.path.exists(self.path('a.jpg')), is_(False))
+        assert_that(os.path.exists(self.path('timeline', 'b.jpg')), is_(True))
+
+    def test_name_conflicts_are_resolved_before_execution(self):
+        first = self.create('a.jpg', 'first')
+        copy = self.create('b.jpg', 'first')
+        other = self.create('c.jpg', 'other')
+        for element in (first, copy, other):
+            element.move_to(self.path('timeline', 'd'))
+
+        assert_that(self.plan.operations(), is_([
+            Operation('mkdir', None, self.path('timeline')),
+            Operation('move', self.path('a.jpg'),
+                      self.path('timeline', 'd.jpg')),
+            Operation('move', self.path('c.jpg'),
+                      self.path('timeline', 'd(1).jpg')),
+            Operation('remove', None, self.path('b.jpg')),
+        ]))
+
+    def test_links_are_done_after_moves(self):
+        element = self.create('a.jpg', 'content')
+        element.move_to(self.path('timeline', 'b'))
+        element.link_to(self.path('album', 'b'))
+
+        assert_that(
+            [operation.name for operation in self.plan.operations()],
+            is_(['mkdir', 'mkdir', 'move', 'link']))
+        self.plan.execute()
+        assert_that(
+            os.path.samefile(self.path('timeline', 'b.jpg'),
+                             self.path('album', 'b.jpg')),
+            is_(True))
+
+    def test_moves_to_the_previous_path_of_a_moved_file(self):
+        os.makedirs(self.path('1'))
+        os.makedirs(self.path('2'))
+        self.create(os.path.join('1', 'y.jpg'), 'first')
+        self.create(os.path.join('2', 'x.jpg'), 'second')
+        self.plan.move(self.path('1', 'y.jpg'), self.path('2', 'z.jpg'))
+        self.plan.move(self.path('2', 'x.jpg'), self.path('1', 'y.jpg'))
+
+        self.plan.execute()
+
+        with open(self.path('2', 'z.jpg')) as f:
+            assert_that(f.read(), is_('first'))
+        with open(self.path('1', 'y.jpg')) as f:
+            assert_that(f.read(), is_('second'))
+
+    def test_only_the_last_move_is_kept(self):
+        element = self.create('a.jpg', 'content')
+        element.move_to(self.path('b'))
+        element.move_to(self.path('c'))
+
+        assert_that(self.plan.operations(), is_([
+            Operation('move', self.path('a.jpg'), self.path('c.jpg')),
+        ]))
+
+    def test_dump(self):
+        element = self.create('a.jpg', 'content')
+        element.move_to(self.path('b'))
+        f = StringIO.StringIO()
+        self.plan.dump(f)
+
+        assert_that(json.loads(f.getvalue()), is_({'operations': [
+            {'name': 'move', 'source': self.path('a.jpg'),
+             'path': self.path('b.jpg')},
+        ]}))
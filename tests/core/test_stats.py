@@ -0,0 +1,63 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from StringIO import StringIO
+import unittest
+
+from hamcrest import assert_that, is_
+import mock
+
+from calbum.core import stats
+
+
+class TestStats(unittest.TestCase):
+
+    def tearDown(self):
+        stats.current = None
+
+    def test_count_and_timer(self):
+        stats.current = stats.Stats()
+        stats.count('files_scanned')
+        stats.count('files_scanned', 2)
+        with mock.patch('time.time', side_effect=[10, 12.5, 20, 21]):
+            with stats.timer('scan'):
+                pass
+            with stats.timer('scan'):
+                pass
+
+        assert_that(stats.current.report(), is_({
+            'seconds': {'scan': 3.5},
+            'counters': {'files_scanned': 3},
+        }))
+
+    def test_nothing_recorded_without_current_stats(self):
+        stats.count('files_scanned')
+        with stats.timer('scan'):
+            pass
+
+        assert_that(stats.current, is_(None))
+
+    def test_dump(self):
+        run_stats = stats.Stats()
+        run_stats.count('files_moved', 4)
+        run_stats.add_time('total', 1.25)
+        f = StringIO()
+        run_stats.dump(f)
+
+        assert_that(json.loads(f.getvalue()), is_({
+            'seconds': {'total': 1.25},
+            'counters': {'files_moved': 4},
+        }))
+        assert_that('files_moved' in run_stats.summary(), is_(True))
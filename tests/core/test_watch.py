@@ -0,0 +1,82 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import assert_that, is_
+
+from calbum.core import watch
+
+
+class TestInboxWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.watcher = watch.InboxWatcher(
+            self.folder, settle_time=0.2, excluded_dirs=('@eaDir',),
+            exclude_hidden=True)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def test_written_files_are_ready_when_closed(self):
+        with open(self.path('a.jpg'), 'w') as f:
+            f.write('content')
+            assert_that(self.watcher.poll(0.1), is_([]))
+
+        assert_that(self.watcher.poll(1), is_([self.path('a.jpg')]))
+
+    def test_moved_files_are_ready(self):
+        other_folder = tempfile.mkdtemp(dir=self.folder + '/..')
+        try:
+            with open(os.path.join(other_folder, 'a.jpg'), 'w') as f:
+                f.write('content')
+            os.rename(os.path.join(other_folder, 'a.jpg'), self.path('b.jpg'))
+
+            assert_that(self.watcher.poll(1), is_([self.path('b.jpg')]))
+        finally:
+            shutil.rmtree(other_folder)
+
+    def test_files_of_new_directories_are_ready(self):
+        os.makedirs(self.path('sub', 'folder'))
+        self.watcher.poll(0.1)
+        with open(self.path('sub', 'folder', 'a.jpg'), 'w') as f:
+            f.write('content')
+
+        assert_that(
+            self.watcher.poll(1), is_([self.path('sub', 'folder', 'a.jpg')]))
+
+    def test_files_still_open_are_ready_once_their_size_is_stable(self):
+        with open(self.path('a.jpg'), 'w') as f:
+            f.write('content')
+            f.flush()
+
+            assert_that(self.watcher.poll(0.1), is_([]))
+            assert_that(self.watcher.poll(2), is_([self.path('a.jpg')]))
+
+    def test_excluded_files_are_ignored(self):
+        os.makedirs(self.path('@eaDir'))
+        self.watcher.poll(0.1)
+        for name in (('.hidden.jpg',), ('@eaDir', 'a.jpg')):
+            with open(self.path(*name), 'w') as f:
+                f.write('content')
+
+        assert_that(self.watcher.poll(0.5), is_([]))
@@ -0,0 +1,61 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from hamcrest import assert_that, is_
+import mock
+
+from calbum.filters.album import CalendarAlbumFilter
+
+
+class TestCalendarAlbumFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.album_filter = CalendarAlbumFilter(
+            albums_path='albums', events=[], save_events=True)
+
+    def event(self, title):
+        event = mock.Mock()
+        event.title.return_value = title
+        return event
+
+    def test_event_is_saved_once(self):
+        event = self.event('Trip')
+        album = self.album_filter.album(event)
+
+        self.album_filter.save_event(album, event)
+        self.album_filter.save_event(album, event)
+
+        event.save_to.assert_called_once_with(album.path())
+
+    def test_every_event_of_a_shared_album_is_saved(self):
+        first, last = self.event('Trip'), self.event('Trip')
+        album = self.album_filter.album(first)
+        assert_that(self.album_filter.album(last).path(), is_(album.path()))
+
+        self.album_filter.save_event(album, first)
+        self.album_filter.save_event(album, last)
+
+        first.save_to.assert_called_once_with(album.path())
+        last.save_to.assert_called_once_with(album.path())
+
+    def test_events_are_not_saved_unless_requested(self):
+        self.album_filter.save_events = False
+        event = self.event('Trip')
+
+        self.album_filter.save_event(self.album_filter.album(event), event)
+
+        assert_that(event.save_to.called, is_(False))
@@ -12,14 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import BaseHTTPServer
+import gzip
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import threading
+import time
 import unittest
 from datetime import datetime, date, timedelta
 
+from dateutil import tz
 from hamcrest import assert_that, is_
-from icalendar import Event
+from icalendar import Calendar, Event
+from icalendar.timezone_cache import _timezone_cache
+import mock
 import pytz
 
-from calbum.sources.calendar import CalendarTimePeriod
+from calbum.sources.calendar import CalendarCache, CalendarEvent, \
+    CalendarTimePeriod
+from tests import resources
 
 
 class TestEventTimePeriod(unittest.TestCase):
@@ -152,3 +165,286 @@ END:VEVENT"""))
 
         assert_that(etp.start(), is_(datetime(2013, 9, 21, 23, tzinfo=pytz.utc)))
         assert_that(datetime(2013, 9, 21, 23, tzinfo=pytz.utc) in etp, is_(False))
+
+    def test_timestamp_in_weekly_event_years_later(self):
+        etp = CalendarTimePeriod(Event.from_ical("""BEGIN:VEVENT
+DTSTART;TZID=America/Toronto:20100601T183000
+DTEND;TZID=America/Toronto:20100601T193000
+RRULE:FREQ=WEEKLY;BYDAY=TU
+EXDATE;TZID=America/Toronto:20190604T183000
+END:VEVENT"""))
+
+        toronto = tz.gettz('America/Toronto')
+        assert_that(datetime(2019, 5, 28, 19, tzinfo=toronto) in etp, is_(True))
+        assert_that(datetime(2019, 5, 28, 20, tzinfo=toronto) in etp, is_(False))
+        assert_that(datetime(2019, 5, 29, 19, tzinfo=toronto) in etp, is_(False))
+        assert_that(datetime(2019, 6, 4, 19, tzinfo=toronto) in etp, is_(False))
+        assert_that(datetime(2019, 6, 11, 19, tzinfo=toronto) in etp, is_(True))
+
+    def test_timestamp_in_recursive_event_with_excluded_start(self):
+        etp = CalendarTimePeriod(Event.from_ical("""BEGIN:VEVENT
+DTSTART:20151010T100000Z
+DTEND:20151010T120000Z
+RRULE:FREQ=DAILY;COUNT=3
+EXDATE:20151010T100000Z
+END:VEVENT"""))
+
+        assert_that(datetime(2015, 10, 10, 11, tzinfo=pytz.utc) in etp, is_(True))
+        assert_that(datetime(2015, 10, 11, 11, tzinfo=pytz.utc) in etp, is_(True))
+        assert_that(datetime(2015, 10, 13, 11, tzinfo=pytz.utc) in etp, is_(False))
+
+    def test_occurrences_are_reused(self):
+        etp = CalendarTimePeriod(Event.from_ical("""BEGIN:VEVENT
+DTSTART;VALUE=DATE:20120702
+DTEND;VALUE=DATE:20120703
+RRULE:FREQ=YEARLY
+END:VEVENT"""))
+        datetime(2014, 7, 1, tzinfo=pytz.utc) in etp
+        datetime(2015, 7, 1, tzinfo=pytz.utc) in etp
+        etp._recurrence = mock.Mock()
+
+        assert_that(datetime(2014, 7, 2, 12, tzinfo=pytz.utc) in etp, is_(True))
+        assert_that(datetime(2015, 7, 2, 12, tzinfo=pytz.utc) in etp, is_(True))
+        assert_that(datetime(2015, 7, 3, 12, tzinfo=pytz.utc) in etp, is_(False))
+        assert_that(etp._recurrence.method_calls, is_([]))
+
+
+class TestLoadFromStream(unittest.TestCase):
+
+    feed = (b"BEGIN:VCALENDAR\r\n"
+            b"BEGIN:VTIMEZONE\r\n"
+            b"TZID:Calbum/Montreal\r\n"
+            b"BEGIN:STANDARD\r\n"
+            b"DTSTART:19701101T020000\r\n"
+            b"TZOFFSETFROM:-0400\r\n"
+            b"TZOFFSETTO:-0500\r\n"
+            b"END:STANDARD\r\n"
+            b"END:VTIMEZONE\r\n"
+            b"BEGIN:VEVENT\r\n"
+            b"SUMMARY:Old event\r\n"
+            b"DTSTART;VALUE=DATE:20090501\r\n"
+            b"DTEND;VALUE=DATE:20090502\r\n"
+            b"BEGIN:VALARM\r\n"
+            b"TRIGGER:-PT15M\r\n"
+            b"DURATION:P10000D\r\n"
+            b"END:VALARM\r\n"
+            b"END:VEVENT\r\n"
+            b"BEGIN:VEVENT\r\n"
+            b"SUMMARY:Old weekly event\r\n"
+            b"DTSTART:20090501T100000Z\r\n"
+            b"DTEND:20090501T120000Z\r\n"
+            b"RRULE:FREQ=WEEKLY\r\n"
+            b"END:VEVENT\r\n"
+            b"BEGIN:VEVENT\r\n"
+            b"SUMMARY:Long \xc3\r\n"
+            b" \xa9v\xc3\xa9nement\r\n"
+            b"DTSTART;TZID=Calbum/Montreal:20150101T100000\r\n"
+            b"DURATION:P30D\r\n"
+            b"END:VEVENT\r\n"
+            b"END:VCALENDAR\r\n")
+
+    def titles(self, events):
+        return [e.title() for e in events]
+
+    def test_load_all_events(self):
+        events = CalendarEvent.load_from_stream(StringIO(self.feed))
+
+        assert_that(
+            self.titles(events),
+            is_([u'Old event', u'Old weekly event', u'Long \xe9v\xe9nement']))
+        assert_that(
+            datetime(2015, 1, 1, 15, tzinfo=pytz.utc) in events[2].time_period(),
+            is_(True))
+
+    def test_events_outside_of_the_window_are_skipped(self):
+        with mock.patch('icalendar.Event.from_ical',
+                        side_effect=Event.from_ical) as from_ical:
+            events = CalendarEvent.load_from_stream(
+                StringIO(self.feed),
+                window=(datetime(2015, 1, 20), datetime(2015, 12, 31)))
+
+        assert_that(
+            self.titles(events),
+            is_([u'Old weekly event', u'Long \xe9v\xe9nement']))
+        assert_that(from_ical.call_count, is_(2))
+
+    def test_events_after_the_window_are_skipped(self):
+        events = CalendarEvent.load_from_stream(
+            StringIO(self.feed), window=(None, datetime(2014, 12, 1)))
+
+        assert_that(
+            self.titles(events), is_([u'Old event', u'Old weekly event']))
+
+    def test_same_events_as_the_whole_calendar(self):
+        path = resources.file_path('calendar.ics')
+        with open(path) as f:
+            calendar = Calendar.from_ical(f.read())
+
+        events = CalendarEvent.load_from_file(path)
+
+        assert_that(
+            [e.component().to_ical() for e in events],
+            is_([e.to_ical() for e in calendar.walk('VEVENT')]))
+
+
+class CalendarRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.delay:
+            time.sleep(server.delay)
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        with open(server.feed, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as z:
+                z.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLoadFromUrl(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), CalendarRequestHandler)
+        self.server.requests = []
+        self.server.delay = 0
+        self.server.feed = resources.file_path('calendar.ics')
+        self.url = 'http://127.0.0.1:{}/calendar.ics'.format(
+            self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.cache_path = tempfile.mkdtemp()
+        self.cache = CalendarCache(self.cache_path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_path)
+
+    def titles(self, events):
+        return [e.title() for e in events]
+
+    def test_load_gzipped_feed(self):
+        events = CalendarEvent.load_from_url(self.url)
+
+        assert_that(
+            self.titles(events),
+            is_(['First event', 'Second event', 'Last event']))
+        assert_that(
+            self.server.requests[0]['accept-encoding'], is_('gzip'))
+
+    def test_unchanged_feed_is_loaded_from_the_cache(self):
+        CalendarEvent.load_from_url(self.url, cache=self.cache)
+
+        with mock.patch('icalendar.Calendar.from_ical') as from_ical:
+            events = CalendarEvent.load_from_url(self.url, cache=self.cache)
+            assert_that(from_ical.called, is_(False))
+
+        assert_that(self.server.requests[1]['if-none-match'], is_('"v1"'))
+        assert_that(
+            self.titles(events),
+            is_(['First event', 'Second event', 'Last event']))
+        assert_that(
+            datetime(2012, 5, 1, 12, tzinfo=pytz.utc) in events[0].time_period(),
+            is_(True))
+
+    def test_cached_events_can_be_saved(self):
+        CalendarEvent.load_from_url(self.url, cache=self.cache)
+        events = CalendarEvent.load_from_url(self.url, cache=self.cache)
+
+        events[0].save_to(self.cache_path)
+
+        with open(os.path.join(self.cache_path, 'event.ics')) as f:
+            assert_that('SUMMARY:First event' in f.read(), is_(True))
+
+    def test_saved_event_is_not_written_again(self):
+        events = CalendarEvent.load_from_url(self.url)
+        events[0].save_to(self.cache_path)
+        event_path = os.path.join(self.cache_path, 'event.ics')
+        os.utime(event_path, (0, 0))
+
+        events[0].save_to(self.cache_path)
+        assert_that(os.stat(event_path).st_mtime, is_(0))
+
+        events[1].save_to(self.cache_path)
+        with open(event_path) as f:
+            assert_that('SUMMARY:Second event' in f.read(), is_(True))
+
+    def test_cached_events_keep_custom_time_zones(self):
+        self.server.feed = os.path.join(self.cache_path, 'custom.ics')
+        with open(self.server.feed, 'w') as f:
+            f.write('BEGIN:VCALENDAR\r\n'
+                    'BEGIN:VTIMEZONE\r\n'
+                    'TZID:My Custom Zone\r\n'
+                    'BEGIN:STANDARD\r\n'
+                    'DTSTART:19700101T000000\r\n'
+                    'TZOFFSETFROM:-0500\r\n'
+                    'TZOFFSETTO:-0500\r\n'
+                    'END:STANDARD\r\n'
+                    'END:VTIMEZONE\r\n'
+                    'BEGIN:VEVENT\r\n'
+                    'SUMMARY:Weekly event\r\n'
+                    'DTSTART;TZID=My Custom Zone:20150105T100000\r\n'
+                    'DTEND;TZID=My Custom Zone:20150105T120000\r\n'
+                    'RRULE:FREQ=WEEKLY\r\n'
+                    'END:VEVENT\r\n'
+                    'END:VCALENDAR\r\n')
+        CalendarEvent.load_from_url(self.url, cache=self.cache)
+        # As in a new run, where the time zone isn't registered yet
+        del _timezone_cache['My Custom Zone']
+
+        events = CalendarEvent.load_from_url(self.url, cache=self.cache)
+
+        assert_that(self.titles(events), is_(['Weekly event']))
+        assert_that(
+            datetime(2015, 1, 12, 16, tzinfo=pytz.utc)
+            in events[0].time_period(),
+            is_(True))
+
+    def test_unreadable_cache_is_ignored(self):
+        CalendarEvent.load_from_url(self.url, cache=self.cache)
+        with mock.patch('calbum.sources.calendar.CalendarEvent.from_compact',
+                        side_effect=KeyError('My Custom Zone')):
+            assert_that(self.cache.load(self.url), is_(None))
+
+    def test_stale_cache_is_used_when_the_server_is_too_slow(self):
+        CalendarEvent.load_from_url(self.url, cache=self.cache)
+        self.server.delay = 0.5
+
+        events = CalendarEvent.load_from_url(
+            self.url, cache=self.cache, timeout=0.1)
+
+        assert_that(
+            self.titles(events),
+            is_(['First event', 'Second event', 'Last event']))
+
+    def test_errors_without_cache_are_raised(self):
+        self.server.delay = 0.5
+
+        self.assertRaises(
+            Exception, CalendarEvent.load_from_url, self.url, timeout=0.1)
+
+    def test_load_several_feeds(self):
+        calendars = CalendarEvent.load_from_urls(
+            [self.url, self.url + '?other'], cache=self.cache)
+
+        assert_that(
+            [self.titles(events) for events in calendars],
+            is_([['First event', 'Second event', 'Last event']] * 2))
+        assert_that(len(self.server.requests), is_(2))
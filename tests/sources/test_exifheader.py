@@ -0,0 +1,120 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from hamcrest import assert_that, is_
+
+from calbum.sources.exifheader import ExifHeaderError, read_tags
+from tests import resources
+
+
+def big_endian_tiff(date_time, date_time_original, subsec=b''):
+    """
+    Build a TIFF header with a DateTime entry in the first IFD and a
+    DateTimeOriginal entry in the Exif IFD, like the header of a raw file.
+    A SubSecTimeOriginal entry (at most 4 bytes) is added if provided.
+    """
+    first_ifd = 8
+    exif_entries = 2 if subsec else 1
+    exif_ifd = first_ifd + 2 + 2 * 12 + 4
+    data = exif_ifd + 2 + exif_entries * 12 + 4
+    return (
+        b'MM\x00*' + struct.pack('>I', first_ifd) +
+        struct.pack('>H', 2) +
+        struct.pack('>HHII', 0x0132, 2, len(date_time), data) +
+        struct.pack('>HHII', 0x8769, 4, 1, exif_ifd) +
+        struct.pack('>I', 0) +
+        struct.pack('>H', exif_entries) +
+        struct.pack('>HHII', 0x9003, 2, len(date_time_original),
+                    data + len(date_time)) +
+        (struct.pack('>HHI4s', 0x9291, 2, len(subsec), subsec)
+         if subsec else b'') +
+        struct.pack('>I', 0) +
+        date_time + date_time_original)
+
+
+class TestReadTags(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_jpeg_exif(self):
+        assert_that(
+            read_tags(resources.file_path('image-01.jpeg')),
+            is_({'EXIF DateTimeOriginal': '2012:05:01 01:00:00'}))
+
+    def test_tiff_exif(self):
+        assert_that(
+            read_tags(resources.file_path('image-03.tif')),
+            is_({'EXIF DateTimeOriginal': '2013:02:01 03:00:00'}))
+
+    def test_big_endian_raw_header(self):
+        path = self.write('image.nef', big_endian_tiff(
+            b'2014:01:02 03:04:05\x00', b'2013:01:02 03:04:05\x00'))
+
+        assert_that(read_tags(path), is_({
+            'Image DateTime': '2014:01:02 03:04:05',
+            'EXIF DateTimeOriginal': '2013:01:02 03:04:05',
+        }))
+
+    def test_sub_second_tag(self):
+        path = self.write('image.dng', big_endian_tiff(
+            b'2014:01:02 03:04:05\x00', b'2013:01:02 03:04:05\x00', b'25\x00'))
+
+        assert_that(
+            read_tags(path)['EXIF SubSecTimeOriginal'], is_('25'))
+
+    def test_jpeg_without_exif(self):
+        path = self.write('image.jpeg', (
+            b'\xff\xd8' +
+            b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' +
+            b'\xff\xda\x00\x02' + b'\x00' * 64))
+
+        assert_that(read_tags(path), is_({}))
+
+    def test_unknown_format(self):
+        self.assertRaises(
+            ExifHeaderError, read_tags, resources.file_path('video-01.mp4'))
+
+    def test_empty_file(self):
+        self.assertRaises(
+            ExifHeaderError, read_tags, self.write('image.jpeg', b''))
+
+    def test_truncated_header(self):
+        content = big_endian_tiff(
+            b'2014:01:02 03:04:05\x00', b'2013:01:02 03:04:05\x00')
+
+        self.assertRaises(
+            ExifHeaderError, read_tags, self.write('image.cr2', content[:20]))
+
+    def test_non_ascii_value(self):
+        content = big_endian_tiff(
+            b'2014:01:02 03:04:05\x00', b'2013:01:02 03:04\xe905\x00')
+
+        self.assertRaises(
+            ExifHeaderError, read_tags, self.write('image.cr2', content))
@@ -17,6 +17,7 @@ import unittest
 
 from dateutil import tz
 from hamcrest import assert_that, is_, instance_of
+import mock
 from calbum.sources import exiftool
 
 from tests import resources
@@ -49,6 +50,17 @@ class TestExifToolMedia(unittest.TestCase):
             exiftool.Video3GPMedia(resources.file_path('video-02.3gp')).timestamp(),
             is_(datetime(2014, 2, 2, 19, 30, 0, tzinfo=tz.gettz())))
 
+    @mock.patch('calbum.sources.exiftool.ExifToolMedia.pool')
+    def test_timestamp_with_fraction_of_second(self, pool):
+        pool.metadata.return_value = {
+            'DateTimeOriginal': '2012:05:01 01:00:00',
+            'SubSecTimeOriginal': '046',
+        }
+
+        assert_that(
+            exiftool.JpegPicture('IMG_0001.jpeg').timestamp(),
+            is_(datetime(2012, 5, 1, 1, 0, 0, 46000, tzinfo=tz.gettz())))
+
     def test_mp4_timestamp_without_exiftool(self):
         try:
             exiftool.ExifToolMedia.exiftool_path = '__invalid_command__'
@@ -57,3 +69,52 @@ class TestExifToolMedia(unittest.TestCase):
                 instance_of(datetime))
         except Exception as e:
             raise AssertionError('Expected no exception but raised {}'.format(e))
+
+
+class TestExifToolPool(unittest.TestCase):
+
+    @mock.patch('calbum.sources.exiftool.ExifToolProcess')
+    def test_metadata_reuses_the_same_process(self, process_factory):
+        process = process_factory.return_value
+        process.execute.side_effect = [
+            b'[{"SourceFile": "a.mp4", "CreateDate": "2014:01:01 19:30:00"}]',
+            b'[{"SourceFile": "b.mp4", "CreateDate": "2014:02:02 19:30:00"}]',
+        ]
+        pool = exiftool.ExifToolPool()
+
+        assert_that(
+            pool.metadata('a.mp4', ('CreateDate',)),
+            is_({'CreateDate': '2014:01:01 19:30:00'}))
+        assert_that(
+            pool.metadata('b.mp4', ('CreateDate',)),
+            is_({'CreateDate': '2014:02:02 19:30:00'}))
+
+        assert_that(process_factory.call_count, is_(1))
+        process.execute.assert_called_with(
+            '-json', '-CreateDate', 'b.mp4')
+
+        pool.close()
+        process.close.assert_called_with()
+
+    @mock.patch('calbum.sources.exiftool.ExifToolProcess')
+    def test_metadata_of_a_file_without_tags(self, process_factory):
+        process_factory.return_value.execute.return_value = (
+            b'[{"SourceFile": "a.mp4"}]')
+        pool = exiftool.ExifToolPool()
+
+        assert_that(pool.metadata('a.mp4', ('CreateDate',)), is_({}))
+
+    @mock.patch('calbum.sources.exiftool.ExifToolProcess')
+    def test_metadata_discards_a_failed_process(self, process_factory):
+        process = process_factory.return_value
+        process.execute.side_effect = exiftool.ExifToolError()
+        pool = exiftool.ExifToolPool()
+
+        self.assertRaises(
+            exiftool.ExifToolError, pool.metadata, 'a.mp4', ('CreateDate',))
+        process.close.assert_called_with()
+
+        process.execute.side_effect = None
+        process.execute.return_value = b''
+        assert_that(pool.metadata('a.mp4', ('CreateDate',)), is_({}))
+        assert_that(process_factory.call_count, is_(2))
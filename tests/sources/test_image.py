@@ -18,8 +18,10 @@ import unittest
 
 from dateutil import tz
 from hamcrest import assert_that, is_
-from calbum.core.model import TimeLine
+import mock
+from calbum.core.model import MediaFactory, TimeLine
 
+from calbum.sources.exifheader import ExifHeaderError
 from calbum.sources.image import JpegPicture
 from tests import resources
 
@@ -30,6 +32,73 @@ class TestExifPicture(unittest.TestCase):
             JpegPicture(resources.file_path('image-01.jpeg')).timestamp(),
             is_(datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())))
 
+    @mock.patch('mmap.mmap')
+    def test_exif_from_sniffed_header(self, mmap):
+        _, inbox_path = resources.copytree()
+        path = os.path.join(inbox_path, 'image-01')
+        os.rename(os.path.join(inbox_path, 'image-01.jpeg'), path)
+        factory = MediaFactory(JpegPicture)
+        factory.sniff = True
+
+        picture = factory(path)
+
+        assert_that(
+            picture.timestamp(),
+            is_(datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())))
+        assert_that(mmap.called, is_(False))
+        assert_that(picture.header, is_(None))
+
+    def test_exif_is_discarded_once_the_timestamp_is_known(self):
+        picture = JpegPicture(resources.file_path('image-01.jpeg'))
+
+        picture.timestamp()
+
+        assert_that(hasattr(picture, '_exif'), is_(False))
+
+    @mock.patch('calbum.sources.exifheader.read_tags')
+    def test_exif_with_fraction_of_second(self, read_tags):
+        read_tags.return_value = {
+            'Image DateTime': '2012:05:01 01:00:09',
+            'EXIF DateTimeOriginal': '2012:05:01 01:00:00',
+            'EXIF SubSecTime': '99',
+            'EXIF SubSecTimeOriginal': '25',
+        }
+
+        assert_that(
+            JpegPicture('IMG_0001.jpeg').timestamp(),
+            is_(datetime(2012, 5, 1, 1, 0, 9, 990000, tzinfo=tz.gettz())))
+
+    def test_exif_falls_back_to_exifread(self):
+        with mock.patch('calbum.sources.exifheader.read_tags',
+                        side_effect=ExifHeaderError()):
+            assert_that(
+                JpegPicture(resources.file_path('image-01.jpeg')).timestamp(),
+                is_(datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())))
+
+    @mock.patch('calbum.sources.exifheader.read_tags')
+    def test_exif_with_non_ascii_value(self, read_tags):
+        read_tags.return_value = {
+            'Image DateTime': u'2012:05:01 01:00\ufffd09',
+            'EXIF DateTimeOriginal': '2012:05:01 01:00:00',
+        }
+
+        assert_that(
+            JpegPicture('IMG_0001.jpeg').timestamp(),
+            is_(datetime(2012, 5, 1, 1, 0, 0, tzinfo=tz.gettz())))
+
+    @mock.patch('exifread.process_file')
+    def test_exifread_with_non_ascii_value(self, process_file):
+        process_file.return_value = {
+            'EXIF DateTimeOriginal': '2012:05:01 01:00\xe900',
+        }
+        with mock.patch('calbum.sources.exifheader.read_tags',
+                        side_effect=ExifHeaderError()):
+            picture = JpegPicture(resources.file_path('IMG_20130302_070000.jpeg'))
+
+            assert_that(
+                picture.timestamp(),
+                is_(datetime(2013, 3, 2, 7, 0, 0, tzinfo=tz.gettz())))
+
 
 class TestExifTimeLine(unittest.TestCase):
     def test_timeline_organize_pictures(self):
@@ -0,0 +1,178 @@
+# Copyright 2015 Jonathan Provost.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from dateutil import tz
+from hamcrest import assert_that, is_
+import mock
+
+from calbum.sources import isobmff
+from tests import resources
+from tests.sources.test_exifheader import big_endian_tiff
+
+
+def box(box_type, *payload):
+    content = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(content), box_type) + content
+
+
+def header(box_type, seconds, version=0):
+    if version == 1:
+        times = struct.pack('>QQ', seconds, seconds)
+    else:
+        times = struct.pack('>II', seconds, seconds)
+    return box(box_type, struct.pack('>B3x', version), times, b'\x00' * 16)
+
+
+def seconds_since_1904(d):
+    return int((d - datetime(1904, 1, 1)).total_seconds())
+
+
+def heic(exif):
+    """
+    Build a HEIF file with an Exif item located after the meta box.
+    """
+    infe = box(b'infe', struct.pack('>B3xHH4s', 2, 1, 0, b'Exif'))
+    iinf = box(b'iinf', struct.pack('>4xH', 1), infe)
+
+    def meta(offset):
+        iloc = box(b'iloc', struct.pack('>4xBBH', 0x44, 0x00, 1),
+                   struct.pack('>HHHII', 1, 0, 1, offset, len(exif)))
+        return box(b'meta', b'\x00' * 4, iinf, iloc)
+
+    ftyp = box(b'ftyp', b'heic\x00\x00\x00\x00mif1heic')
+    offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(offset) + box(b'mdat', exif)
+
+
+class TestReadTags(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_mp4_creation_times(self):
+        assert_that(
+            isobmff.read_tags(resources.file_path('video-01.mp4')),
+            is_({
+                'CreateDate': '2014:01:01 19:30:00',
+                'TrackCreateDate': '2014:01:01 19:30:00',
+                'MediaCreateDate': '2014:01:01 19:30:00',
+            }))
+
+    def test_quicktime_creation_date_with_64_bit_headers(self):
+        seconds = seconds_since_1904(datetime(2016, 7, 1, 12, 30))
+        path = self.write('movie.mov', (
+            box(b'wide') +
+            box(b'mdat', b'\x00' * 128) +
+            box(b'moov',
+                header(b'mvhd', seconds, version=1),
+                box(b'trak',
+                    header(b'tkhd', 0),
+                    box(b'mdia', header(b'mdhd', seconds, version=1))),
+                box(b'meta',
+                    box(b'hdlr', b'\x00' * 24),
+                    box(b'keys', struct.pack('>4xI', 1), box(
+                        b'mdta', b'com.apple.quicktime.creationdate')),
+                    box(b'ilst', box(
+                        struct.pack('>I', 1),
+                        box(b'data', struct.pack('>II', 1, 0),
+                            b'2016-07-01T14:30:00+0200')))))))
+
+        assert_that(isobmff.read_tags(path), is_({
+            'CreationDate': u'2016-07-01T14:30:00+0200',
+            'CreateDate': '2016:07:01 12:30:00',
+            'MediaCreateDate': '2016:07:01 12:30:00',
+        }))
+
+    def test_heic_exif_item(self):
+        path = self.write('image.heic', heic(
+            struct.pack('>I', 6) + b'Exif\x00\x00' + big_endian_tiff(
+                b'2017:01:02 03:04:05\x00', b'2017:01:02 03:04:00\x00')))
+
+        assert_that(isobmff.read_tags(path), is_({
+            'ModifyDate': '2017:01:02 03:04:05',
+            'DateTimeOriginal': '2017:01:02 03:04:00',
+        }))
+
+    def test_unknown_format(self):
+        self.assertRaises(
+            isobmff.IsoBoxError,
+            isobmff.read_tags, resources.file_path('image-01.jpeg'))
+
+    def test_truncated_box(self):
+        content = box(b'ftyp', b'mp42') + box(b'moov', header(b'mvhd', 1))
+
+        self.assertRaises(
+            isobmff.IsoBoxError,
+            isobmff.read_tags, self.write('video.mp4', content[:-20]))
+
+
+    def test_invalid_64_bit_creation_time(self):
+        content = box(b'ftyp', b'mp42') + box(
+            b'moov', header(b'mvhd', 2 ** 64 - 1, version=1))
+
+        self.assertRaises(
+            isobmff.IsoBoxError,
+            isobmff.read_tags, self.write('video.mp4', content))
+
+
+class TestIsoMedia(unittest.TestCase):
+
+    def test_mp4_timestamp(self):
+        with mock.patch('calbum.sources.exiftool.ExifToolMedia.pool') as pool:
+            assert_that(
+                isobmff.VideoMP4Media(
+                    resources.file_path('video-01.mp4')).timestamp(),
+                is_(datetime(2014, 1, 1, 19, 30, 0, tzinfo=tz.gettz())))
+            assert_that(pool.metadata.called, is_(False))
+
+    def test_3gp_timestamp(self):
+        assert_that(
+            isobmff.Video3GPMedia(
+                resources.file_path('video-02.3gp')).timestamp(),
+            is_(datetime(2014, 2, 2, 19, 30, 0, tzinfo=tz.gettz())))
+
+    @mock.patch('calbum.sources.isobmff.read_tags')
+    def test_unix_epoch_time_is_patched(self, read_tags):
+        read_tags.return_value = {'CreateDate': '1948:01:01 19:30:00'}
+
+        assert_that(
+            isobmff.VideoMP4Media('video.mp4').timestamp(),
+            is_(datetime(2014, 1, 1, 19, 30, 0, tzinfo=tz.gettz())))
+
+    @mock.patch('calbum.sources.isobmff.read_tags')
+    @mock.patch('calbum.sources.exiftool.ExifToolMedia.pool')
+    def test_exiftool_is_used_when_the_boxes_are_invalid(
+            self, pool, read_tags):
+        read_tags.side_effect = isobmff.IsoBoxError()
+        pool.metadata.return_value = {'CreateDate': '2014:01:01 19:30:00'}
+
+        assert_that(
+            isobmff.VideoMOVMedia('video.mov').timestamp(),
+            is_(datetime(2014, 1, 1, 19, 30, 0, tzinfo=tz.gettz())))
@@ -13,12 +13,16 @@
 # limitations under the License.
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from hamcrest import assert_that, is_
+import mock
 
 from calbum import cmd
-from calbum.core.model import MediaCollection
+from calbum.core import watch
+from calbum.core.model import Media, MediaCollection
 from tests import resources
 
 
@@ -30,12 +34,16 @@ class TestMain(unittest.TestCase):
         album_path = os.path.join(repo_path, 'album')
 
         os.chdir(repo_path)
+        resolved_timestamps = Media.resolved_timestamps
         cmd.main([
             '--inbox', inbox_path,
             '--calendar', 'https://raw.githubusercontent.com/JoProvost/calbum/master/tests/resources/calendar.ics',
             '--save-events'
         ])
 
+        assert_that(Media.resolved_timestamps - resolved_timestamps,
+                    is_(len(resources.files)))
+
         timeline = MediaCollection(timeline_path)
         pictures = list(timeline)
 
@@ -114,3 +122,103 @@ class TestMain(unittest.TestCase):
                 os.path.exists(os.path.join(inbox_path, name)),
                 is_(True),
                 'File is absent from inbox: {}'.format(name))
+
+    def test_main_watching(self):
+        repo_path = tempfile.mkdtemp()
+        inbox_path = os.path.join(repo_path, 'inbox')
+        timeline_path = os.path.join(repo_path, 'timeline')
+        os.mkdir(inbox_path)
+        shutil.copy(resources.file_path('image-01.jpeg'), inbox_path)
+        dropped = ['image-03.tif', 'image-04.jpeg']
+        ready = []
+
+        def drop_files(watcher):
+            # Files are dropped one after another, each once the previous
+            # one was moved
+            for name in dropped:
+                shutil.copy(resources.file_path(name), inbox_path)
+                for path in watcher.poll(5):
+                    ready.append(path)
+                    yield path
+
+        try:
+            with mock.patch.object(watch.InboxWatcher, '__iter__',
+                                   drop_files):
+                cmd.main([
+                    '--inbox', inbox_path,
+                    '--timeline', timeline_path,
+                    '--watch',
+                ])
+
+            assert_that(ready, is_(
+                [os.path.join(inbox_path, name) for name in dropped]))
+            assert_that(os.listdir(inbox_path), is_([]))
+            for name in ['image-01.jpeg'] + dropped:
+                assert_that(
+                    os.path.exists(os.path.join(
+                        timeline_path, resources.files[name]['expected_path'])),
+                    is_(True),
+                    'File is missing: {}'.format(name))
+        finally:
+            shutil.rmtree(repo_path)
+
+    def test_main_dry_run_leaves_the_timeline_untouched(self):
+        repo_path = tempfile.mkdtemp()
+        inbox_path = os.path.join(repo_path, 'inbox')
+        timeline_path = os.path.join(repo_path, 'timeline')
+        plan_path = os.path.join(repo_path, 'plan.json')
+        os.mkdir(inbox_path)
+        os.mkdir(timeline_path)
+        shutil.copy(resources.file_path('image-01.jpeg'), inbox_path)
+        try:
+            cmd.main([
+                '--inbox', inbox_path,
+                '--timeline', timeline_path,
+                '--metadata-cache',
+                '--skip-duplicates',
+                '--dry-run', plan_path,
+            ])
+
+            assert_that(os.path.exists(plan_path), is_(True))
+            assert_that(os.listdir(inbox_path), is_(['image-01.jpeg']))
+            assert_that(os.listdir(timeline_path), is_([]))
+        finally:
+            shutil.rmtree(repo_path)
+
+    def test_main_library_is_kept_up_to_date(self):
+        repo_path = tempfile.mkdtemp()
+        inbox_path = os.path.join(repo_path, 'inbox')
+        timeline_path = os.path.join(repo_path, 'timeline')
+        os.mkdir(inbox_path)
+
+        def run(*arguments):
+            cmd.main(['--inbox', inbox_path,
+                      '--timeline', timeline_path] + list(arguments))
+
+        def drop_picture(mtime):
+            path = os.path.join(inbox_path, 'noexif.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'\xff\xd8\xff\xd9')
+            os.utime(path, (mtime, mtime))
+
+        def timeline_files():
+            return sorted(
+                os.path.relpath(os.path.join(root, name), timeline_path)
+                for root, dirs, names in os.walk(timeline_path)
+                if '.calbum' not in root.split(os.sep)
+                for name in names)
+
+        try:
+            shutil.copy(resources.file_path('image-01.jpeg'), inbox_path)
+            run('--skip-duplicates')
+            drop_picture(1357041600)  # 2013-01-01
+            run()
+            imported = timeline_files()
+            drop_picture(1388577600)  # 2014-01-01
+            run('--skip-duplicates')
+
+            assert_that(len(imported), is_(2))
+            assert_that(timeline_files(), is_(imported))
+            assert_that(os.listdir(inbox_path), is_([]))
+        finally:
+            shutil.rmtree(repo_path)